@@ -0,0 +1,277 @@
+"""
+Vectorized sales analytics: week-over-week, hour-of-day heatmap, basket sizes
+
+The heatmap and basket reports share one load of a date range. MongoDB
+projects each completed transaction down to four numbers (ANALYTICS_ROW:
+epoch ms, total, units, lines). Each cursor batch becomes NumPy arrays via
+np.fromiter, so no per-transaction dicts or datetimes are built in Python.
+Each report is then a few bincount group-bys over TransactionColumns.
+Week-over-week needs only daily totals, which it reads from daily_rollups.
+
+The *_loop functions are the plain per-dict versions of the same reports. They
+are the reference for `python cli.py benchmark-analytics`, which checks that
+both give identical results.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+MS_PER_QUARTER_HOUR = 900_000
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MS = timedelta(milliseconds=1)
+# 1970-01-01 was a Thursday; shifts day numbers so Monday is weekday 0
+EPOCH_WEEKDAY_SHIFT = 3
+# Baskets of this many units or more share the last bucket
+BASKET_SIZE_CAP = 10
+WEEKDAYS = ["Senin", "Selasa", "Rabu", "Kamis", "Jumat", "Sabtu", "Minggu"]
+
+# $project stage turning a transaction into the row ColumnBuilder reads
+ANALYTICS_ROW = {
+    "_id": 0,
+    "ms": {"$toLong": "$created_at"},
+    "total": 1,
+    "units": {"$sum": "$items.qty"},
+    "lines": {"$size": "$items"},
+}
+
+
+@dataclass
+class TransactionColumns:
+    """Completed transactions of a date range, one array entry per transaction"""
+    local_ms: np.ndarray  # int64, wall-clock time in the tenant's timezone, ms since epoch
+    total: np.ndarray     # int64
+    units: np.ndarray     # int64, items per basket (sum of qty)
+    lines: np.ndarray     # int64, line items per basket
+
+    def __len__(self) -> int:
+        return len(self.total)
+
+
+def to_local_ms(utc_ms: np.ndarray, tz: ZoneInfo) -> np.ndarray:
+    """Shift UTC epoch ms to local wall-clock ms.
+    
+    The offset is looked up once per distinct quarter hour: offsets and DST
+    transitions fall on 15-minute boundaries in every IANA zone in use.
+    """
+    quarters, inverse = np.unique(utc_ms // MS_PER_QUARTER_HOUR, return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(int(quarter) * 900, tz).utcoffset() // ONE_MS for quarter in quarters
+    ], dtype=np.int64)
+    return utc_ms + offsets[inverse.reshape(-1)]
+
+
+def project_row(t: dict) -> dict:
+    """ANALYTICS_ROW computed in Python (for synthetic data in the benchmark)"""
+    return {
+        "ms": (t["created_at"] - EPOCH) // ONE_MS,
+        "total": t["total"],
+        "units": sum(item["qty"] for item in t["items"]),
+        "lines": len(t["items"]),
+    }
+
+
+class ColumnBuilder:
+    """Turn batches of ANALYTICS_ROW rows (e.g. from an async cursor) into TransactionColumns"""
+
+    def __init__(self, tz: ZoneInfo):
+        self.tz = tz
+        self._batches = {field: [] for field in ("ms", "total", "units", "lines")}
+
+    def add_batch(self, rows: List[dict]):
+        for field, arrays in self._batches.items():
+            arrays.append(np.fromiter((row[field] for row in rows), dtype=np.int64, count=len(rows)))
+
+    def _column(self, field: str) -> np.ndarray:
+        arrays = self._batches[field]
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+
+    def build(self) -> TransactionColumns:
+        return TransactionColumns(
+            local_ms=to_local_ms(self._column("ms"), self.tz),
+            total=self._column("total"),
+            units=self._column("units"),
+            lines=self._column("lines"),
+        )
+
+
+def build_columns(rows: List[dict], tz: ZoneInfo, batch_size: int = 1000) -> TransactionColumns:
+    builder = ColumnBuilder(tz)
+    for start in range(0, len(rows), batch_size):
+        builder.add_batch(rows[start:start + batch_size])
+    return builder.build()
+
+
+def week_start(day: date) -> date:
+    """Monday of the week containing `day`"""
+    return day - timedelta(days=day.weekday())
+
+
+def _change_pct(current: int, previous: int) -> Optional[float]:
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+
+def _week_rows(first_monday: date, sales: List[int], counts: List[int]) -> List[dict]:
+    rows = []
+    for week, (amount, transactions) in enumerate(zip(sales, counts)):
+        start = first_monday + timedelta(weeks=week)
+        rows.append({
+            "week_start": start.isoformat(),
+            "week_end": (start + timedelta(days=6)).isoformat(),
+            "total_sales": amount,
+            "total_transactions": transactions,
+            "average_transaction": round(amount / transactions, 2) if transactions else 0,
+            "sales_change_pct": _change_pct(amount, sales[week - 1]) if week else None,
+            "transactions_change_pct": _change_pct(transactions, counts[week - 1]) if week else None,
+        })
+    return rows
+
+
+def _bincount_int(index: np.ndarray, weights: np.ndarray, size: int) -> np.ndarray:
+    """Integer sums per bucket (bincount sums weights as float64; exact below 2**53)"""
+    return np.rint(np.bincount(index, weights=weights, minlength=size)).astype(np.int64)
+
+
+def week_over_week(rollups: Iterable[dict], first_monday: date, weeks: int) -> List[dict]:
+    """Sales and transaction counts per business week (Monday start), with change vs the week before.
+    
+    Reads daily_rollups documents, so the cost is one row per day, not per transaction.
+    """
+    sales = [0] * weeks
+    counts = [0] * weeks
+    for rollup in rollups:
+        week = (date.fromisoformat(rollup["business_date"]) - first_monday).days // 7
+        if 0 <= week < weeks:
+            sales[week] += rollup.get("total_sales", 0)
+            counts[week] += rollup.get("total_transactions", 0)
+    return _week_rows(first_monday, sales, counts)
+
+
+def _heatmap_result(sales: List[List[int]], counts: List[List[int]]) -> dict:
+    busiest = None
+    peak = max((count, -weekday, -hour) for weekday, row in enumerate(counts) for hour, count in enumerate(row))
+    if peak[0]:
+        weekday, hour = -peak[1], -peak[2]
+        busiest = {"weekday": WEEKDAYS[weekday], "hour": hour, "transactions": peak[0], "sales": sales[weekday][hour]}
+    return {
+        "weekdays": WEEKDAYS,
+        "hours": list(range(24)),
+        "sales": sales,
+        "transactions": counts,
+        "busiest": busiest,
+    }
+
+
+def hourly_heatmap(cols: TransactionColumns) -> dict:
+    """7 x 24 grid (weekday x local hour) of sales and transaction counts"""
+    weekday = (cols.local_ms // MS_PER_DAY + EPOCH_WEEKDAY_SHIFT) % 7
+    hour = (cols.local_ms // MS_PER_HOUR) % 24
+    cell = weekday * 24 + hour
+    sales = _bincount_int(cell, cols.total, 7 * 24).reshape(7, 24)
+    counts = np.bincount(cell, minlength=7 * 24).reshape(7, 24)
+    return _heatmap_result(sales.tolist(), counts.tolist())
+
+
+def _basket_result(
+    counts: List[int],
+    sales: List[int],
+    average_units: float,
+    median_units: float,
+    p90_units: float,
+    average_lines: float,
+) -> dict:
+    total = sum(counts)
+    distribution = []
+    for size, (transactions, amount) in enumerate(zip(counts, sales), start=1):
+        distribution.append({
+            "size": f"{size}+" if size == BASKET_SIZE_CAP else str(size),
+            "transactions": transactions,
+            "share_pct": round(transactions / total * 100, 1) if total else 0,
+            "average_total": round(amount / transactions, 2) if transactions else 0,
+        })
+    return {
+        "total_transactions": total,
+        "average_units": round(average_units, 2),
+        "median_units": round(median_units, 2),
+        "p90_units": round(p90_units, 2),
+        "average_lines": round(average_lines, 2),
+        "distribution": distribution,
+    }
+
+
+def basket_sizes(cols: TransactionColumns) -> dict:
+    """Distribution of units per basket, with average basket value per size"""
+    if not len(cols):
+        return _basket_result([0] * BASKET_SIZE_CAP, [0] * BASKET_SIZE_CAP, 0, 0, 0, 0)
+    size = np.clip(cols.units, 1, BASKET_SIZE_CAP)
+    counts = np.bincount(size, minlength=BASKET_SIZE_CAP + 1)[1:]
+    sales = _bincount_int(size, cols.total, BASKET_SIZE_CAP + 1)[1:]
+    return _basket_result(
+        counts.tolist(),
+        sales.tolist(),
+        float(cols.units.mean()),
+        float(np.percentile(cols.units, 50)),
+        float(np.percentile(cols.units, 90)),
+        float(cols.lines.mean()),
+    )
+
+
+# ============== Reference loop implementations ==============
+
+def week_over_week_loop(transactions: List[dict], first_monday: date, weeks: int) -> List[dict]:
+    sales = [0] * weeks
+    counts = [0] * weeks
+    for t in transactions:
+        week = (date.fromisoformat(t["business_date"]) - first_monday).days // 7
+        if 0 <= week < weeks:
+            sales[week] += t["total"]
+            counts[week] += 1
+    return _week_rows(first_monday, sales, counts)
+
+
+def hourly_heatmap_loop(transactions: List[dict], tz: ZoneInfo) -> dict:
+    sales = [[0] * 24 for _ in range(7)]
+    counts = [[0] * 24 for _ in range(7)]
+    for t in transactions:
+        local = t["created_at"].astimezone(tz)
+        sales[local.weekday()][local.hour] += t["total"]
+        counts[local.weekday()][local.hour] += 1
+    return _heatmap_result(sales, counts)
+
+
+def _percentile(sorted_values: List[int], pct: float) -> float:
+    """Linear interpolation between closest ranks (NumPy's default method)"""
+    position = (len(sorted_values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def basket_sizes_loop(transactions: List[dict]) -> dict:
+    if not transactions:
+        return _basket_result([0] * BASKET_SIZE_CAP, [0] * BASKET_SIZE_CAP, 0, 0, 0, 0)
+    counts = [0] * BASKET_SIZE_CAP
+    sales = [0] * BASKET_SIZE_CAP
+    units = []
+    lines = 0
+    for t in transactions:
+        basket = sum(item["qty"] for item in t["items"])
+        size = min(max(basket, 1), BASKET_SIZE_CAP)
+        counts[size - 1] += 1
+        sales[size - 1] += t["total"]
+        units.append(basket)
+        lines += len(t["items"])
+    units.sort()
+    return _basket_result(
+        counts,
+        sales,
+        sum(units) / len(units),
+        _percentile(units, 50),
+        _percentile(units, 90),
+        lines / len(transactions),
+    )
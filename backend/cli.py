@@ -0,0 +1,410 @@
+"""
+AIKasir maintenance commands
+
+Usage (from /app/backend, with the same .env as the server):
+    python cli.py ensure-indexes
+    python cli.py check-indexes
+    python cli.py migrate-dates
+    python cli.py rebuild-rollups [--tenant-id ID] [--start-date YYYY-MM-DD] [--end-date YYYY-MM-DD]
+    python cli.py benchmark-analytics [--transactions N]
+    python cli.py benchmark-bcrypt [--rounds 10,11,12,13] [--workers N]
+"""
+
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import typer
+from pymongo import UpdateOne
+
+import analytics
+from server import (
+    BCRYPT_ROUNDS,
+    DEFAULT_TIMEZONE,
+    EXPORT_BATCH_SIZE,
+    PASSWORD_HASH_WORKERS,
+    db,
+    ensure_indexes,
+    make_pwd_context,
+    rollup_operations,
+    tenant_timezone,
+    to_business_date,
+)
+
+cli = typer.Typer(help="AIKasir maintenance commands")
+
+SAMPLE_ID = "00000000-0000-0000-0000-000000000000"
+SAMPLE_DAY = "20260101"
+SAMPLE_DATE = "2026-01-01"
+SAMPLE_CREATED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# (collection, filter, sort) for every query the routes run, with placeholder values
+QUERY_SHAPES = [
+    # Auth & users
+    ("users", {"id": SAMPLE_ID}, None),
+    ("users", {"email": "owner@test.com"}, None),
+    ("users", {"invite_token": SAMPLE_ID}, None),
+    ("users", {"tenant_id": SAMPLE_ID}, [("created_at", -1)]),
+    ("users", {"token_revoked_at": {"$gte": SAMPLE_CREATED_AT}}, None),
+    ("refresh_tokens", {"family": SAMPLE_ID}, None),
+    # Tenants
+    ("tenants", {"id": SAMPLE_ID}, None),
+    ("tenants", {"subdomain": "kopibangjago"}, None),
+    ("tenants", {"group_id": SAMPLE_ID}, [("name", 1)]),
+    # Items & stock
+    ("items", {"tenant_id": SAMPLE_ID, "is_active": True}, [("name", 1)]),
+    ("items", {"tenant_id": SAMPLE_ID, "is_active": True, "name": {"$regex": "kopi", "$options": "i"}}, [("name", 1)]),
+    ("items", {"tenant_id": SAMPLE_ID}, [("name", 1)]),
+    ("items", {"id": SAMPLE_ID, "tenant_id": SAMPLE_ID}, None),
+    ("items", {"id": {"$in": [SAMPLE_ID]}, "tenant_id": SAMPLE_ID}, None),
+    ("items", {"tenant_id": SAMPLE_ID, "is_active": True, "track_stock": True}, [("name", 1)]),
+    ("stock_adjustments", {"item_id": SAMPLE_ID, "tenant_id": SAMPLE_ID}, [("created_at", -1)]),
+    ("stock_adjustments", {"transaction_id": SAMPLE_ID}, None),
+    ("stock_adjustments", {"transaction_id": SAMPLE_ID, "adjustment_type": "void_return"}, None),
+    # Transactions
+    ("transactions", {"tenant_id": SAMPLE_ID}, [("created_at", -1), ("id", -1)]),
+    ("transactions", {"tenant_id": SAMPLE_ID, "$or": [
+        {"created_at": {"$lt": SAMPLE_CREATED_AT}},
+        {"created_at": SAMPLE_CREATED_AT, "id": {"$lt": SAMPLE_ID}}
+    ]}, [("created_at", -1), ("id", -1)]),
+    ("transactions", {"tenant_id": SAMPLE_ID, "transaction_number": {"$gte": SAMPLE_DAY, "$lt": f"{SAMPLE_DAY}~"}}, [("transaction_number", -1)]),
+    ("transactions", {"tenant_id": SAMPLE_ID, "business_date": SAMPLE_DATE}, [("created_at", -1), ("id", -1)]),
+    ("transactions", {"tenant_id": SAMPLE_ID, "business_date": SAMPLE_DATE, "status": "selesai"}, None),
+    ("transactions", {"tenant_id": SAMPLE_ID, "business_date": {"$gte": SAMPLE_DATE, "$lte": SAMPLE_DATE}, "status": "selesai"}, None),
+    ("transactions", {"tenant_id": SAMPLE_ID, "business_date": {"$gte": SAMPLE_DATE, "$lte": SAMPLE_DATE}}, [("created_at", 1)]),
+    ("transactions", {"id": SAMPLE_ID, "tenant_id": SAMPLE_ID}, None),
+    ("transactions", {"id": {"$in": [SAMPLE_ID]}}, None),
+    ("transactions", {"tenant_id": SAMPLE_ID, "client_id": {"$in": ["outlet-1"], "$type": "string"}}, None),
+    ("transactions", {"tenant_id": SAMPLE_ID, "idempotency_key": "key-1"}, None),
+    # AI onboarding
+    ("ai_sessions", {"id": SAMPLE_ID}, None),
+    ("ai_messages", {"session_id": SAMPLE_ID}, [("created_at", 1)]),
+    # Export jobs
+    ("export_jobs", {"id": SAMPLE_ID, "tenant_id": SAMPLE_ID}, None),
+    ("export_jobs", {"tenant_id": SAMPLE_ID}, [("created_at", -1)]),
+    ("export_jobs", {"status": "queued", "created_at": {"$lt": SAMPLE_CREATED_AT}}, None),
+    ("export_jobs", {"status": "running", "lease_expires_at": {"$lt": SAMPLE_CREATED_AT}}, None),
+    # Daily rollups
+    ("daily_rollups", {"tenant_id": SAMPLE_ID, "business_date": {"$gte": SAMPLE_DATE, "$lte": SAMPLE_DATE}}, None),
+    ("daily_rollups", {"tenant_id": {"$in": [SAMPLE_ID]}, "business_date": SAMPLE_DATE}, None),
+    ("daily_rollups", {"tenant_id": {"$in": [SAMPLE_ID]}, "business_date": {"$gte": SAMPLE_DATE, "$lte": SAMPLE_DATE}}, None),
+]
+
+
+def find_stages(plan) -> list:
+    """Collect every stage name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(find_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(find_stages(value))
+    return stages
+
+
+async def explain_query_shapes() -> list:
+    results = []
+    for collection, query, sort in QUERY_SHAPES:
+        command = {"find": collection, "filter": query}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = await db.command("explain", command, verbosity="queryPlanner")
+        stages = find_stages(explain["queryPlanner"]["winningPlan"])
+        results.append((collection, query, sort, stages))
+    return results
+
+
+def parse_stored_datetime(value) -> Optional[datetime]:
+    """Parse a legacy ISO string timestamp (naive strings are UTC)"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def migrate_collection_dates(collection: str, query: dict, build_update, batch_size: int) -> int:
+    """Rewrite matching documents with bulk updates built by build_update(doc)"""
+    migrated = 0
+    ops = []
+    async for doc in db[collection].find(query):
+        update = build_update(doc)
+        if update:
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(ops) >= batch_size:
+            await db[collection].bulk_write(ops, ordered=False)
+            migrated += len(ops)
+            ops = []
+    if ops:
+        await db[collection].bulk_write(ops, ordered=False)
+        migrated += len(ops)
+    return migrated
+
+
+async def migrate_dates(batch_size: int) -> dict:
+    timezones = {
+        tenant["id"]: tenant_timezone(tenant)
+        async for tenant in db.tenants.find({}, {"_id": 0, "id": 1, "timezone": 1})
+    }
+
+    def transaction_update(doc):
+        update = {}
+        created_at = parse_stored_datetime(doc.get("created_at"))
+        if created_at:
+            update["created_at"] = created_at
+            tz = timezones.get(doc.get("tenant_id")) or tenant_timezone(None)
+            update["business_date"] = to_business_date(created_at, tz)
+        else:
+            # No usable timestamp: fall back to the day in the transaction number
+            number = doc.get("transaction_number", "")
+            update["business_date"] = f"{number[:4]}-{number[4:6]}-{number[6:8]}"
+        voided_at = parse_stored_datetime(doc.get("voided_at"))
+        if voided_at:
+            update["voided_at"] = voided_at
+        return update
+
+    def created_at_update(doc):
+        created_at = parse_stored_datetime(doc.get("created_at"))
+        return {"created_at": created_at} if created_at else None
+
+    return {
+        "transactions": await migrate_collection_dates("transactions", {"$or": [
+            {"created_at": {"$type": "string"}},
+            {"voided_at": {"$type": "string"}},
+            {"business_date": {"$exists": False}}
+        ]}, transaction_update, batch_size),
+        "stock_adjustments": await migrate_collection_dates(
+            "stock_adjustments", {"created_at": {"$type": "string"}}, created_at_update, batch_size
+        ),
+        "ai_messages": await migrate_collection_dates(
+            "ai_messages", {"created_at": {"$type": "string"}}, created_at_update, batch_size
+        ),
+    }
+
+
+async def rebuild_rollups(
+    tenant_id: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    batch_size: int
+) -> int:
+    """Recompute daily_rollups from completed transactions, streaming in batches"""
+    scope = {}
+    if tenant_id:
+        scope["tenant_id"] = tenant_id
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = start_date
+    if end_date:
+        date_range["$lte"] = end_date
+    if date_range:
+        scope["business_date"] = date_range
+
+    # Rebuilt docs continue past the old revisions, so live dashboards replace their copies
+    revisions = {row["_id"]: row.get("revision", 0) async for row in db.daily_rollups.find(scope, {"_id": 1, "revision": 1})}
+    await db.daily_rollups.delete_many(scope)
+
+    query = {"business_date": {"$exists": True}, **scope, "status": "selesai"}
+    projection = {"_id": 0, "tenant_id": 1, "business_date": 1, "total": 1, "payment_method": 1, "items": 1}
+    pending = {}
+    pending_count = 0
+    rebuilt = 0
+
+    async def flush():
+        for pending_tenant, transactions in pending.items():
+            await db.daily_rollups.bulk_write(rollup_operations(pending_tenant, transactions), ordered=False)
+        pending.clear()
+
+    async for transaction in db.transactions.find(query, projection):
+        pending.setdefault(transaction["tenant_id"], []).append(transaction)
+        pending_count += 1
+        rebuilt += 1
+        if pending_count >= batch_size:
+            await flush()
+            pending_count = 0
+    await flush()
+    if revisions:
+        await db.daily_rollups.bulk_write([
+            UpdateOne({"_id": rollup_id}, {"$max": {"revision": revision + 1}})
+            for rollup_id, revision in revisions.items()
+        ], ordered=False)
+    return rebuilt
+
+
+def synthetic_transactions(count: int, days: int, item_count: int, tz: ZoneInfo, seed: int = 42) -> list:
+    """Random completed transactions shaped like the stored documents"""
+    rng = random.Random(seed)
+    catalog = [(f"item-{i}", f"Barang {i}", rng.randrange(2000, 50000, 500)) for i in range(item_count)]
+    start = datetime(2026, 1, 5, tzinfo=timezone.utc)
+    transactions = []
+    for _ in range(count):
+        created_at = start + timedelta(seconds=rng.randrange(days * 86400))
+        lines = []
+        for item_id, name, price in rng.sample(catalog, rng.randint(1, 5)):
+            qty = rng.choice([1, 1, 1, 2, 2, 3, 6])
+            lines.append({"item_id": item_id, "name": name, "qty": qty, "price": price, "subtotal": qty * price})
+        transactions.append({
+            "created_at": created_at,
+            "business_date": to_business_date(created_at, tz),
+            "total": sum(line["subtotal"] for line in lines),
+            "payment_method": rng.choice(["tunai", "tunai", "qris", "transfer"]),
+            "items": lines
+        })
+    return transactions
+
+
+def best_of(repeat: int, fn):
+    """Fastest wall time of `repeat` runs, and the last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+@cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create the full index set (same as the server startup hook)"""
+    asyncio.run(ensure_indexes())
+    typer.echo("Indexes ensured")
+
+
+@cli.command("check-indexes")
+def check_indexes_command():
+    """Explain every route query shape and fail if any is a collection scan"""
+    async def run():
+        await ensure_indexes()
+        return await explain_query_shapes()
+
+    failures = 0
+    for collection, query, sort, stages in asyncio.run(run()):
+        scan = "COLLSCAN" in stages
+        failures += scan
+        status = "❌ COLLSCAN" if scan else "✅"
+        typer.echo(f"{status} {collection} {query} sort={sort} -> {' > '.join(stages)}")
+
+    if failures:
+        typer.echo(f"\n{failures} query shape(s) not covered by an index")
+        raise typer.Exit(code=1)
+    typer.echo(f"\nAll {len(QUERY_SHAPES)} query shapes use an index")
+
+
+@cli.command("migrate-dates")
+def migrate_dates_command(batch_size: int = typer.Option(1000, help="Documents per bulk write")):
+    """One-off: convert ISO string timestamps to BSON dates and fill business_date"""
+    async def run():
+        await ensure_indexes()
+        return await migrate_dates(batch_size)
+
+    for collection, migrated in asyncio.run(run()).items():
+        typer.echo(f"{collection}: {migrated} document(s) migrated")
+
+
+@cli.command("rebuild-rollups")
+def rebuild_rollups_command(
+    tenant_id: Optional[str] = typer.Option(None, help="Only this tenant"),
+    start_date: Optional[str] = typer.Option(None, help="First business day (YYYY-MM-DD)"),
+    end_date: Optional[str] = typer.Option(None, help="Last business day (YYYY-MM-DD)"),
+    batch_size: int = typer.Option(5000, help="Transactions per bulk write")
+):
+    """Recompute daily_rollups from raw transactions (run in a quiet period)"""
+    async def run():
+        await ensure_indexes()
+        return await rebuild_rollups(tenant_id, start_date, end_date, batch_size)
+
+    rebuilt = asyncio.run(run())
+    typer.echo(f"Rollups rebuilt from {rebuilt} transaction(s)")
+
+
+@cli.command("benchmark-analytics")
+def benchmark_analytics_command(
+    transactions: int = typer.Option(200000, help="Synthetic transactions to generate"),
+    weeks: int = typer.Option(8, help="Weeks covered by the data"),
+    items: int = typer.Option(60, help="Catalog size"),
+    repeat: int = typer.Option(3, help="Runs per measurement (best is reported)")
+):
+    """Compare the vectorized analytics reports with the per-dict loop versions (no database needed)"""
+    tz = ZoneInfo(DEFAULT_TIMEZONE)
+    data = synthetic_transactions(transactions, weeks * 7, items, tz)
+    first_monday = analytics.week_start(date.fromisoformat(min(t["business_date"] for t in data)))
+    # One extra week in case the data spills past the last full week
+    span = weeks + 1
+    # What MongoDB hands the server: ANALYTICS_ROW rows and daily_rollups docs
+    rows = [analytics.project_row(t) for t in data]
+    rollups = {}
+    for t in data:
+        day = rollups.setdefault(t["business_date"], {"business_date": t["business_date"], "total_sales": 0, "total_transactions": 0})
+        day["total_sales"] += t["total"]
+        day["total_transactions"] += 1
+    rollups = list(rollups.values())
+
+    def loop_reports():
+        return (
+            analytics.week_over_week_loop(data, first_monday, span),
+            analytics.hourly_heatmap_loop(data, tz),
+            analytics.basket_sizes_loop(data)
+        )
+
+    def vector_reports():
+        # Includes the load: projected rows -> arrays, in cursor-sized batches
+        cols = analytics.build_columns(rows, tz, EXPORT_BATCH_SIZE)
+        return (
+            analytics.week_over_week(rollups, first_monday, span),
+            analytics.hourly_heatmap(cols),
+            analytics.basket_sizes(cols)
+        )
+
+    loop_time, expected = best_of(repeat, loop_reports)
+    vector_time, actual = best_of(repeat, vector_reports)
+
+    if actual != expected:
+        typer.echo("❌ Vectorized results differ from the loop implementation")
+        raise typer.Exit(code=1)
+
+    typer.echo(f"{transactions} transactions, 3 reports (best of {repeat}):")
+    typer.echo(f"  loop over dicts         {loop_time * 1000:9.1f} ms")
+    typer.echo(f"  load + vectorized       {vector_time * 1000:9.1f} ms  ({loop_time / vector_time:.1f}x faster)")
+    typer.echo("✅ Results identical")
+
+
+@cli.command("benchmark-bcrypt")
+def benchmark_bcrypt_command(
+    rounds: str = typer.Option("10,11,12,13", help="Comma-separated bcrypt costs to compare"),
+    workers: int = typer.Option(PASSWORD_HASH_WORKERS, help="Hashing threads (PASSWORD_HASH_WORKERS)"),
+    logins: int = typer.Option(0, help="Verifications per cost (default: 8 per worker, at least 16)")
+):
+    """Login verification throughput per bcrypt cost, to size BCRYPT_ROUNDS and login capacity (no database needed)"""
+    logins = logins or max(16, workers * 8)
+    password = "benchmark-password"
+    typer.echo(f"{logins} logins per cost on {workers} worker thread(s):")
+    typer.echo(f"  {'rounds':>6}  {'verify ms':>9}  {'logins/s':>9}  {'per core':>9}")
+    for cost in sorted(int(value) for value in rounds.split(",")):
+        context = make_pwd_context(cost)
+        hashed = context.hash(password)
+        single, _ = best_of(3, lambda: context.verify(password, hashed))
+        # bcrypt releases the GIL, so threads verify in parallel up to the core count
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            started = time.perf_counter()
+            list(executor.map(lambda _: context.verify(password, hashed), range(logins)))
+            elapsed = time.perf_counter() - started
+        throughput = logins / elapsed
+        current = "  <- BCRYPT_ROUNDS" if cost == BCRYPT_ROUNDS else ""
+        typer.echo(f"  {cost:>6}  {single * 1000:9.1f}  {throughput:9.1f}  {throughput / min(workers, os.cpu_count() or 1):9.1f}{current}")
+    typer.echo("Each extra round doubles the cost; hashes at another cost are redone on the next login.")
+
+
+if __name__ == "__main__":
+    cli()
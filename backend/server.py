@@ -1,37 +1,144 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, status
+from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import io
+import base64
+import csv
+import hashlib
+import time
+import random
+import re
+import tempfile
+import asyncio
 import logging
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 import jwt
+import pyarrow as pa
+import pyarrow.parquet as pq
 from passlib.context import CryptContext
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 import json
 
+from analytics import ANALYTICS_ROW, ColumnBuilder, basket_sizes, hourly_heatmap, week_over_week, week_start
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: BSON dates come back as UTC-aware datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ.get('DB_NAME', 'aikasir_db')]
 
 # JWT Config
 JWT_SECRET = os.environ.get('JWT_SECRET', 'aikasir-secret-key')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+# Access tokens carry the user's claims and are checked without a database read;
+# revoking them (token_version bump) takes effect within the reload interval
+ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', 15))
+REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+TOKEN_REVOCATION_REFRESH_SECONDS = int(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', 10))
+# A rotated refresh token presented again after this long is treated as stolen
+REFRESH_TOKEN_REUSE_GRACE_SECONDS = 30
+
+# Business days are counted in the tenant's timezone
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'Asia/Jakarta')
+
+# Idempotency keys for checkout/void retries
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+# A "processing" claim older than this (crashed worker) can be taken over by a retry
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 60))
+
+# Offline sales sync
+BATCH_SYNC_MAX_SALES = int(os.environ.get('BATCH_SYNC_MAX_SALES', 1000))
+# Save attempts when stock or client_ids change under a batch between validation and write
+BATCH_SYNC_MAX_ATTEMPTS = 3
+
+# In-process caches
+TENANT_CACHE_TTL_SECONDS = int(os.environ.get('TENANT_CACHE_TTL_SECONDS', 300))
+TENANT_CACHE_MAX_SIZE = int(os.environ.get('TENANT_CACHE_MAX_SIZE', 1000))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 30))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.environ.get('PRINCIPAL_CACHE_MAX_SIZE', 10000))
+# History list totals may lag new sales by this long
+TRANSACTION_COUNT_CACHE_TTL_SECONDS = int(os.environ.get('TRANSACTION_COUNT_CACHE_TTL_SECONDS', 30))
+TRANSACTION_PAGE_MAX_SIZE = 200
+REPORT_CACHE_TTL_SECONDS = int(os.environ.get('REPORT_CACHE_TTL_SECONDS', 600))
+REPORT_CACHE_MAX_SIZE = int(os.environ.get('REPORT_CACHE_MAX_SIZE', 2000))
+ANALYTICS_MAX_DAYS = 366
+ANALYTICS_MAX_WEEKS = 52
+
+# Report exports
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Background export jobs: files on local disk, removed after EXPORT_JOB_TTL_HOURS
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', 2))
+EXPORT_JOB_TTL_HOURS = int(os.environ.get('EXPORT_JOB_TTL_HOURS', 24))
+# A running job's owner renews its lease; jobs whose lease ran out are taken over
+EXPORT_JOB_LEASE_SECONDS = int(os.environ.get('EXPORT_JOB_LEASE_SECONDS', 60))
+EXPORT_JOB_MAX_ATTEMPTS = 3
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', ROOT_DIR / 'exports'))
+
+# Live dashboard
+DASHBOARD_TOP_ITEMS = 5
+DASHBOARD_SSE_KEEPALIVE_SECONDS = float(os.environ.get('DASHBOARD_SSE_KEEPALIVE_SECONDS', 15))
+# Sales handled by other workers reach this worker's dashboards within this long
+DASHBOARD_SYNC_SECONDS = float(os.environ.get('DASHBOARD_SYNC_SECONDS', 2))
+# Tenants whose dashboard was read this recently (or has SSE subscribers) are kept in sync
+DASHBOARD_ACTIVE_SECONDS = 300
+
+# Password hashing: bcrypt runs in a bounded thread pool, off the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+# Requests waiting for a worker beyond this are turned away with 503
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 200))
+# bcrypt work factor (log2 iterations; +1 doubles login CPU). Size it with
+# `python cli.py benchmark-bcrypt`; hashes at any other cost are redone on login.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def make_pwd_context(rounds: int) -> CryptContext:
+    """bcrypt context where hashes at any cost other than `rounds` need an update"""
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+pwd_context = make_pwd_context(BCRYPT_ROUNDS)
 
-# OpenAI Client
-openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+# OpenAI Client (async; retries are done by chat_completion, under the semaphore limit)
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', 30))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+OPENAI_RETRY_BASE_SECONDS = float(os.environ.get('OPENAI_RETRY_BASE_SECONDS', 0.5))
+# Concurrent completions per worker; more callers wait for a slot
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 8))
+openai_client = AsyncOpenAI(
+    api_key=os.environ.get('OPENAI_API_KEY'),
+    # Point at a local fake server in tests
+    base_url=os.environ.get('OPENAI_BASE_URL') or None,
+    timeout=OPENAI_TIMEOUT_SECONDS,
+    max_retries=0
+)
+llm_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+RETRYABLE_OPENAI_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
 
 # Security
 security = HTTPBearer(auto_error=False)
@@ -64,6 +171,8 @@ class Tenant(BaseModel):
     subdomain: str
     address: Optional[str] = None
     phone: Optional[str] = None
+    timezone: str = DEFAULT_TIMEZONE  # IANA name, defines the business day
+    group_id: Optional[str] = None  # Shared by outlets linked by the same owner
     config: TenantConfig = Field(default_factory=TenantConfig)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -80,6 +189,7 @@ class User(BaseModel):
     status: str = "active"  # active, invited, disabled
     invited_by: Optional[str] = None
     invite_token: Optional[str] = None
+    token_version: int = 0  # Bumped to revoke every token issued so far
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -91,6 +201,14 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class OutletLinkRequest(BaseModel):
+    # Login of the other outlet's owner account, as proof of ownership
+    email: str
+    password: str
+
 class UserResponse(BaseModel):
     id: str
     tenant_id: str
@@ -185,12 +303,16 @@ class Transaction(BaseModel):
     change_amount: int
     payment_reference: Optional[str] = None  # Untuk QRIS/Transfer reference
     status: str = "selesai"  # selesai, void
-    voided_at: Optional[str] = None
+    voided_at: Optional[datetime] = None
     voided_by: Optional[str] = None
     void_reason: Optional[str] = None
+    client_id: Optional[str] = None  # Set for sales synced from an offline outlet
+    idempotency_key: Optional[str] = None  # Idempotency-Key of the checkout that created it
+    void_idempotency_key: Optional[str] = None  # Idempotency-Key of the void
     created_by: str
     created_by_name: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    business_date: str  # YYYY-MM-DD in the tenant's timezone
 
 class TransactionCreate(BaseModel):
     items: List[Dict[str, Any]]  # [{"item_id": "...", "qty": 2}]
@@ -201,6 +323,24 @@ class TransactionCreate(BaseModel):
 class TransactionVoid(BaseModel):
     reason: str
 
+class OfflineSale(BaseModel):
+    client_id: str  # Unique per sale on the outlet device, used to skip re-uploads
+    created_at: datetime  # Original time of the sale
+    items: List[Dict[str, Any]]
+    payment_method: str = "tunai"
+    payment_amount: int
+    payment_reference: Optional[str] = None
+
+class TransactionBatch(BaseModel):
+    sales: List[OfflineSale]
+
+# Report Models
+class ExportJobCreate(BaseModel):
+    start_date: str
+    end_date: str
+    format: str = "csv"  # csv, parquet
+    granularity: str = "transaction"  # transaction, item (parquet only)
+
 # AI Onboarding Models
 class AIOnboardMessage(BaseModel):
     message: str
@@ -218,20 +358,342 @@ class AISession(BaseModel):
 
 # ============== HELPER FUNCTIONS ==============
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+class TTLCache:
+    """Small in-process LRU cache with per-entry expiry and hit/miss counters.
+    
+    Values are shared between requests, so callers must treat them as read-only.
+    """
+    def __init__(self, name: str, max_size: int, ttl_seconds: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+tenant_cache = TTLCache("tenants", TENANT_CACHE_MAX_SIZE, TENANT_CACHE_TTL_SECONDS)
+# Authenticated users by id; short TTL so changes made on other workers still apply quickly
+principal_cache = TTLCache("principals", PRINCIPAL_CACHE_MAX_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+# Transaction list totals by tenant and date filter
+transaction_count_cache = TTLCache("transaction_counts", TENANT_CACHE_MAX_SIZE * 10, TRANSACTION_COUNT_CACHE_TTL_SECONDS)
+# Report results, keyed with the tenant's write_version (see bump_tenant_version)
+report_cache = TTLCache("reports", REPORT_CACHE_MAX_SIZE, REPORT_CACHE_TTL_SECONDS)
+CACHES = [tenant_cache, principal_cache, transaction_count_cache, report_cache]
+
+async def bump_tenant_version(tenant_id: str):
+    """Count a write that can change the tenant's reports (tenants.write_version).
+    
+    Stored on the tenant document, so a sale on any worker makes every
+    worker's cached reports for the tenant unreachable.
+    """
+    await db.tenants.update_one({"id": tenant_id}, {"$inc": {"write_version": 1}})
+
+async def get_tenant_write_versions(tenant_ids: List[str]) -> List[int]:
+    """Current write_version of each tenant, in order (read per request, never cached)"""
+    versions = {}
+    async for tenant in db.tenants.find({"id": {"$in": tenant_ids}}, {"_id": 0, "id": 1, "write_version": 1}):
+        versions[tenant["id"]] = tenant.get("write_version", 0)
+    return [versions.get(tenant_id, 0) for tenant_id in tenant_ids]
+
+async def cached_report(tenant_id: str, endpoint: str, params: dict, compute, tenant_ids: Optional[List[str]] = None):
+    """Serve a report from report_cache, computing it with compute() on a miss.
+    
+    The key includes the write_version of the tenant (or of every tenant in
+    tenant_ids, for reports spanning outlets). The versions are read before
+    computing, so a write that lands mid-compute leaves the result under a
+    key that is already stale.
+    """
+    versions = await get_tenant_write_versions(tenant_ids or [tenant_id])
+    key = f"{tenant_id}:{versions}:{endpoint}:{json.dumps(params, sort_keys=True)}"
+    result = report_cache.get(key)
+    if result is None:
+        result = await compute()
+        report_cache.set(key, result)
+    return result
+
+async def get_tenant(tenant_id: str) -> Optional[dict]:
+    """Get tenant document (name/address/phone for receipts), served from the in-process cache"""
+    tenant = tenant_cache.get(tenant_id)
+    if tenant is None:
+        tenant = await db.tenants.find_one({"id": tenant_id}, {"_id": 0, "write_version": 0})
+        if tenant:
+            tenant_cache.set(tenant_id, tenant)
+    return tenant
+
+def tenant_timezone(tenant: Optional[dict]) -> ZoneInfo:
+    """Timezone of a tenant document, falling back to DEFAULT_TIMEZONE"""
+    try:
+        return ZoneInfo((tenant or {}).get("timezone") or DEFAULT_TIMEZONE)
+    except Exception:
+        return ZoneInfo(DEFAULT_TIMEZONE)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def to_business_date(moment: datetime, tz: ZoneInfo) -> str:
+    """Business day (YYYY-MM-DD) of a moment in the tenant's timezone"""
+    return moment.astimezone(tz).strftime("%Y-%m-%d")
 
-def create_token(user_id: str, tenant_id: str) -> str:
+async def get_tenant_today(tenant_id: str) -> str:
+    """Today's business day for a tenant"""
+    tz = tenant_timezone(await get_tenant(tenant_id))
+    return to_business_date(datetime.now(timezone.utc), tz)
+
+def parse_report_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Format tanggal harus YYYY-MM-DD")
+
+class PasswordHasher:
+    """Runs bcrypt in a small thread pool so a login wave never blocks the event loop.
+    
+    bcrypt releases the GIL, so up to `workers` hashes run in parallel; at most
+    `max_queue` more wait for a worker. Queue and hash times are kept for stats().
+    """
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._queue_times = deque(maxlen=1000)
+        self._hash_times = deque(maxlen=1000)
+    
+    async def run(self, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server sedang sibuk, silakan coba lagi")
+        
+        submitted = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started - submitted, time.perf_counter() - started
+        
+        self.in_flight += 1
+        try:
+            result, queued, took = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self._queue_times.append(queued)
+        self._hash_times.append(took)
+        return result
+    
+    @staticmethod
+    def _percentile_ms(values, pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000, 1)
+    
+    def stats(self) -> dict:
+        return {
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            # Over the last 1000 hashes
+            "queue_ms_p50": self._percentile_ms(self._queue_times, 50),
+            "queue_ms_p99": self._percentile_ms(self._queue_times, 99),
+            "hash_ms_p50": self._percentile_ms(self._hash_times, 50),
+            "hash_ms_p99": self._percentile_ms(self._hash_times, 99)
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    # Invited users have no password yet ("" is not a hash passlib can read)
+    if not hashed_password:
+        return False
+    try:
+        return await password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+    except ValueError:
+        return False
+
+async def rehash_password_if_needed(user: dict, plain_password: str):
+    """After a successful login, re-hash a password stored at another bcrypt cost"""
+    if not pwd_context.needs_update(user["password"]):
+        return
+    try:
+        hashed = await hash_password(plain_password)
+    except HTTPException:
+        # Hashing pool saturated; the next login tries again
+        return
+    # Only if the password was not changed in the meantime
+    result = await db.users.update_one(
+        {"id": user["id"], "password": user["password"]},
+        {"$set": {"password": hashed}}
+    )
+    password_hasher.rehashed += result.modified_count
+
+# Running rehash tasks; the event loop only keeps weak references to tasks
+rehash_tasks = set()
+
+def schedule_password_rehash(user: dict, plain_password: str):
+    """Run rehash_password_if_needed in the background, so the login response does not wait on bcrypt"""
+    if not pwd_context.needs_update(user["password"]):
+        return
+    
+    async def rehash():
+        try:
+            await rehash_password_if_needed(user, plain_password)
+        except Exception as e:
+            logger.error(f"Password rehash failed for user {user['id']}: {str(e)}")
+    
+    task = asyncio.create_task(rehash())
+    rehash_tasks.add(task)
+    task.add_done_callback(rehash_tasks.discard)
+
+def create_access_token(user: dict) -> str:
+    """Short-lived token carrying everything get_current_user needs"""
+    payload = {
+        "type": "access",
+        "user_id": user["id"],
+        "tenant_id": user["tenant_id"],
+        "role": user["role"],
+        "name": user["name"],
+        "email": user["email"],
+        "ver": user.get("token_version", 0),
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_MINUTES)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def create_refresh_token(user: dict, jti: str) -> str:
     payload = {
-        "user_id": user_id,
-        "tenant_id": tenant_id,
-        "exp": datetime.now(timezone.utc) + timedelta(hours=24)
+        "type": "refresh",
+        "user_id": user["id"],
+        "ver": user.get("token_version", 0),
+        "jti": jti,
+        "exp": datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_DAYS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+async def issue_tokens(user: dict, family: Optional[str] = None) -> dict:
+    """Token fields for login-style responses.
+    
+    Refresh tokens are single use: each one is recorded in refresh_tokens and
+    exchanged at most once. A login starts a new family (one per device);
+    refreshing continues it.
+    """
+    jti = str(uuid.uuid4())
+    await db.refresh_tokens.insert_one({
+        "_id": jti,
+        "user_id": user["id"],
+        "family": family or jti,
+        "used_at": None,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_DAYS)
+    })
+    return {
+        "token": create_access_token(user),
+        "refresh_token": create_refresh_token(user, jti),
+        "expires_in": ACCESS_TOKEN_MINUTES * 60
+    }
+
+class TokenRevocations:
+    """Current token_version of users whose tokens were revoked recently.
+    
+    Only revocations younger than the access-token lifetime matter (older
+    access tokens have expired anyway), so the map stays small. It is reloaded
+    from Mongo every TOKEN_REVOCATION_REFRESH_SECONDS, which also picks up
+    revocations made by other workers.
+    """
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self._noted_at: Dict[str, float] = {}
+    
+    def is_revoked(self, user_id: str, version: int) -> bool:
+        current = self.versions.get(user_id)
+        return current is not None and version < current
+    
+    def note(self, user_id: str, version: int):
+        self.versions[user_id] = max(version, self.versions.get(user_id, 0))
+        self._noted_at[user_id] = time.monotonic()
+    
+    async def reload(self):
+        started = time.monotonic()
+        since = datetime.now(timezone.utc) - timedelta(minutes=ACCESS_TOKEN_MINUTES)
+        loaded = {
+            user["id"]: user.get("token_version", 0)
+            async for user in db.users.find(
+                {"token_revoked_at": {"$gte": since}},
+                {"_id": 0, "id": 1, "token_version": 1}
+            )
+        }
+        # Merge, never lower: revocations noted while the query ran may be
+        # missing from its result, or newer than what it read
+        for user_id, version in self.versions.items():
+            if user_id in loaded or self._noted_at.get(user_id, float("-inf")) >= started:
+                loaded[user_id] = max(version, loaded.get(user_id, 0))
+        self.versions = loaded
+        self._noted_at = {user_id: at for user_id, at in self._noted_at.items() if at >= started}
+
+token_revocations = TokenRevocations()
+
+async def reload_token_revocations_forever():
+    while True:
+        try:
+            await token_revocations.reload()
+        except Exception as e:
+            logger.error(f"Token revocation reload failed: {str(e)}")
+        await asyncio.sleep(TOKEN_REVOCATION_REFRESH_SECONDS)
+
+async def revoke_user_tokens(user_id: str) -> Optional[dict]:
+    """Invalidate every token issued to a user so far; returns the updated user"""
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_version": 1}, "$set": {"token_revoked_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "password": 0, "invite_token": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        token_revocations.note(user_id, user["token_version"])
+    principal_cache.invalidate(user_id)
+    return user
+
 def create_invite_token() -> str:
     """Generate unique invite token"""
     return str(uuid.uuid4())
@@ -250,9 +712,36 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         raise HTTPException(status_code=401, detail="Tidak ada token")
     
     payload = decode_token(credentials.credentials)
-    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="User tidak ditemukan")
+    token_type = payload.get("type")
+    if token_type == "access":
+        if token_revocations.is_revoked(payload["user_id"], payload.get("ver", 0)):
+            raise HTTPException(status_code=401, detail="Sesi sudah berakhir, silakan login ulang")
+        # Signed claims are enough: no database read
+        return {
+            "id": payload["user_id"],
+            "tenant_id": payload["tenant_id"],
+            "role": payload["role"],
+            "name": payload["name"],
+            "email": payload["email"],
+            "is_active": True,
+            "token_version": payload.get("ver", 0)
+        }
+    if token_type is not None:
+        raise HTTPException(status_code=401, detail="Token tidak valid")
+    
+    # Tokens issued before claims were added (valid until they expire)
+    user = principal_cache.get(payload["user_id"])
+    if user is None:
+        user = await db.users.find_one(
+            {"id": payload["user_id"]},
+            {"_id": 0, "password": 0, "invite_token": 0}
+        )
+        if not user:
+            raise HTTPException(status_code=401, detail="User tidak ditemukan")
+        principal_cache.set(payload["user_id"], user)
+    
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=401, detail="Akun tidak aktif")
     return user
 
 def require_owner(current_user: dict):
@@ -272,14 +761,746 @@ def format_rupiah(amount: int) -> str:
     """Format number to Rupiah string"""
     return f"Rp {amount:,}".replace(",", ".")
 
-async def generate_transaction_number(tenant_id: str) -> str:
-    """Generate transaction number for today"""
-    today = datetime.now(timezone.utc).strftime("%Y%m%d")
-    count = await db.transactions.count_documents({
-        "tenant_id": tenant_id,
-        "transaction_number": {"$regex": f"^{today}"}
-    })
-    return f"{today}{str(count + 1).zfill(4)}"
+async def seed_transaction_counter(tenant_id: str, day: str):
+    """Create the day's counter past any transaction numbered before the counter existed.
+    
+    $max makes concurrent seeders agree, and the counter only ever appears
+    already seeded, so no reservation can hand out a number below the seed.
+    """
+    prefix = {"$gte": day, "$lt": f"{day}~"}
+    existing = await db.transactions.count_documents({"tenant_id": tenant_id, "transaction_number": prefix})
+    highest = 0
+    if existing:
+        last = await db.transactions.find_one(
+            {"tenant_id": tenant_id, "transaction_number": prefix},
+            {"_id": 0, "transaction_number": 1},
+            sort=[("transaction_number", -1)]
+        )
+        suffix = last["transaction_number"][len(day):] if last else ""
+        highest = int(suffix) if suffix.isdigit() else 0
+    await db.transaction_counters.update_one(
+        {"_id": f"{tenant_id}:{day}"},
+        {
+            "$max": {"seq": max(existing, highest)},
+            "$setOnInsert": {"tenant_id": tenant_id, "day": day}
+        },
+        upsert=True
+    )
+
+async def reserve_transaction_numbers(tenant_id: str, day: str, count: int = 1) -> List[str]:
+    """Reserve `count` consecutive transaction numbers for a day (YYYYMMDD) from the per-tenant counter"""
+    counter_id = f"{tenant_id}:{day}"
+    
+    # Single atomic increment on an existing counter; seeded on the first call of the day
+    for _ in range(2):
+        counter = await db.transaction_counters.find_one_and_update(
+            {"_id": counter_id},
+            {"$inc": {"seq": count}},
+            return_document=ReturnDocument.AFTER
+        )
+        if counter:
+            break
+        await seed_transaction_counter(tenant_id, day)
+    last_seq = counter["seq"]
+    
+    return [f"{day}{str(seq).zfill(4)}" for seq in range(last_seq - count + 1, last_seq + 1)]
+
+async def generate_transaction_number(tenant_id: str, business_date: str) -> str:
+    """Generate the next transaction number for a business day (YYYY-MM-DD)"""
+    numbers = await reserve_transaction_numbers(tenant_id, business_date.replace("-", ""))
+    return numbers[0]
+
+_transactions_supported: Optional[bool] = None
+
+async def supports_transactions() -> bool:
+    """Check (once) whether MongoDB is a replica set / sharded cluster with multi-document transactions"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logger.warning(f"Cannot detect transaction support: {str(e)}")
+            _transactions_supported = False
+    return _transactions_supported
+
+async def run_atomic(callback):
+    """Run callback(session) inside a multi-document transaction.
+    
+    On a standalone MongoDB the callback gets session=None and is responsible
+    for its own compensating rollback.
+    """
+    if not await supports_transactions():
+        return await callback(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
+
+async def restore_stock(tenant_id: str, quantities: Dict[str, int], session=None):
+    """Give stock back to items with one bulk $inc (negative quantities take it away again)"""
+    if not quantities:
+        return
+    await db.items.bulk_write([
+        UpdateOne({"id": item_id, "tenant_id": tenant_id}, {"$inc": {"stock": qty}})
+        for item_id, qty in quantities.items()
+    ], ordered=False, session=session)
+
+async def deduct_stock(tenant_id: str, items_to_deduct: Dict[str, dict], session=None) -> Dict[str, int]:
+    """Deduct stock with a conditional $inc per item, guarded by stock >= qty.
+    
+    Returns item_id -> stock before the deduction. If any item is short, a
+    400 is raised with nothing deducted, so concurrent checkouts can never
+    oversell. In a transaction that is the abort; on a standalone server the
+    lines already deducted are given back, even when the request is cancelled.
+    """
+    item_ids = list(items_to_deduct.keys())
+    if not item_ids:
+        return {}
+    
+    if session is not None:
+        # One in-session read for stock_before and one bulk_write for all lines;
+        # a concurrent change to these items conflicts and retries the transaction
+        items = await db.items.find(
+            {"id": {"$in": item_ids}, "tenant_id": tenant_id},
+            {"_id": 0, "id": 1, "stock": 1},
+            session=session
+        ).to_list(len(item_ids))
+        stock_before = {item["id"]: item.get("stock", 0) for item in items}
+        short = [item_id for item_id in item_ids if stock_before.get(item_id, 0) < items_to_deduct[item_id]["qty"]]
+        if not short:
+            result = await db.items.bulk_write([
+                UpdateOne(
+                    {"id": item_id, "tenant_id": tenant_id, "stock": {"$gte": items_to_deduct[item_id]["qty"]}},
+                    {"$inc": {"stock": -items_to_deduct[item_id]["qty"]}}
+                )
+                for item_id in item_ids
+            ], ordered=False, session=session)
+            if result.matched_count == len(item_ids):
+                return stock_before
+            short = item_ids[:1]  # Not expected inside the snapshot; report the first line
+        item_deduct = items_to_deduct[short[0]]
+        raise HTTPException(
+            status_code=400,
+            detail=f"Stok {item_deduct['item_name']} tidak cukup (tersedia: {stock_before.get(short[0], 0)})"
+        )
+    
+    async def deduct(item_id: str, qty: int) -> Optional[int]:
+        before = await db.items.find_one_and_update(
+            {"id": item_id, "tenant_id": tenant_id, "stock": {"$gte": qty}},
+            {"$inc": {"stock": -qty}},
+            projection={"_id": 0, "stock": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        return before["stock"] if before else None
+    
+    # Standalone: each line is its own atomic guarded $inc, run in parallel
+    tasks = [asyncio.ensure_future(deduct(item_id, items_to_deduct[item_id]["qty"])) for item_id in item_ids]
+    try:
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    except BaseException:
+        # Cancelled part-way: give back whatever already landed, then re-raise
+        landed = {
+            item_id: items_to_deduct[item_id]["qty"]
+            for item_id, task in zip(item_ids, tasks)
+            if task.done() and not task.cancelled() and task.exception() is None and task.result() is not None
+        }
+        await asyncio.shield(restore_stock(tenant_id, landed))
+        raise
+    
+    deducted = {}
+    failed = []
+    for item_id, outcome in zip(item_ids, outcomes):
+        if outcome is None or isinstance(outcome, BaseException):
+            failed.append((item_id, outcome))
+        else:
+            deducted[item_id] = outcome
+    
+    if failed:
+        await asyncio.shield(restore_stock(tenant_id, {
+            item_id: items_to_deduct[item_id]["qty"] for item_id in deducted
+        }))
+        for _, outcome in failed:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        item_deduct = items_to_deduct[failed[0][0]]
+        current = await db.items.find_one(
+            {"id": item_deduct["item_id"]}, {"_id": 0, "stock": 1}
+        )
+        raise HTTPException(
+            status_code=400,
+            detail=f"Stok {item_deduct['item_name']} tidak cukup (tersedia: {current.get('stock', 0) if current else 0})"
+        )
+    
+    return deducted
+
+def request_fingerprint(body: dict) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+async def claim_idempotency_key(key_id: str, request_hash: str, current_user: dict, owner: str):
+    """Claim the key for this request.
+    
+    Returns (taken_over, None) when the claim is ours, taken_over meaning a
+    previous holder's lease ran out, or (False, stored response) for a replay.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": key_id,
+            "status": "processing",
+            "request_hash": request_hash,
+            "user_id": current_user["id"],
+            "owner": owner,
+            "claimed_at": now,
+            "created_at": now
+        })
+        return False, None
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"_id": key_id})
+    
+    if not existing:
+        # Released between our insert and read; the client simply retries
+        raise HTTPException(status_code=409, detail="Permintaan yang sama sedang diproses")
+    if existing.get("request_hash", request_hash) != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key sudah dipakai untuk permintaan yang berbeda")
+    if existing.get("status") == "completed":
+        return False, existing["response"]
+    
+    # Still processing: take over only a lease its holder stopped renewing
+    # (keys claimed before leases existed only have created_at)
+    lease_start = existing.get("claimed_at") or existing["created_at"]
+    if lease_start < now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS):
+        taken = await db.idempotency_keys.update_one(
+            {"_id": key_id, "status": "processing", "claimed_at": existing.get("claimed_at")},
+            {"$set": {"claimed_at": now, "owner": owner, "user_id": current_user["id"]}}
+        )
+        if taken.modified_count:
+            return True, None
+    raise HTTPException(status_code=409, detail="Permintaan yang sama sedang diproses")
+
+async def renew_idempotency_lease(ours: dict):
+    """Keep our claim alive while the handler runs, however long it takes"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+        try:
+            await db.idempotency_keys.update_one(ours, {"$set": {"claimed_at": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logger.error(f"Idempotency lease renewal failed: {str(e)}")
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    current_user: dict,
+    scope: str,
+    body: dict,
+    handler,
+    recover
+):
+    """Run handler once per Idempotency-Key and replay its response on retries.
+    
+    handler(key) must store the key in the same atomic write as its effect
+    (e.g. on the transaction document), and recover(key) must rebuild the
+    response from that effect, or return None if there is none. The stored
+    response is then only a shortcut. A process dying between the commit and
+    saving the response cannot cause a second sale: whoever takes the key
+    over finds the committed effect first.
+    
+    The key is claimed with a lease that is renewed while the handler runs,
+    so a retry that races the original gets a 409 instead of a second sale.
+    Reusing a key for a different body is a 422. Failed or cancelled requests
+    release the key so the client can try again.
+    """
+    if not idempotency_key:
+        return await handler(None)
+    
+    key_id = f"{current_user['tenant_id']}:{scope}:{idempotency_key}"
+    owner = str(uuid.uuid4())
+    taken_over, replay = await claim_idempotency_key(key_id, request_fingerprint(body), current_user, owner)
+    if replay is not None:
+        return replay
+    ours = {"_id": key_id, "owner": owner}
+    heartbeat = asyncio.create_task(renew_idempotency_lease(ours))
+    
+    try:
+        response = await recover(idempotency_key) if taken_over else None
+        if response is None:
+            try:
+                response = await handler(idempotency_key)
+            except Exception:
+                # E.g. the duplicate key of a sale the previous holder committed meanwhile
+                response = await recover(idempotency_key)
+                if response is None:
+                    raise
+    except BaseException:
+        heartbeat.cancel()
+        # Shielded: a cancelled request (client gone) must still release its claim
+        await asyncio.shield(db.idempotency_keys.delete_one(ours))
+        raise
+    heartbeat.cancel()
+    
+    await db.idempotency_keys.update_one(
+        ours,
+        {"$set": {"status": "completed", "response": response}}
+    )
+    return response
+
+# ============== DATABASE INDEXES ==============
+
+# collection -> [(keys, options)]; every route query shape must be served by one of these
+# (checked by `python cli.py check-indexes`)
+INDEXES = {
+    "tenants": [
+        ([("id", 1)], {"unique": True}),
+        # Not unique: generate_subdomain() can produce the same subdomain for two shops
+        ([("subdomain", 1)], {}),
+        # Outlets linked into one chain
+        ([("group_id", 1)], {}),
+    ],
+    "users": [
+        ([("id", 1)], {"unique": True}),
+        ([("email", 1)], {"unique": True}),
+        ([("invite_token", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"invite_token": {"$type": "string"}}
+        }),
+        ([("tenant_id", 1), ("created_at", -1)], {}),
+        # Recent revocations, reloaded by every worker
+        ([("token_revoked_at", 1)], {"sparse": True}),
+    ],
+    "items": [
+        ([("id", 1)], {"unique": True}),
+        ([("tenant_id", 1), ("is_active", 1), ("name", 1)], {}),
+        ([("tenant_id", 1), ("name", 1)], {}),
+    ],
+    "transactions": [
+        ([("id", 1)], {"unique": True}),
+        # Not unique: numbers handed out before the daily counter may collide
+        ([("tenant_id", 1), ("transaction_number", 1)], {}),
+        # History keyset pagination on (created_at, id)
+        ([("tenant_id", 1), ("created_at", -1), ("id", -1)], {}),
+        # Date-scoped lists and reports: range scans on the business day
+        ([("tenant_id", 1), ("business_date", 1), ("created_at", -1), ("id", -1)], {}),
+        # Offline sales are stored at most once per client_id
+        ([("tenant_id", 1), ("client_id", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"client_id": {"$type": "string"}}
+        }),
+        # ...and checkouts at most once per Idempotency-Key
+        ([("tenant_id", 1), ("idempotency_key", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"idempotency_key": {"$type": "string"}}
+        }),
+    ],
+    "stock_adjustments": [
+        ([("tenant_id", 1), ("item_id", 1), ("created_at", -1)], {}),
+        ([("transaction_id", 1)], {}),
+    ],
+    "ai_sessions": [
+        ([("id", 1)], {"unique": True}),
+    ],
+    "ai_messages": [
+        ([("session_id", 1), ("created_at", 1)], {}),
+    ],
+    "daily_rollups": [
+        ([("tenant_id", 1), ("business_date", 1)], {}),
+    ],
+    "refresh_tokens": [
+        # Reuse of a spent token ends its whole family
+        ([("family", 1)], {}),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "idempotency_keys": [
+        # Stored idempotent responses expire on their own
+        ([("created_at", 1)], {"expireAfterSeconds": IDEMPOTENCY_TTL_SECONDS}),
+    ],
+    "export_jobs": [
+        ([("id", 1)], {"unique": True}),
+        ([("tenant_id", 1), ("created_at", -1)], {}),
+        # resume_export_jobs: stranded queued jobs and expired leases
+        ([("status", 1), ("created_at", 1)], {}),
+        ([("status", 1), ("lease_expires_at", 1)], {}),
+        # Job documents expire with their files (see cleanup_export_files)
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+async def ensure_indexes():
+    """Create the full index set. Idempotent, so it runs on every startup."""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except Exception as e:
+                # e.g. existing duplicates for a unique index; keep serving and report it
+                logger.error(f"Cannot create index {collection} {keys}: {str(e)}")
+
+# ============== DAILY ROLLUPS ==============
+
+def rollup_increments(transaction: dict, sign: int = 1) -> Dict[str, int]:
+    """$inc fields a completed transaction adds to (sign=1) or removes from (sign=-1) its daily rollup"""
+    method = transaction.get("payment_method") or "tunai"
+    inc = {
+        "total_sales": sign * transaction["total"],
+        "total_transactions": sign,
+        "total_items_sold": 0,
+        f"payment_methods.{method}.count": sign,
+        f"payment_methods.{method}.amount": sign * transaction["total"]
+    }
+    for item in transaction["items"]:
+        inc["total_items_sold"] += sign * item["qty"]
+        for field, value in (("qty", item["qty"]), ("revenue", item["subtotal"])):
+            key = f"items.{item['item_id']}.{field}"
+            inc[key] = inc.get(key, 0) + sign * value
+    return inc
+
+def rollup_operations(tenant_id: str, transactions: List[dict], sign: int = 1) -> List[UpdateOne]:
+    """One update per business day, with the increments of all its transactions combined.
+    
+    Sales upsert; voids only touch an existing document. A missing day keeps
+    falling back to raw transactions (see load_rollups), which already leave
+    voided ones out.
+    """
+    by_day = {}
+    for transaction in transactions:
+        if not transaction.get("business_date"):
+            continue  # Not migrated yet, see `python cli.py migrate-dates`
+        day = by_day.setdefault(transaction["business_date"], {"inc": {}, "names": {}})
+        for key, value in rollup_increments(transaction, sign).items():
+            day["inc"][key] = day["inc"].get(key, 0) + value
+        for item in transaction["items"]:
+            day["names"][f"items.{item['item_id']}.name"] = item["name"]
+    
+    operations = []
+    for business_date, day in by_day.items():
+        # revision: lets live dashboards tell a newer rollup from an older read
+        update = {"$inc": {**day["inc"], "revision": 1}}
+        if sign > 0:
+            update["$set"] = day["names"]
+            update["$setOnInsert"] = {"tenant_id": tenant_id, "business_date": business_date}
+        operations.append(UpdateOne({"_id": f"{tenant_id}:{business_date}"}, update, upsert=sign > 0))
+    return operations
+
+async def write_rollups(tenant_id: str, transactions: List[dict], sign: int = 1, session=None):
+    """Add (or, for voids, subtract) transactions to the daily_rollups collection.
+    
+    Called inside the sale/void's own run_atomic callback, after the
+    transactions are written, so the rollups commit (or roll back) together
+    with them. A sale landing on a day without a rollup document (the first
+    sale of the day, or a backdated offline sale) creates that day from all
+    of its raw transactions, including these, instead of starting a partial
+    document from zero.
+    """
+    if sign > 0:
+        days = {transaction["business_date"] for transaction in transactions if transaction.get("business_date")}
+        existing = {
+            rollup["business_date"]
+            async for rollup in db.daily_rollups.find(
+                {"_id": {"$in": [f"{tenant_id}:{day}" for day in days]}},
+                {"_id": 0, "business_date": 1},
+                session=session
+            )
+        }
+        missing = days - existing
+        if missing:
+            computed = await compute_raw_rollups(
+                {"tenant_id": tenant_id, "business_date": {"$in": list(missing)}, "status": "selesai"},
+                session=session
+            )
+            # Concurrent creators of the same day conflict and their transaction is retried
+            await db.daily_rollups.bulk_write([
+                UpdateOne(
+                    {"_id": f"{tenant_id}:{rollup['business_date']}"},
+                    {"$setOnInsert": {**rollup, "revision": 1}},
+                    upsert=True
+                )
+                for rollup in computed.values()
+            ], ordered=False, session=session)
+            transactions = [transaction for transaction in transactions if transaction.get("business_date") not in missing]
+    
+    operations = rollup_operations(tenant_id, transactions, sign)
+    if operations:
+        await db.daily_rollups.bulk_write(operations, ordered=False, session=session)
+
+async def notify_sales_committed(tenant_id: str, transactions: List[dict], sign: int = 1):
+    """Effects of committed sales/voids: report cache version and live dashboard.
+    
+    The version is bumped after commit, not inside the sale's transaction, so
+    concurrent checkouts do not conflict on the tenant document. If the bump
+    fails, reports are stale until REPORT_CACHE_TTL_SECONDS at worst.
+    """
+    try:
+        await bump_tenant_version(tenant_id)
+    except Exception as e:
+        logger.error(f"Report cache version bump failed for tenant {tenant_id}: {str(e)}")
+    live_dashboard.changed(tenant_id)
+
+def add_rollup_increments(rollup: dict, inc: Dict[str, int]):
+    """Apply rollup_increments ("a.b.c" keys) to a rollup-shaped document in memory"""
+    for key, value in inc.items():
+        *path, field = key.split(".")
+        node = rollup
+        for part in path:
+            node = node.setdefault(part, {})
+        node[field] = node.get(field, 0) + value
+
+ROLLUP_SOURCE_PROJECTION = {
+    "_id": 0, "tenant_id": 1, "business_date": 1, "total": 1, "payment_method": 1,
+    "items.item_id": 1, "items.name": 1, "items.qty": 1, "items.subtotal": 1
+}
+
+async def compute_raw_rollups(query: dict, session=None) -> Dict[tuple, dict]:
+    """Rollup-shaped documents per (tenant_id, business_date), summed from the transactions matching query"""
+    computed: Dict[tuple, dict] = {}
+    async for transaction in db.transactions.find(query, ROLLUP_SOURCE_PROJECTION, session=session):
+        if not transaction.get("business_date"):
+            continue
+        key = (transaction["tenant_id"], transaction["business_date"])
+        rollup = computed.setdefault(key, {"tenant_id": key[0], "business_date": key[1]})
+        add_rollup_increments(rollup, rollup_increments(transaction))
+        for item in transaction["items"]:
+            rollup["items"][item["item_id"]]["name"] = item["name"]
+    return computed
+
+async def load_rollups(tenant_ids: List[str], start_date: str, end_date: str) -> List[dict]:
+    """Daily rollups of some tenants over a date range (YYYY-MM-DD, inclusive).
+    
+    Days without a rollup document (history from before rollups existed,
+    until `python cli.py rebuild-rollups` has run) are computed from the raw
+    transactions instead, so reports never silently show zero for them.
+    """
+    day_range = {"$gte": start_date, "$lte": end_date}
+    rollups = await db.daily_rollups.find(
+        {"tenant_id": {"$in": tenant_ids}, "business_date": day_range}, {"_id": 0}
+    ).to_list(None)
+    
+    covered: Dict[str, List[str]] = {}
+    for rollup in rollups:
+        covered.setdefault(rollup["tenant_id"], []).append(rollup["business_date"])
+    span_days = (date.fromisoformat(end_date) - date.fromisoformat(start_date)).days + 1
+    branches = []
+    uncovered = [tenant_id for tenant_id in tenant_ids if tenant_id not in covered]
+    if uncovered:
+        branches.append({"tenant_id": {"$in": uncovered}, "business_date": day_range})
+    for tenant_id, days in covered.items():
+        if len(days) < span_days:
+            branches.append({"tenant_id": tenant_id, "business_date": {**day_range, "$nin": days}})
+    if not branches:
+        return rollups
+    
+    # Usually only days without sales, which the index answers with nothing
+    query = {"$or": branches} if len(branches) > 1 else dict(branches[0])
+    query["status"] = "selesai"
+    computed = await compute_raw_rollups(query)
+    return rollups + list(computed.values())
+
+def rollups_to_facets(rollups: List[dict]) -> dict:
+    """Merge daily rollup documents into the REPORT_SUMMARY_FACETS result shape"""
+    payment_breakdown = {}
+    items = {}
+    daily_sales = []
+    total_sales = 0
+    total_transactions = 0
+    
+    for rollup in sorted(rollups, key=lambda r: r["business_date"]):
+        if rollup.get("total_transactions", 0) <= 0:
+            continue
+        total_sales += rollup.get("total_sales", 0)
+        total_transactions += rollup.get("total_transactions", 0)
+        daily_sales.append({
+            "_id": rollup["business_date"],
+            "transactions": rollup.get("total_transactions", 0),
+            "amount": rollup.get("total_sales", 0)
+        })
+        for method, values in rollup.get("payment_methods", {}).items():
+            row = payment_breakdown.setdefault(method, {"_id": method, "count": 0, "amount": 0})
+            row["count"] += values.get("count", 0)
+            row["amount"] += values.get("amount", 0)
+        # Reports group items by name, like the raw aggregation
+        for values in rollup.get("items", {}).values():
+            row = items.setdefault(values.get("name", ""), {"_id": values.get("name", ""), "qty": 0, "revenue": 0})
+            row["qty"] += values.get("qty", 0)
+            row["revenue"] += values.get("revenue", 0)
+    
+    return {
+        "totals": [{"total_sales": total_sales, "total_transactions": total_transactions}],
+        "payment_breakdown": [row for row in payment_breakdown.values() if row["count"] > 0],
+        "items": sorted(
+            [row for row in items.values() if row["qty"] > 0],
+            key=lambda row: (-row["revenue"], row["_id"])
+        ),
+        "daily_sales": daily_sales
+    }
+
+# ============== LIVE DASHBOARD ==============
+
+class LiveDashboard:
+    """Today's dashboard per tenant: an in-memory copy of its daily rollup, pushed to SSE subscribers.
+    
+    daily_rollups is the source of truth. It is written in the same
+    transaction as every sale and void, and carries a revision counter. A
+    commit on this worker re-reads its tenant right away. sync() polls the
+    revisions of active tenants, so sales handled by other workers show up
+    within DASHBOARD_SYNC_SECONDS. A copy is only replaced by a newer
+    revision (or another day), so a slow read can never undo a newer one.
+    """
+    def __init__(self, top_n: int, sync_seconds: float, active_seconds: float):
+        self.top_n = top_n
+        self.sync_seconds = sync_seconds
+        self.active_seconds = active_seconds
+        self._counters: Dict[str, dict] = {}
+        self._subscribers: Dict[str, set] = {}
+        self._last_read: Dict[str, float] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._refreshes = set()
+    
+    def load(self, tenant_id: str, business_date: str, rollup: Optional[dict] = None) -> bool:
+        """Install a daily rollup document (or zero) unless the copy held is as new. True if installed."""
+        rollup = rollup or {}
+        revision = rollup.get("revision", 0)
+        self._checked_at[tenant_id] = time.monotonic()
+        current = self._counters.get(tenant_id)
+        if current and current["date"] == business_date and revision <= current["revision"]:
+            return False
+        self._counters[tenant_id] = {
+            "date": business_date,
+            "revision": revision,
+            "total_sales": rollup.get("total_sales", 0),
+            "total_transactions": rollup.get("total_transactions", 0),
+            "total_items_sold": rollup.get("total_items_sold", 0),
+            "items": {
+                item_id: {"name": values.get("name", ""), "qty": values.get("qty", 0), "revenue": values.get("revenue", 0)}
+                for item_id, values in rollup.get("items", {}).items()
+            }
+        }
+        return True
+    
+    def seed(self, tenant_id: str, business_date: str, rollup: Optional[dict] = None):
+        """Startup load: counts as a read, so sync() keeps the copy current until it goes idle"""
+        self.load(tenant_id, business_date, rollup)
+        self._last_read[tenant_id] = time.monotonic()
+    
+    def is_active(self, tenant_id: str) -> bool:
+        return tenant_id in self._subscribers or \
+            time.monotonic() - self._last_read.get(tenant_id, float("-inf")) < self.active_seconds
+    
+    async def ensure_today(self, tenant_id: str, today: str):
+        """Load counters unless the copy is for today and was checked against the database recently"""
+        self._last_read[tenant_id] = time.monotonic()
+        counters = self._counters.get(tenant_id)
+        checked = time.monotonic() - self._checked_at.get(tenant_id, float("-inf"))
+        if counters and counters["date"] == today and checked < 2 * self.sync_seconds:
+            return
+        rollups = await load_rollups([tenant_id], today, today)
+        if self.load(tenant_id, today, rollups[0] if rollups else None):
+            self.publish(tenant_id)
+    
+    async def refresh(self, tenant_ids: List[str]):
+        """Re-read the loaded day's rollup of these tenants and install newer revisions"""
+        keys = {f"{tenant_id}:{self._counters[tenant_id]['date']}": tenant_id for tenant_id in tenant_ids if tenant_id in self._counters}
+        if not keys:
+            return
+        async for rollup in db.daily_rollups.find({"_id": {"$in": list(keys)}}, {"_id": 1, "business_date": 1, "revision": 1, "total_sales": 1, "total_transactions": 1, "total_items_sold": 1, "items": 1}):
+            tenant_id = keys[rollup["_id"]]
+            if self.load(tenant_id, rollup["business_date"], rollup):
+                self.publish(tenant_id)
+    
+    def changed(self, tenant_id: str):
+        """A sale or void for this tenant was committed here: pick it up without waiting for sync()"""
+        if tenant_id not in self._counters:
+            return  # Loaded from daily_rollups on first read, which already include it
+        task = asyncio.create_task(self.refresh([tenant_id]))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+    
+    async def sync(self):
+        """One poll: re-read the rollups of active tenants whose revision moved"""
+        now = time.monotonic()
+        keys = {
+            f"{tenant_id}:{counters['date']}": tenant_id
+            for tenant_id, counters in self._counters.items() if self.is_active(tenant_id)
+        }
+        if not keys:
+            return
+        # Revisions first; a full rollup is only read when it changed
+        moved = []
+        async for row in db.daily_rollups.find({"_id": {"$in": list(keys)}}, {"_id": 1, "revision": 1}):
+            tenant_id = keys[row["_id"]]
+            if row.get("revision", 0) > self._counters[tenant_id]["revision"]:
+                moved.append(tenant_id)
+        for tenant_id in keys.values():
+            self._checked_at[tenant_id] = now
+        if moved:
+            await self.refresh(moved)
+    
+    def snapshot(self, tenant_id: str) -> dict:
+        """Dashboard response for the loaded day"""
+        counters = self._counters[tenant_id]
+        top_items = sorted(
+            [row for row in counters["items"].values() if row["qty"] > 0],
+            key=lambda row: row["qty"],
+            reverse=True
+        )[:self.top_n]
+        return {
+            "date": counters["date"],
+            "total_sales": counters["total_sales"],
+            "total_sales_formatted": format_rupiah(counters["total_sales"]),
+            "total_transactions": counters["total_transactions"],
+            "total_items_sold": counters["total_items_sold"],
+            "top_items": [dict(row) for row in top_items]
+        }
+    
+    def subscribe(self, tenant_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(tenant_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, tenant_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(tenant_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[tenant_id]
+    
+    def publish(self, tenant_id: str):
+        """Hand the latest snapshot to every subscriber; a slow one only ever sees the newest"""
+        queues = self._subscribers.get(tenant_id)
+        if not queues or tenant_id not in self._counters:
+            return
+        snapshot = self.snapshot(tenant_id)
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+    
+    def stats(self) -> dict:
+        return {
+            "tenants": len(self._counters),
+            "active_tenants": sum(1 for tenant_id in self._counters if self.is_active(tenant_id)),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values())
+        }
+
+live_dashboard = LiveDashboard(DASHBOARD_TOP_ITEMS, DASHBOARD_SYNC_SECONDS, DASHBOARD_ACTIVE_SECONDS)
+
+async def seed_live_dashboard():
+    """Load today's counters for every tenant from daily_rollups"""
+    tenants_by_day: Dict[str, List[str]] = {}
+    async for tenant in db.tenants.find({}, {"_id": 0, "id": 1, "timezone": 1}):
+        today = to_business_date(datetime.now(timezone.utc), tenant_timezone(tenant))
+        tenants_by_day.setdefault(today, []).append(tenant["id"])
+    
+    loaded = 0
+    for today, tenant_ids in tenants_by_day.items():
+        rollups = {rollup["tenant_id"]: rollup for rollup in await load_rollups(tenant_ids, today, today)}
+        for tenant_id in tenant_ids:
+            live_dashboard.seed(tenant_id, today, rollups.get(tenant_id))
+            loaded += 1
+    logger.info(f"Live dashboard counters loaded for {loaded} tenant(s)")
+
+async def sync_live_dashboard_forever():
+    """Background task: poll rollup revisions so every worker sees every worker's sales"""
+    while True:
+        await asyncio.sleep(DASHBOARD_SYNC_SECONDS)
+        try:
+            await live_dashboard.sync()
+        except Exception as e:
+            logger.error(f"Live dashboard sync failed: {str(e)}")
 
 # ============== AI ONBOARDING ==============
 
@@ -308,168 +1529,352 @@ Jawab dalam JSON format:
 Jika complete=true, berarti semua data sudah lengkap.
 Pastikan items adalah array minimal 2 item."""
 
-@api_router.post("/v1/ai/onboard")
-async def ai_onboard(data: AIOnboardMessage):
-    """AI-powered onboarding untuk setup toko baru"""
-    try:
-        # Get or create session
-        session = None
-        if data.session_id:
-            session_doc = await db.ai_sessions.find_one({"id": data.session_id}, {"_id": 0})
-            if session_doc:
-                session = AISession(**session_doc)
-        
-        if not session:
-            session = AISession()
-            await db.ai_sessions.insert_one(session.model_dump())
-        
-        # Build conversation history
-        messages = [
-            {"role": "system", "content": AI_SYSTEM_PROMPT}
-        ]
-        
-        # Get previous messages for this session
-        prev_messages = await db.ai_messages.find(
-            {"session_id": session.id}
-        ).sort("created_at", 1).to_list(100)
-        
-        for msg in prev_messages:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add current user message
-        messages.append({"role": "user", "content": data.message})
+def completion_request(messages: List[dict]) -> dict:
+    return {
+        "model": OPENAI_MODEL,
+        "messages": messages,
+        "temperature": 0.7,
+        "response_format": {"type": "json_object"}
+    }
+
+async def retry_backoff(attempt: int, error: Exception):
+    """Sleep before the next attempt, or give up with 503 after the last one"""
+    if attempt == OPENAI_MAX_RETRIES:
+        logger.error(f"OpenAI call failed after {attempt + 1} attempt(s): {str(error)}")
+        raise HTTPException(status_code=503, detail="Asisten AI sedang sibuk, silakan coba lagi")
+    # Outside the semaphore, so a backing-off call does not hold a slot
+    await asyncio.sleep(OPENAI_RETRY_BASE_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+
+async def chat_completion(messages: List[dict]) -> str:
+    """JSON chat completion with timeout, retry with jittered backoff, and a global concurrency limit"""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        try:
+            async with llm_semaphore:
+                response = await openai_client.chat.completions.create(**completion_request(messages))
+            return response.choices[0].message.content
+        except RETRYABLE_OPENAI_ERRORS as e:
+            await retry_backoff(attempt, e)
+
+async def stream_chat_completion(messages: List[dict]):
+    """Like chat_completion, but yields content deltas; only retried until the first delta"""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        started = False
+        try:
+            async with llm_semaphore:
+                stream = await openai_client.chat.completions.create(**completion_request(messages), stream=True)
+                async with stream:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            started = True
+                            yield chunk.choices[0].delta.content
+            return
+        except RETRYABLE_OPENAI_ERRORS as e:
+            if started:
+                logger.error(f"OpenAI stream broke off: {str(e)}")
+                raise HTTPException(status_code=503, detail="Asisten AI sedang sibuk, silakan coba lagi")
+            await retry_backoff(attempt, e)
+
+class MessageFieldStream:
+    """Pulls the top-level "message" string out of a JSON completion as it streams in.
+    
+    feed() takes raw completion deltas and returns the newly decoded message
+    text. Keys are found with a small scanner that skips nested objects and
+    arrays, so "message" may come after "data": {...}. Escapes are only
+    decoded once complete (a \\u surrogate pair as one). finish() returns
+    whatever the stream missed, from the parsed completion.
+    """
+    HIGH_SURROGATE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+    
+    def __init__(self):
+        self.buffer = ""
+        self.start = None
+        self.done = False
+        self.emitted = ""
+        # Scanner state, up to the opening quote of the message value
+        self.scanned = 0
+        self.depth = 0
+        self.string_start = None
+        self.escaped = False
+        self.expect_key = False
+        self.key = None
+        self.expect_value = False
+    
+    def find_message(self) -> bool:
+        """Scan new input for the top-level "message" value; True once its opening quote is found"""
+        buffer = self.buffer
+        i = self.scanned
+        while i < len(buffer):
+            char = buffer[i]
+            i += 1
+            if self.string_start is not None:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    if self.depth == 1 and self.expect_key:
+                        self.key = buffer[self.string_start:i]
+                        self.expect_key = False
+                    self.string_start = None
+                continue
+            if self.expect_value and not char.isspace():
+                self.expect_value = False
+                if char == '"' and self.key == '"message"':
+                    self.scanned = self.start = i
+                    return True
+            if char == '"':
+                self.string_start = i - 1
+            elif char in "{[":
+                self.depth += 1
+                self.expect_key = self.depth == 1 and char == "{"
+            elif char in "}]":
+                self.depth -= 1
+            elif self.depth == 1 and char == ",":
+                self.expect_key = True
+            elif self.depth == 1 and char == ":":
+                self.expect_value = True
+        self.scanned = i
+        return False
+    
+    def feed(self, delta: str) -> str:
+        self.buffer += delta
+        if self.done:
+            return ""
+        if self.start is None and not self.find_message():
+            return ""
         
-        # Save user message
-        await db.ai_messages.insert_one({
-            "session_id": session.id,
-            "role": "user",
-            "content": data.message,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        raw = self.buffer[self.start:]
+        end = 0
+        while end < len(raw) and raw[end] != '"':
+            if raw[end] == "\\":
+                escape_len = 6 if raw[end + 1:end + 2] == "u" else 2
+                if end + escape_len > len(raw):
+                    break
+                end += escape_len
+            else:
+                end += 1
+        self.done = end < len(raw) and raw[end] == '"'
+        complete = raw[:end]
+        if not self.done and self.HIGH_SURROGATE.search(complete):
+            complete = complete[:-6]
         
-        # Call OpenAI
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7,
-            response_format={"type": "json_object"}
+        text = json.loads(f'"{complete}"')
+        new_text = text[len(self.emitted):]
+        self.emitted = text
+        return new_text
+    
+    def finish(self) -> str:
+        """Message text not streamed yet, taken from the complete JSON (empty if it is not valid)"""
+        if self.done:
+            return ""
+        try:
+            message = json.loads(self.buffer).get("message")
+        except (ValueError, AttributeError):
+            return ""
+        if not isinstance(message, str) or not message.startswith(self.emitted):
+            return ""
+        self.done = True
+        new_text = message[len(self.emitted):]
+        self.emitted = message
+        return new_text
+
+async def start_onboard_turn(data: AIOnboardMessage):
+    """Load or create the session, save the user message and build the prompt"""
+    # Get or create session
+    session = None
+    if data.session_id:
+        session_doc = await db.ai_sessions.find_one({"id": data.session_id}, {"_id": 0})
+        if session_doc:
+            session = AISession(**session_doc)
+    
+    if not session:
+        session = AISession()
+        await db.ai_sessions.insert_one(session.model_dump())
+    
+    # Build conversation history
+    messages = [
+        {"role": "system", "content": AI_SYSTEM_PROMPT}
+    ]
+    
+    # Get previous messages for this session
+    prev_messages = await db.ai_messages.find(
+        {"session_id": session.id}
+    ).sort("created_at", 1).to_list(100)
+    
+    for msg in prev_messages:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    # Add current user message
+    messages.append({"role": "user", "content": data.message})
+    
+    # Save user message
+    await db.ai_messages.insert_one({
+        "session_id": session.id,
+        "role": "user",
+        "content": data.message,
+        "created_at": datetime.now(timezone.utc)
+    })
+    
+    return session, messages
+
+async def finish_onboard_turn(session: AISession, ai_response: str) -> dict:
+    """Save the assistant reply, update the session and create the store once complete"""
+    ai_data = json.loads(ai_response)
+    
+    # Save AI response
+    await db.ai_messages.insert_one({
+        "session_id": session.id,
+        "role": "assistant",
+        "content": ai_response,
+        "created_at": datetime.now(timezone.utc)
+    })
+    
+    # Update session with extracted data
+    update_data = {}
+    if ai_data.get("data"):
+        if ai_data["data"].get("business_type"):
+            update_data["business_type"] = ai_data["data"]["business_type"]
+        if ai_data["data"].get("business_name"):
+            update_data["business_name"] = ai_data["data"]["business_name"]
+        if ai_data["data"].get("items"):
+            update_data["items"] = ai_data["data"]["items"]
+        if ai_data["data"].get("email"):
+            update_data["owner_email"] = ai_data["data"]["email"]
+    
+    if ai_data.get("step"):
+        update_data["step"] = ai_data["step"]
+    
+    if update_data:
+        await db.ai_sessions.update_one(
+            {"id": session.id},
+            {"$set": update_data}
         )
-        
-        ai_response = response.choices[0].message.content
-        ai_data = json.loads(ai_response)
-        
-        # Save AI response
-        await db.ai_messages.insert_one({
-            "session_id": session.id,
-            "role": "assistant",
-            "content": ai_response,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
-        # Update session with extracted data
-        update_data = {}
-        if ai_data.get("data"):
-            if ai_data["data"].get("business_type"):
-                update_data["business_type"] = ai_data["data"]["business_type"]
-            if ai_data["data"].get("business_name"):
-                update_data["business_name"] = ai_data["data"]["business_name"]
-            if ai_data["data"].get("items"):
-                update_data["items"] = ai_data["data"]["items"]
-            if ai_data["data"].get("email"):
-                update_data["owner_email"] = ai_data["data"]["email"]
-        
-        if ai_data.get("step"):
-            update_data["step"] = ai_data["step"]
-        
-        if update_data:
-            await db.ai_sessions.update_one(
-                {"id": session.id},
-                {"$set": update_data}
-            )
-        
-        # If complete, create tenant, user, and items
-        if ai_data.get("complete") and ai_data.get("data"):
-            extracted = ai_data["data"]
-            
-            # Check if email already exists
-            existing_user = await db.users.find_one({"email": extracted.get("email", "")})
-            if existing_user:
-                return {
-                    "status": "continue",
-                    "message": "Email sudah terdaftar. Coba pakai email lain ya!",
-                    "session_id": session.id
-                }
-            
-            # Create tenant
-            subdomain = generate_subdomain(extracted.get("business_name", "toko"))
-            tenant = Tenant(
-                name=extracted.get("business_name", "Toko Saya"),
-                subdomain=subdomain,
-                config=TenantConfig(business_type=extracted.get("business_type", "general"))
-            )
-            tenant_dict = tenant.model_dump()
-            tenant_dict["created_at"] = tenant_dict["created_at"].isoformat()
-            tenant_dict["config"] = dict(tenant_dict["config"])
-            await db.tenants.insert_one(tenant_dict)
-            
-            # Create user with temporary password
-            temp_password = str(uuid.uuid4())[:8]
-            user = User(
-                tenant_id=tenant.id,
-                name="Pemilik",
-                email=extracted.get("email", f"{subdomain}@aikasir.com"),
-                password=hash_password(temp_password),
-                role="pemilik"
-            )
-            user_dict = user.model_dump()
-            user_dict["created_at"] = user_dict["created_at"].isoformat()
-            await db.users.insert_one(user_dict)
-            
-            # Create items
-            created_items = []
-            items_list = extracted.get("items", [])
-            for item_name in items_list:
-                item = Item(
-                    tenant_id=tenant.id,
-                    name=item_name,
-                    price=10000  # Default price, user can edit later
-                )
-                item_dict = item.model_dump()
-                item_dict["created_at"] = item_dict["created_at"].isoformat()
-                await db.items.insert_one(item_dict)
-                created_items.append({"name": item_name, "price": 10000})
-            
-            # Create token for auto-login
-            token = create_token(user.id, tenant.id)
-            
+    
+    # If complete, create tenant, user, and items
+    if ai_data.get("complete") and ai_data.get("data"):
+        extracted = ai_data["data"]
+    
+        # Check if email already exists
+        existing_user = await db.users.find_one({"email": extracted.get("email", "")})
+        if existing_user:
             return {
-                "status": "complete",
-                "message": ai_data.get("message", "Toko kamu sudah jadi! 🎉"),
-                "session_id": session.id,
-                "tenant": {
-                    "id": tenant.id,
-                    "name": tenant.name,
-                    "subdomain": tenant.subdomain
-                },
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "temp_password": temp_password
-                },
-                "items": created_items,
-                "token": token
+                "status": "continue",
+                "message": "Email sudah terdaftar. Coba pakai email lain ya!",
+                "session_id": session.id
             }
-        
+    
+        # Create tenant
+        subdomain = generate_subdomain(extracted.get("business_name", "toko"))
+        tenant = Tenant(
+            name=extracted.get("business_name", "Toko Saya"),
+            subdomain=subdomain,
+            config=TenantConfig(business_type=extracted.get("business_type", "general"))
+        )
+        tenant_dict = tenant.model_dump()
+        tenant_dict["created_at"] = tenant_dict["created_at"].isoformat()
+        tenant_dict["config"] = dict(tenant_dict["config"])
+        await db.tenants.insert_one(tenant_dict)
+    
+        # Create user with temporary password
+        temp_password = str(uuid.uuid4())[:8]
+        user = User(
+            tenant_id=tenant.id,
+            name="Pemilik",
+            email=extracted.get("email", f"{subdomain}@aikasir.com"),
+            password=await hash_password(temp_password),
+            role="pemilik"
+        )
+        user_dict = user.model_dump()
+        user_dict["created_at"] = user_dict["created_at"].isoformat()
+        await db.users.insert_one(user_dict)
+    
+        # Create items
+        created_items = []
+        items_list = extracted.get("items", [])
+        for item_name in items_list:
+            item = Item(
+                tenant_id=tenant.id,
+                name=item_name,
+                price=10000  # Default price, user can edit later
+            )
+            item_dict = item.model_dump()
+            item_dict["created_at"] = item_dict["created_at"].isoformat()
+            await db.items.insert_one(item_dict)
+            created_items.append({"name": item_name, "price": 10000})
+    
         return {
-            "status": "continue",
-            "message": ai_data.get("message", "Oke, lanjut ya!"),
-            "session_id": session.id
+            "status": "complete",
+            "message": ai_data.get("message", "Toko kamu sudah jadi! 🎉"),
+            "session_id": session.id,
+            "tenant": {
+                "id": tenant.id,
+                "name": tenant.name,
+                "subdomain": tenant.subdomain
+            },
+            "user": {
+                "id": user.id,
+                "email": user.email,
+                "temp_password": temp_password
+            },
+            "items": created_items,
+            # Auto-login
+            **(await issue_tokens(user_dict))
         }
-        
+    
+    return {
+        "status": "continue",
+        "message": ai_data.get("message", "Oke, lanjut ya!"),
+        "session_id": session.id
+    }
+
+@api_router.post("/v1/ai/onboard")
+async def ai_onboard(data: AIOnboardMessage):
+    """AI-powered onboarding untuk setup toko baru"""
+    try:
+        session, messages = await start_onboard_turn(data)
+        ai_response = await chat_completion(messages)
+        return await finish_onboard_turn(session, ai_response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"AI Onboard error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+async def onboard_events(session: AISession, messages: List[dict]):
+    """SSE stream: `token` events with message text as it is generated, then `done` with the full response"""
+    parser = MessageFieldStream()
+    parts = []
+    try:
+        async for delta in stream_chat_completion(messages):
+            parts.append(delta)
+            text = parser.feed(delta)
+            if text:
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        text = parser.finish()
+        if text:
+            yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        result = await finish_onboard_turn(session, "".join(parts))
+        yield f"event: done\ndata: {json.dumps(result)}\n\n"
+    except HTTPException as e:
+        yield f"event: error\ndata: {json.dumps({'detail': e.detail})}\n\n"
+    except Exception as e:
+        logger.error(f"AI Onboard stream error: {str(e)}")
+        yield f"event: error\ndata: {json.dumps({'detail': f'Error: {str(e)}'})}\n\n"
+
+@api_router.post("/v1/ai/onboard/stream")
+async def ai_onboard_stream(data: AIOnboardMessage):
+    """Streaming variant of /v1/ai/onboard over Server-Sent Events"""
+    try:
+        session, messages = await start_onboard_turn(data)
+    except Exception as e:
+        logger.error(f"AI Onboard error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return StreamingResponse(
+        onboard_events(session, messages),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ============== AUTH ROUTES ==============
 
 @api_router.post("/v1/auth/login")
@@ -479,19 +1884,17 @@ async def login(data: UserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Email tidak ditemukan")
     
-    if not verify_password(data.password, user["password"]):
+    if not await verify_password(data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Password salah")
     
     if not user.get("is_active", True):
         raise HTTPException(status_code=401, detail="Akun tidak aktif")
     
     # Get tenant
-    tenant = await db.tenants.find_one({"id": user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(user["tenant_id"])
     
-    token = create_token(user["id"], user["tenant_id"])
-    
-    return {
-        "token": token,
+    response = {
+        **(await issue_tokens(user)),
         "user": {
             "id": user["id"],
             "name": user["name"],
@@ -506,11 +1909,13 @@ async def login(data: UserLogin):
             "phone": tenant.get("phone")
         }
     }
+    schedule_password_rehash(user, data.password)
+    return response
 
 @api_router.get("/v1/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current user info"""
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(current_user["tenant_id"])
     return {
         "user": {
             "id": current_user["id"],
@@ -531,12 +1936,43 @@ async def change_password(
     if not new_password or len(new_password) < 6:
         raise HTTPException(status_code=400, detail="Password minimal 6 karakter")
     
-    hashed = hash_password(new_password)
+    hashed = await hash_password(new_password)
     await db.users.update_one(
         {"id": current_user["id"]},
         {"$set": {"password": hashed}}
     )
-    return {"message": "Password berhasil diubah"}
+    # Sign out every other session; this one continues with the new tokens
+    user = await revoke_user_tokens(current_user["id"])
+    return {"message": "Password berhasil diubah", **(await issue_tokens(user))}
+
+@api_router.post("/v1/auth/refresh")
+async def refresh_access_token(data: RefreshTokenRequest):
+    """Exchange a refresh token for a new access token and a new refresh token (the old one is spent)"""
+    payload = decode_token(data.refresh_token)
+    if payload.get("type") != "refresh" or not payload.get("jti"):
+        raise HTTPException(status_code=401, detail="Token tidak valid")
+    
+    now = datetime.now(timezone.utc)
+    token = await db.refresh_tokens.find_one_and_update(
+        {"_id": payload["jti"], "user_id": payload["user_id"], "used_at": None},
+        {"$set": {"used_at": now}}
+    )
+    if not token:
+        spent = await db.refresh_tokens.find_one({"_id": payload["jti"]}, {"family": 1, "used_at": 1})
+        # A quick second use is two tabs racing; a late one is a copied token
+        if spent and spent["used_at"] and now - spent["used_at"] > timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE_SECONDS):
+            logger.warning(f"Refresh token reused for user {payload['user_id']}; ending that session")
+            await db.refresh_tokens.delete_many({"family": spent["family"]})
+        raise HTTPException(status_code=401, detail="Sesi sudah berakhir, silakan login ulang")
+    
+    user = await db.users.find_one(
+        {"id": payload["user_id"]},
+        {"_id": 0, "password": 0, "invite_token": 0}
+    )
+    if not user or not user.get("is_active", True) or payload.get("ver", 0) != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Sesi sudah berakhir, silakan login ulang")
+    
+    return await issue_tokens(user, family=token["family"])
 
 # ============== ITEMS ROUTES ==============
 
@@ -618,6 +2054,7 @@ async def update_item(
     
     if update_data:
         await db.items.update_one({"id": item_id}, {"$set": update_data})
+        await bump_tenant_version(current_user["tenant_id"])
     
     updated_item = await db.items.find_one({"id": item_id}, {"_id": 0})
     return updated_item
@@ -636,32 +2073,78 @@ async def delete_item(
         raise HTTPException(status_code=404, detail="Barang tidak ditemukan")
     
     await db.items.update_one({"id": item_id}, {"$set": {"is_active": False}})
+    await bump_tenant_version(current_user["tenant_id"])
     return {"message": "Barang berhasil dihapus"}
 
 # ============== TRANSACTIONS ROUTES ==============
 
+def encode_transaction_cursor(transaction: dict) -> str:
+    """Opaque keyset cursor pointing just past a transaction in (created_at, id) order"""
+    raw = json.dumps({"t": transaction["created_at"].isoformat(), "id": transaction["id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_transaction_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), str(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor tidak valid")
+
+async def count_transactions(query: dict) -> int:
+    """Total for the history list, cached briefly so paging does not recount"""
+    key = f"{query['tenant_id']}:{query.get('business_date', '*')}"
+    total = transaction_count_cache.get(key)
+    if total is None:
+        total = await db.transactions.count_documents(query)
+        transaction_count_cache.set(key, total)
+    return total
+
 @api_router.get("/v1/transactions")
 async def get_transactions(
     date: str = None,
     limit: int = 50,
+    after: Optional[str] = None,
     offset: int = 0,
+    include_total: bool = True,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get transactions for current tenant"""
+    """Get transactions for current tenant, newest first.
+    
+    Pass the previous page's `next_cursor` as `after` to continue; `offset`
+    is still accepted for old clients but costs O(offset).
+    """
+    limit = max(1, min(limit, TRANSACTION_PAGE_MAX_SIZE))
     query = {"tenant_id": current_user["tenant_id"]}
     
     if date:
-        # Filter by date (YYYY-MM-DD)
-        query["transaction_number"] = {"$regex": f"^{date.replace('-', '')}"}
+        # Filter by business day (YYYY-MM-DD)
+        query["business_date"] = date
+    
+    # The total only changes with new sales, so later pages skip it
+    total = await count_transactions(query) if include_total and not after else None
+    
+    page_query = query
+    if after:
+        created_at, transaction_id = decode_transaction_cursor(after)
+        page_query = {**query, "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": transaction_id}}
+        ]}
     
-    total = await db.transactions.count_documents(query)
-    transactions = await db.transactions.find(query, {"_id": 0})\
-        .sort("created_at", -1)\
-        .skip(offset)\
-        .limit(limit)\
-        .to_list(limit)
+    cursor = db.transactions.find(page_query, {"_id": 0})\
+        .sort([("created_at", -1), ("id", -1)])
+    if offset and not after:
+        cursor = cursor.skip(offset)
+    # One extra row tells whether another page exists
+    transactions = await cursor.limit(limit + 1).to_list(limit + 1)
     
-    return {"transactions": transactions, "total": total}
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_transaction_cursor(transactions[-1])
+    
+    return {"transactions": transactions, "total": total, "next_cursor": next_cursor}
 
 @api_router.get("/v1/transactions/{transaction_id}")
 async def get_transaction(
@@ -678,7 +2161,7 @@ async def get_transaction(
         raise HTTPException(status_code=404, detail="Transaksi tidak ditemukan")
     
     # Get tenant info for receipt
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(current_user["tenant_id"])
     
     return {
         "transaction": transaction,
@@ -689,45 +2172,55 @@ async def get_transaction(
         }
     }
 
-@api_router.post("/v1/transactions", status_code=201)
-async def create_transaction(
-    data: TransactionCreate,
-    current_user: dict = Depends(get_current_user)
+async def fetch_items_by_id(tenant_id: str, item_ids: List[str]) -> Dict[str, dict]:
+    """Fetch catalog items for a cart (or a batch of carts) in one query"""
+    item_ids = list(set(item_ids))
+    items = await db.items.find({
+        "id": {"$in": item_ids},
+        "tenant_id": tenant_id
+    }, {"_id": 0}).to_list(len(item_ids))
+    return {item["id"]: item for item in items}
+
+def build_transaction_items(
+    cart_items: List[Dict[str, Any]],
+    items_by_id: Dict[str, dict],
+    reserved: Optional[Dict[str, int]] = None
 ):
-    """Create new transaction"""
-    if not data.items:
-        raise HTTPException(status_code=400, detail="Keranjang tidak boleh kosong")
+    """Price a cart against the catalog and check stock.
     
-    # Build transaction items and check stock
+    `reserved` holds quantities already claimed by earlier carts in the same
+    batch. Returns (transaction_items, total, items_to_deduct).
+    """
+    reserved = reserved or {}
     transaction_items = []
     total = 0
-    items_to_deduct = []  # Items that need stock deduction
+    items_to_deduct = {}  # item_id -> stock deduction for tracked items
     
-    for cart_item in data.items:
-        item = await db.items.find_one({
-            "id": cart_item["item_id"],
-            "tenant_id": current_user["tenant_id"]
-        }, {"_id": 0})
+    for cart_item in cart_items:
+        item = items_by_id.get(cart_item.get("item_id"))
         
         if not item:
             raise HTTPException(status_code=400, detail=f"Barang tidak ditemukan")
         
         qty = cart_item.get("qty", 1)
+        if qty <= 0:
+            raise HTTPException(status_code=400, detail="Jumlah barang harus lebih dari 0")
         
-        # Check stock if tracking is enabled
+        # Check stock if tracking is enabled (same item may appear on several lines)
         if item.get("track_stock", False):
-            current_stock = item.get("stock", 0)
-            if current_stock < qty:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Stok {item['name']} tidak cukup (tersedia: {current_stock})"
-                )
-            items_to_deduct.append({
+            current_stock = item.get("stock", 0) - reserved.get(item["id"], 0)
+            deduct = items_to_deduct.setdefault(item["id"], {
                 "item_id": item["id"],
                 "item_name": item["name"],
-                "qty": qty,
+                "qty": 0,
                 "stock_before": current_stock
             })
+            deduct["qty"] += qty
+            if current_stock < deduct["qty"]:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Stok {item['name']} tidak cukup (tersedia: {current_stock})"
+                )
         
         subtotal = item["price"] * qty
         
@@ -740,402 +2233,1547 @@ async def create_transaction(
         ))
         total += subtotal
     
-    # Validate payment method
+    return transaction_items, total, items_to_deduct
+
+def validate_payment(payment_method: str, payment_amount: int, total: int):
+    """Validate payment for a total. Returns (payment_amount, change_amount)."""
     valid_methods = ["tunai", "qris", "transfer"]
-    if data.payment_method not in valid_methods:
+    if payment_method not in valid_methods:
         raise HTTPException(status_code=400, detail="Metode pembayaran tidak valid")
     
     # Validate payment - only for tunai need to check amount
-    if data.payment_method == "tunai":
-        if data.payment_amount < total:
+    if payment_method == "tunai":
+        if payment_amount < total:
             raise HTTPException(status_code=400, detail="Pembayaran kurang dari total")
-        change_amount = data.payment_amount - total
+        return payment_amount, payment_amount - total
+    
+    # For QRIS/Transfer, payment amount should be exact
+    return max(payment_amount, total), 0  # Auto-set to total for non-cash
+
+def transaction_response(transaction_dict: dict, tenant: Optional[dict]) -> dict:
+    """Checkout response: the transaction plus the receipt header"""
+    return {
+        **transaction_dict,
+        "receipt": {
+            "business_name": tenant["name"] if tenant else "Toko",
+            "address": tenant.get("address", "") if tenant else "",
+            "phone": tenant.get("phone", "") if tenant else ""
+        }
+    }
+
+async def recover_transaction(tenant_id: str, idempotency_key: str) -> Optional[dict]:
+    """Checkout response of the sale already committed under an Idempotency-Key, if any"""
+    transaction = await db.transactions.find_one(
+        {"tenant_id": tenant_id, "idempotency_key": idempotency_key}, {"_id": 0}
+    )
+    if not transaction:
+        return None
+    return transaction_response(transaction, await get_tenant(tenant_id))
+
+async def process_transaction(data: TransactionCreate, current_user: dict, idempotency_key: Optional[str] = None) -> dict:
+    """Validate the cart, deduct stock and save a new transaction"""
+    if not data.items:
+        raise HTTPException(status_code=400, detail="Keranjang tidak boleh kosong")
+    
+    items_by_id = await fetch_items_by_id(
+        current_user["tenant_id"],
+        [cart_item.get("item_id") for cart_item in data.items]
+    )
+    transaction_items, total, items_to_deduct = build_transaction_items(data.items, items_by_id)
+    data.payment_amount, change_amount = validate_payment(data.payment_method, data.payment_amount, total)
+    
+    # Tenant for the business day and the receipt
+    tenant = await get_tenant(current_user["tenant_id"])
+    tz = tenant_timezone(tenant)
+    
+    # The counter is outside the session: a retried callback reuses its number
+    numbered = {}
+    
+    async def save_transaction(session):
+        # Reserve stock first so a short item never consumes a transaction number
+        stock_before = await deduct_stock(current_user["tenant_id"], items_to_deduct, session=session)
+        transaction_saved = False
+        try:
+            # Generate transaction number
+            if not numbered:
+                numbered["created_at"] = datetime.now(timezone.utc)
+                numbered["business_date"] = to_business_date(numbered["created_at"], tz)
+                numbered["number"] = await generate_transaction_number(current_user["tenant_id"], numbered["business_date"])
+            created_at = numbered["created_at"]
+            business_date = numbered["business_date"]
+            transaction_number = numbered["number"]
+            
+            # Create transaction
+            transaction = Transaction(
+                tenant_id=current_user["tenant_id"],
+                transaction_number=transaction_number,
+                items=[item.model_dump() for item in transaction_items],
+                total=total,
+                final_total=total,
+                payment_method=data.payment_method,
+                payment_amount=data.payment_amount,
+                change_amount=change_amount,
+                payment_reference=data.payment_reference,
+                idempotency_key=idempotency_key,
+                created_by=current_user["id"],
+                created_by_name=current_user["name"],
+                created_at=created_at,
+                business_date=business_date
+            )
+            
+            transaction_dict = transaction.model_dump()
+            
+            # Stock adjustment records, using the stock actually seen by each $inc
+            stock_adjustments = []
+            for item_id, before in stock_before.items():
+                item_deduct = items_to_deduct[item_id]
+                stock_adj = StockAdjustment(
+                    tenant_id=current_user["tenant_id"],
+                    item_id=item_id,
+                    item_name=item_deduct["item_name"],
+                    adjustment_type="sale",
+                    quantity=item_deduct["qty"],
+                    stock_before=before,
+                    stock_after=before - item_deduct["qty"],
+                    reason=f"Penjualan #{transaction_number}",
+                    transaction_id=transaction_dict["id"],
+                    created_by=current_user["id"],
+                    created_by_name=current_user["name"]
+                )
+                stock_adj_dict = stock_adj.model_dump()
+                stock_adjustments.append(stock_adj_dict)
+            
+            await db.transactions.insert_one(transaction_dict, session=session)
+            transaction_saved = True
+            if stock_adjustments:
+                await db.stock_adjustments.insert_many(stock_adjustments, ordered=False, session=session)
+            await write_rollups(current_user["tenant_id"], [transaction_dict], session=session)
+        except BaseException:
+            if session is None:
+                # No replica set: compensate by hand (also when cancelled)
+                if transaction_saved:
+                    await db.transactions.delete_one({"id": transaction_dict["id"]})
+                    await db.stock_adjustments.delete_many({"transaction_id": transaction_dict["id"]})
+                await restore_stock(current_user["tenant_id"], {
+                    item_id: items_to_deduct[item_id]["qty"] for item_id in stock_before
+                })
+            raise
+        return transaction_dict
+    
+    transaction_dict = await run_atomic(save_transaction)
+    await notify_sales_committed(current_user["tenant_id"], [transaction_dict])
+    
+    # Remove MongoDB _id before returning
+    transaction_dict.pop("_id", None)
+    
+    return transaction_response(transaction_dict, tenant)
+
+@api_router.post("/v1/transactions", status_code=201)
+async def create_transaction(
+    data: TransactionCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Create new transaction"""
+    return await run_idempotent(
+        idempotency_key, current_user, "create_transaction", data.model_dump(),
+        lambda key: process_transaction(data, current_user, key),
+        lambda key: recover_transaction(current_user["tenant_id"], key)
+    )
+
+@api_router.post("/v1/transactions/batch")
+async def sync_transactions_batch(
+    data: TransactionBatch,
+    current_user: dict = Depends(get_current_user)
+):
+    """Sync sales recorded while an outlet was offline.
+    
+    All sales are checked against one catalog fetch, numbered with one
+    counter reservation per business day and written with bulk inserts.
+    Returns one result per sale, in request order.
+    """
+    if not data.sales:
+        raise HTTPException(status_code=400, detail="Tidak ada transaksi untuk disinkronkan")
+    if len(data.sales) > BATCH_SYNC_MAX_SALES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maksimal {BATCH_SYNC_MAX_SALES} transaksi per sinkronisasi"
+        )
+    
+    tenant_id = current_user["tenant_id"]
+    tz = tenant_timezone(await get_tenant(tenant_id))
+    now = datetime.now(timezone.utc)
+    
+    # Sales already stored by an earlier (retried) upload
+    client_ids = list({sale.client_id for sale in data.sales})
+    existing = await db.transactions.find(
+        # $type lets the planner use the partial (tenant_id, client_id) index
+        {"tenant_id": tenant_id, "client_id": {"$in": client_ids, "$type": "string"}},
+        {"_id": 0, "id": 1, "client_id": 1, "transaction_number": 1}
+    ).to_list(len(client_ids))
+    synced = {t["client_id"]: t for t in existing}
+    
+    items_by_id = await fetch_items_by_id(
+        tenant_id,
+        [line.get("item_id") for sale in data.sales for line in sale.items]
+    )
+    
+    results: List[Optional[dict]] = [None] * len(data.sales)
+    accepted = []
+    reserved = {}  # item_id -> qty claimed by earlier sales in this batch
+    first_copy = {}  # client_id -> index of the sale accepted from this batch
+    later_copies = []  # (index, client_id) of repeats of such a sale
+    
+    def price_sale(entry: dict, items_by_id: Dict[str, dict], reserved: Dict[str, int]):
+        """Price and stock-check a sale against the catalog, claiming its stock in `reserved`"""
+        sale = entry["sale"]
+        transaction_items, total, items_to_deduct = build_transaction_items(sale.items, items_by_id, reserved)
+        payment_amount, change_amount = validate_payment(sale.payment_method, sale.payment_amount, total)
+        for item_id, item_deduct in items_to_deduct.items():
+            reserved[item_id] = reserved.get(item_id, 0) + item_deduct["qty"]
+        entry.update({
+            "transaction_items": transaction_items,
+            "total": total,
+            "payment_amount": payment_amount,
+            "change_amount": change_amount,
+            "items_to_deduct": items_to_deduct
+        })
+    
+    def sale_time(sale: OfflineSale) -> datetime:
+        created_at = sale.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return created_at.astimezone(timezone.utc)
+    
+    # Claim stock in the order the sales actually happened
+    for index, sale in sorted(enumerate(data.sales), key=lambda pair: sale_time(pair[1])):
+        if sale.client_id in first_copy:
+            later_copies.append((index, sale.client_id))
+            continue
+        if sale.client_id in synced:
+            previous = synced[sale.client_id]
+            results[index] = {
+                "client_id": sale.client_id,
+                "status": "duplicate",
+                "transaction_id": previous.get("id"),
+                "transaction_number": previous.get("transaction_number")
+            }
+            continue
+        
+        entry = {"index": index, "sale": sale, "created_at": sale_time(sale)}
+        try:
+            if not sale.items:
+                raise HTTPException(status_code=400, detail="Keranjang tidak boleh kosong")
+            if entry["created_at"] > now + timedelta(minutes=5):
+                raise HTTPException(status_code=400, detail="Waktu transaksi tidak valid")
+            price_sale(entry, items_by_id, reserved)
+        except HTTPException as e:
+            results[index] = {"client_id": sale.client_id, "status": "error", "detail": e.detail}
+            continue
+        
+        first_copy[sale.client_id] = index
+        accepted.append(entry)
+    
+    async def save_accepted():
+        # Whole-batch stock deduction, one guarded $inc per distinct item
+        batch_deduct = {}
+        for entry in accepted:
+            for item_id, item_deduct in entry["items_to_deduct"].items():
+                total_deduct = batch_deduct.setdefault(item_id, {
+                    "item_id": item_id,
+                    "item_name": item_deduct["item_name"],
+                    "qty": 0
+                })
+                total_deduct["qty"] += item_deduct["qty"]
+        
+        async def save_batch(session):
+            stock_before = await deduct_stock(tenant_id, batch_deduct, session=session)
+            transaction_ids = []
+            try:
+                # One counter reservation per business day in the batch; sales
+                # numbered by an earlier (retried) attempt keep their numbers
+                by_day = {}
+                for entry in accepted:
+                    if "transaction_number" not in entry:
+                        entry["business_date"] = to_business_date(entry["created_at"], tz)
+                        by_day.setdefault(entry["business_date"], []).append(entry)
+                for day, entries in by_day.items():
+                    numbers = await reserve_transaction_numbers(tenant_id, day.replace("-", ""), len(entries))
+                    for entry, number in zip(entries, numbers):
+                        entry["transaction_number"] = number
+                
+                running_stock = dict(stock_before)
+                transaction_docs = []
+                stock_adjustments = []
+                for entry in accepted:
+                    sale = entry["sale"]
+                    transaction = Transaction(
+                        tenant_id=tenant_id,
+                        transaction_number=entry["transaction_number"],
+                        items=[item.model_dump() for item in entry["transaction_items"]],
+                        total=entry["total"],
+                        final_total=entry["total"],
+                        payment_method=sale.payment_method,
+                        payment_amount=entry["payment_amount"],
+                        change_amount=entry["change_amount"],
+                        payment_reference=sale.payment_reference,
+                        client_id=sale.client_id,
+                        created_by=current_user["id"],
+                        created_by_name=current_user["name"],
+                        created_at=entry["created_at"],
+                        business_date=entry["business_date"]
+                    )
+                    transaction_dict = transaction.model_dump()
+                    transaction_docs.append(transaction_dict)
+                    entry["transaction_id"] = transaction_dict["id"]
+                    
+                    for item_id, item_deduct in entry["items_to_deduct"].items():
+                        before = running_stock[item_id]
+                        running_stock[item_id] = before - item_deduct["qty"]
+                        stock_adj = StockAdjustment(
+                            tenant_id=tenant_id,
+                            item_id=item_id,
+                            item_name=item_deduct["item_name"],
+                            adjustment_type="sale",
+                            quantity=item_deduct["qty"],
+                            stock_before=before,
+                            stock_after=running_stock[item_id],
+                            reason=f"Penjualan #{entry['transaction_number']} (sinkronisasi offline)",
+                            transaction_id=transaction_dict["id"],
+                            created_by=current_user["id"],
+                            created_by_name=current_user["name"]
+                        )
+                        stock_adj_dict = stock_adj.model_dump()
+                        stock_adjustments.append(stock_adj_dict)
+                
+                transaction_ids = [t["id"] for t in transaction_docs]
+                await db.transactions.insert_many(transaction_docs, ordered=False, session=session)
+                if stock_adjustments:
+                    await db.stock_adjustments.insert_many(stock_adjustments, ordered=False, session=session)
+                await write_rollups(tenant_id, transaction_docs, session=session)
+            except BaseException:
+                if session is None:
+                    # No replica set: compensate by hand (also when cancelled)
+                    if transaction_ids:
+                        await db.transactions.delete_many({"id": {"$in": transaction_ids}})
+                        await db.stock_adjustments.delete_many({"transaction_id": {"$in": transaction_ids}})
+                    await restore_stock(tenant_id, {
+                        item_id: batch_deduct[item_id]["qty"] for item_id in stock_before
+                    })
+                raise
+            return transaction_docs
+        
+        return await run_atomic(save_batch)
+    
+    async def reprice_accepted() -> List[dict]:
+        """Stock moved since validation: re-check every pending sale against fresh stock"""
+        fresh_items = await fetch_items_by_id(
+            tenant_id,
+            [line.get("item_id") for entry in accepted for line in entry["sale"].items]
+        )
+        fresh_reserved = {}
+        still_accepted = []
+        for entry in accepted:
+            try:
+                price_sale(entry, fresh_items, fresh_reserved)
+                still_accepted.append(entry)
+            except HTTPException as e:
+                results[entry["index"]] = {"client_id": entry["sale"].client_id, "status": "error", "detail": e.detail}
+        return still_accepted
+    
+    async def drop_duplicates(error: BulkWriteError) -> List[dict]:
+        """A concurrent upload stored some of these client_ids first: report those as duplicates"""
+        duplicate_ids = {
+            write_error["op"]["client_id"]
+            for write_error in error.details.get("writeErrors", [])
+            if write_error.get("code") == 11000 and write_error.get("op", {}).get("client_id")
+        }
+        if not duplicate_ids:
+            raise error
+        stored = await db.transactions.find(
+            {"tenant_id": tenant_id, "client_id": {"$in": list(duplicate_ids), "$type": "string"}},
+            {"_id": 0, "id": 1, "client_id": 1, "transaction_number": 1}
+        ).to_list(len(duplicate_ids))
+        stored_by_client = {t["client_id"]: t for t in stored}
+        for entry in accepted:
+            client_id = entry["sale"].client_id
+            if client_id in duplicate_ids:
+                previous = stored_by_client.get(client_id, {})
+                results[entry["index"]] = {
+                    "client_id": client_id,
+                    "status": "duplicate",
+                    "transaction_id": previous.get("id"),
+                    "transaction_number": previous.get("transaction_number")
+                }
+        return [entry for entry in accepted if entry["sale"].client_id not in duplicate_ids]
+    
+    # Each failed attempt is rolled back whole; the sales that caused it are
+    # resolved per sale and the rest are saved again
+    transaction_docs = []
+    for attempt in range(BATCH_SYNC_MAX_ATTEMPTS):
+        if not accepted:
+            break
+        try:
+            transaction_docs = await save_accepted()
+            break
+        except HTTPException:
+            accepted = await reprice_accepted()
+        except BulkWriteError as e:
+            accepted = await drop_duplicates(e)
     else:
-        # For QRIS/Transfer, payment amount should be exact
-        change_amount = 0
-        if data.payment_amount < total:
-            data.payment_amount = total  # Auto-set to total for non-cash
+        for entry in accepted:
+            results[entry["index"]] = {
+                "client_id": entry["sale"].client_id,
+                "status": "error",
+                "detail": "Stok berubah saat sinkronisasi, silakan sinkronkan ulang"
+            }
+        accepted = []
     
-    # Generate transaction number
-    transaction_number = await generate_transaction_number(current_user["tenant_id"])
+    if transaction_docs:
+        await notify_sales_committed(tenant_id, transaction_docs)
     
-    # Create transaction
-    transaction = Transaction(
-        tenant_id=current_user["tenant_id"],
-        transaction_number=transaction_number,
-        items=[item.model_dump() for item in transaction_items],
-        total=total,
-        final_total=total,
-        payment_method=data.payment_method,
-        payment_amount=data.payment_amount,
-        change_amount=change_amount,
-        payment_reference=data.payment_reference,
-        created_by=current_user["id"],
-        created_by_name=current_user["name"]
+    for entry in accepted:
+        results[entry["index"]] = {
+            "client_id": entry["sale"].client_id,
+            "status": "created",
+            "transaction_id": entry["transaction_id"],
+            "transaction_number": entry["transaction_number"]
+        }
+    
+    # A repeated client_id shares the outcome of its first copy
+    for index, client_id in later_copies:
+        original = results[first_copy[client_id]]
+        if original["status"] == "error":
+            results[index] = dict(original)
+        else:
+            results[index] = {
+                "client_id": client_id,
+                "status": "duplicate",
+                "transaction_id": original["transaction_id"],
+                "transaction_number": original["transaction_number"]
+            }
+    
+    return {
+        "results": results,
+        "summary": {
+            "created": len([r for r in results if r["status"] == "created"]),
+            "duplicate": len([r for r in results if r["status"] == "duplicate"]),
+            "error": len([r for r in results if r["status"] == "error"])
+        }
+    }
+
+def void_response(transaction: dict, voided_by_name: str) -> dict:
+    return {
+        "message": "Transaksi berhasil dibatalkan",
+        "transaction_id": transaction["id"],
+        "voided_by": voided_by_name,
+        "reason": transaction["void_reason"]
+    }
+
+async def recover_void(tenant_id: str, transaction_id: str, idempotency_key: str, current_user: dict) -> Optional[dict]:
+    """Void response if the transaction was already voided under this Idempotency-Key"""
+    transaction = await db.transactions.find_one(
+        {"id": transaction_id, "tenant_id": tenant_id, "void_idempotency_key": idempotency_key},
+        {"_id": 0, "id": 1, "void_reason": 1}
+    )
+    return void_response(transaction, current_user["name"]) if transaction else None
+
+async def process_void(transaction_id: str, data: TransactionVoid, current_user: dict, idempotency_key: Optional[str] = None) -> dict:
+    """Void a transaction and return its stock"""
+    # Find transaction
+    transaction = await db.transactions.find_one({
+        "id": transaction_id,
+        "tenant_id": current_user["tenant_id"]
+    }, {"_id": 0})
+    
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaksi tidak ditemukan")
+    
+    if transaction.get("status") == "void":
+        raise HTTPException(status_code=400, detail="Transaksi sudah dibatalkan")
+    
+    # Quantity to give back per item (same item may appear on several lines)
+    quantities = {}
+    item_names = {}
+    for trans_item in transaction.get("items", []):
+        quantities[trans_item["item_id"]] = quantities.get(trans_item["item_id"], 0) + trans_item["qty"]
+        item_names[trans_item["item_id"]] = trans_item["name"]
+    
+    void_fields = {
+        "status": "void",
+        "voided_at": datetime.now(timezone.utc),
+        "voided_by": current_user["id"],
+        "void_reason": data.reason,
+        "void_idempotency_key": idempotency_key
+    }
+    
+    async def save_void(session):
+        # Flip status first, conditional on selesai, so only one concurrent void wins
+        result = await db.transactions.update_one(
+            {"id": transaction_id, "tenant_id": current_user["tenant_id"], "status": "selesai"},
+            {"$set": void_fields},
+            session=session
+        )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Transaksi sudah dibatalkan")
+        
+        stock_restored = {}
+        try:
+            # Return stock for voided items that still track stock
+            items = await db.items.find({
+                "id": {"$in": list(quantities.keys())},
+                "tenant_id": current_user["tenant_id"],
+                "track_stock": True
+            }, {"_id": 0, "id": 1, "stock": 1}, session=session).to_list(len(quantities))
+            
+            stock_adjustments = []
+            for item in items:
+                qty = quantities[item["id"]]
+                current_stock = item.get("stock", 0)
+                stock_adj = StockAdjustment(
+                    tenant_id=current_user["tenant_id"],
+                    item_id=item["id"],
+                    item_name=item_names[item["id"]],
+                    adjustment_type="void_return",
+                    quantity=qty,
+                    stock_before=current_stock,
+                    stock_after=current_stock + qty,
+                    reason=f"Pembatalan #{transaction['transaction_number']}: {data.reason}",
+                    transaction_id=transaction_id,
+                    created_by=current_user["id"],
+                    created_by_name=current_user["name"]
+                )
+                stock_adj_dict = stock_adj.model_dump()
+                stock_adjustments.append(stock_adj_dict)
+            
+            if stock_adjustments:
+                to_restore = {item["id"]: quantities[item["id"]] for item in items}
+                await restore_stock(current_user["tenant_id"], to_restore, session=session)
+                stock_restored = to_restore
+                await db.stock_adjustments.insert_many(stock_adjustments, ordered=False, session=session)
+            await write_rollups(current_user["tenant_id"], [transaction], sign=-1, session=session)
+        except BaseException:
+            if session is None:
+                # No replica set: compensate by hand (also when cancelled)
+                if stock_restored:
+                    await restore_stock(current_user["tenant_id"], {
+                        item_id: -qty for item_id, qty in stock_restored.items()
+                    })
+                    await db.stock_adjustments.delete_many({
+                        "transaction_id": transaction_id,
+                        "adjustment_type": "void_return"
+                    })
+                await db.transactions.update_one(
+                    {"id": transaction_id},
+                    {
+                        "$set": {"status": "selesai"},
+                        "$unset": {"voided_at": "", "voided_by": "", "void_reason": "", "void_idempotency_key": ""}
+                    }
+                )
+            raise
+    
+    await run_atomic(save_void)
+    await notify_sales_committed(current_user["tenant_id"], [transaction], sign=-1)
+    
+    return void_response({"id": transaction_id, "void_reason": data.reason}, current_user["name"])
+
+@api_router.post("/v1/transactions/{transaction_id}/void")
+async def void_transaction(
+    transaction_id: str,
+    data: TransactionVoid,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Void/cancel a transaction (owner only)"""
+    require_owner(current_user)
+    
+    return await run_idempotent(
+        idempotency_key, current_user, f"void_transaction:{transaction_id}", data.model_dump(),
+        lambda key: process_void(transaction_id, data, current_user, key),
+        lambda key: recover_void(current_user["tenant_id"], transaction_id, key, current_user)
     )
+
+# ============== REPORTS ROUTES ==============
+
+# Summary, payment breakdown, items and daily series computed in one pass by MongoDB
+REPORT_SUMMARY_FACETS = {
+    "totals": [
+        {"$group": {"_id": None, "total_sales": {"$sum": "$total"}, "total_transactions": {"$sum": 1}}}
+    ],
+    "payment_breakdown": [
+        {"$group": {
+            "_id": {"$ifNull": ["$payment_method", "tunai"]},
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$total"}
+        }}
+    ],
+    # One row per item name, so bounded by the catalog size
+    "items": [
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$items.name",
+            "qty": {"$sum": "$items.qty"},
+            "revenue": {"$sum": "$items.subtotal"}
+        }},
+        {"$sort": {"revenue": -1, "_id": 1}}
+    ],
+    "daily_sales": [
+        {"$group": {"_id": "$business_date", "transactions": {"$sum": 1}, "amount": {"$sum": "$total"}}},
+        {"$sort": {"_id": 1}}
+    ]
+}
+
+def shape_report_summary(facets: dict) -> dict:
+    """Turn the REPORT_SUMMARY_FACETS result into the report response body"""
+    totals = facets.get("totals") or [{}]
+    total_sales = totals[0].get("total_sales", 0)
+    total_transactions = totals[0].get("total_transactions", 0)
+    items = facets.get("items", [])
+    
+    return {
+        "summary": {
+            "total_sales": total_sales,
+            "total_sales_formatted": format_rupiah(total_sales),
+            "total_transactions": total_transactions,
+            "total_items_sold": sum(item["qty"] for item in items),
+            "avg_transaction": total_sales // total_transactions if total_transactions > 0 else 0
+        },
+        "payment_breakdown": {
+            row["_id"]: {"count": row["count"], "amount": row["amount"]}
+            for row in facets.get("payment_breakdown", [])
+        },
+        "top_items": [
+            {"name": item["_id"], "qty": item["qty"], "revenue": item["revenue"]}
+            for item in items[:10]
+        ],
+        "daily_sales": {
+            row["_id"]: {"transactions": row["transactions"], "amount": row["amount"]}
+            for row in facets.get("daily_sales", [])
+        }
+    }
+
+@api_router.get("/v1/reports/summary")
+async def get_report_summary(
+    start_date: str = None,
+    end_date: str = None,
+    source: str = "rollups",
+    current_user: dict = Depends(get_current_user)
+):
+    """Get sales summary report for date range.
+    
+    Reads one daily rollup per day; source=transactions recomputes it from
+    the raw transactions instead.
+    """
+    require_owner(current_user)
+    
+    # Default to today if no dates provided
+    if not start_date:
+        start_date = await get_tenant_today(current_user["tenant_id"])
+    if not end_date:
+        end_date = start_date
     
-    transaction_dict = transaction.model_dump()
-    transaction_dict["created_at"] = transaction_dict["created_at"].isoformat()
-    await db.transactions.insert_one(transaction_dict)
+    if source not in ["rollups", "transactions"]:
+        raise HTTPException(status_code=400, detail="Sumber laporan tidak valid")
+    start_date = parse_report_date(start_date).isoformat()
+    end_date = parse_report_date(end_date).isoformat()
     
-    # Deduct stock and create stock adjustments
-    for item_deduct in items_to_deduct:
-        new_stock = item_deduct["stock_before"] - item_deduct["qty"]
-        await db.items.update_one(
-            {"id": item_deduct["item_id"]},
-            {"$set": {"stock": new_stock}}
-        )
+    async def compute():
+        if source == "rollups":
+            rollups = await load_rollups([current_user["tenant_id"]], start_date, end_date)
+            facets = rollups_to_facets(rollups)
+        else:
+            # Range scan on the business day
+            query = {
+                "tenant_id": current_user["tenant_id"],
+                "business_date": {"$gte": start_date, "$lte": end_date},
+                "status": "selesai"
+            }
+            
+            result = await db.transactions.aggregate([
+                {"$match": query},
+                {"$facet": REPORT_SUMMARY_FACETS}
+            ]).to_list(1)
+            facets = result[0] if result else {}
         
-        # Create stock adjustment record
-        stock_adj = StockAdjustment(
-            tenant_id=current_user["tenant_id"],
-            item_id=item_deduct["item_id"],
-            item_name=item_deduct["item_name"],
-            adjustment_type="sale",
-            quantity=item_deduct["qty"],
-            stock_before=item_deduct["stock_before"],
-            stock_after=new_stock,
-            reason=f"Penjualan #{transaction_number}",
-            transaction_id=transaction_dict["id"],
-            created_by=current_user["id"],
-            created_by_name=current_user["name"]
-        )
-        stock_adj_dict = stock_adj.model_dump()
-        stock_adj_dict["created_at"] = stock_adj_dict["created_at"].isoformat()
-        await db.stock_adjustments.insert_one(stock_adj_dict)
+        return {
+            "period": {
+                "start_date": start_date,
+                "end_date": end_date
+            },
+            **shape_report_summary(facets)
+        }
     
-    # Remove MongoDB _id before returning
-    transaction_dict.pop("_id", None)
+    return await cached_report(
+        current_user["tenant_id"], "summary",
+        {"start_date": start_date, "end_date": end_date, "source": source},
+        compute
+    )
+
+@api_router.get("/v1/reports/daily")
+async def get_daily_report(
+    date: str = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get detailed daily report"""
+    if not date:
+        date = await get_tenant_today(current_user["tenant_id"])
     
-    # Get tenant for receipt
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    async def compute():
+        # Get transactions for the day
+        transactions = await db.transactions.find({
+            "tenant_id": current_user["tenant_id"],
+            "business_date": date
+        }, {"_id": 0}).sort("created_at", -1).to_list(1000)
+        
+        # Separate by status
+        completed = [t for t in transactions if t.get("status") == "selesai"]
+        voided = [t for t in transactions if t.get("status") == "void"]
+        
+        total_sales = sum(t["total"] for t in completed)
+        total_voided = sum(t["total"] for t in voided)
+        
+        return {
+            "date": date,
+            "summary": {
+                "total_sales": total_sales,
+                "total_sales_formatted": format_rupiah(total_sales),
+                "total_transactions": len(completed),
+                "total_voided": len(voided),
+                "voided_amount": total_voided
+            },
+            "transactions": transactions
+        }
     
+    return await cached_report(current_user["tenant_id"], "daily", {"date": date}, compute)
+
+EXPORT_FIELDS = ["transaction_number", "date", "time", "items", "total", "payment_method", "status", "cashier"]
+EXPORT_PROJECTION = {
+    "_id": 0, "transaction_number": 1, "business_date": 1, "created_at": 1, "items": 1,
+    "total": 1, "payment_method": 1, "status": 1, "created_by_name": 1
+}
+
+def flatten_export_row(t: dict, tz: ZoneInfo) -> dict:
+    """Flatten a transaction into one export row (local time of the tenant)"""
     return {
-        **transaction_dict,
-        "receipt": {
-            "business_name": tenant["name"] if tenant else "Toko",
-            "address": tenant.get("address", "") if tenant else "",
-            "phone": tenant.get("phone", "") if tenant else ""
-        }
+        "transaction_number": t["transaction_number"],
+        "date": t["business_date"],
+        "time": t["created_at"].astimezone(tz).strftime("%H:%M:%S"),
+        "items": ", ".join([f"{item['name']} x{item['qty']}" for item in t["items"]]),
+        "total": t["total"],
+        "payment_method": t.get("payment_method", "tunai"),
+        "status": t.get("status", "selesai"),
+        "cashier": t.get("created_by_name", "")
     }
 
-@api_router.post("/v1/transactions/{transaction_id}/void")
-async def void_transaction(
-    transaction_id: str,
-    data: TransactionVoid,
+EXPORT_GRANULARITIES = ("transaction", "item")
+EXPORT_PARQUET_SCHEMAS = {
+    "transaction": pa.schema([
+        ("id", pa.string()),
+        ("transaction_number", pa.string()),
+        ("business_date", pa.date32()),
+        ("created_at", pa.timestamp("ms", tz="UTC")),
+        ("item_count", pa.int32()),
+        ("total", pa.int64()),
+        ("payment_method", pa.string()),
+        ("payment_amount", pa.int64()),
+        ("change_amount", pa.int64()),
+        ("status", pa.string()),
+        ("voided_at", pa.timestamp("ms", tz="UTC")),
+        ("cashier", pa.string()),
+    ]),
+    "item": pa.schema([
+        ("transaction_id", pa.string()),
+        ("transaction_number", pa.string()),
+        ("business_date", pa.date32()),
+        ("created_at", pa.timestamp("ms", tz="UTC")),
+        ("item_id", pa.string()),
+        ("item_name", pa.string()),
+        ("qty", pa.int32()),
+        ("price", pa.int64()),
+        ("subtotal", pa.int64()),
+        ("payment_method", pa.string()),
+        ("status", pa.string()),
+        ("cashier", pa.string()),
+    ]),
+}
+
+def parquet_export_rows(t: dict, granularity: str) -> List[dict]:
+    """One row per transaction, or one per line item"""
+    common = {
+        "transaction_number": t["transaction_number"],
+        "business_date": date.fromisoformat(t["business_date"]),
+        "created_at": t["created_at"],
+        "payment_method": t.get("payment_method", "tunai"),
+        "status": t.get("status", "selesai"),
+        "cashier": t.get("created_by_name", "")
+    }
+    if granularity == "item":
+        return [{
+            **common,
+            "transaction_id": t["id"],
+            "item_id": item["item_id"],
+            "item_name": item["name"],
+            "qty": item["qty"],
+            "price": item["price"],
+            "subtotal": item["subtotal"]
+        } for item in t["items"]]
+    return [{
+        **common,
+        "id": t["id"],
+        "item_count": sum(item["qty"] for item in t["items"]),
+        "total": t["total"],
+        "payment_amount": t.get("payment_amount", t["total"]),
+        "change_amount": t.get("change_amount", 0),
+        "voided_at": t.get("voided_at")
+    }]
+
+class ParquetExportWriter:
+    """Buffers export rows and writes them to a Parquet file one row group at a time"""
+    def __init__(self, path: str, granularity: str):
+        self.granularity = granularity
+        self.schema = EXPORT_PARQUET_SCHEMAS[granularity]
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.rows = []
+        self.written = 0
+    
+    def add(self, t: dict) -> bool:
+        """Buffer a transaction's rows; True once a row group is ready to flush"""
+        new_rows = parquet_export_rows(t, self.granularity)
+        self.rows.extend(new_rows)
+        self.written += len(new_rows)
+        return len(self.rows) >= EXPORT_BATCH_SIZE
+    
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+    
+    def close(self):
+        self.writer.close()
+
+async def write_export_parquet(query: dict, granularity: str, path: str) -> int:
+    """Write the export to a Parquet file one row group per cursor batch; returns row count"""
+    export = ParquetExportWriter(path, granularity)
+    try:
+        cursor = db.transactions.find(query, {"_id": 0})\
+            .sort("created_at", 1)\
+            .batch_size(EXPORT_BATCH_SIZE)
+        async for t in cursor:
+            if export.add(t):
+                # Encoding/compression is CPU-bound; keep it off the event loop
+                await asyncio.to_thread(export.flush)
+        await asyncio.to_thread(export.flush)
+    finally:
+        export.close()
+    return export.written
+
+async def stream_export_csv(query: dict, tz: ZoneInfo):
+    """Yield CSV in ~64 KB chunks straight from the cursor, so memory stays flat for any range"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    
+    cursor = db.transactions.find(query, EXPORT_PROJECTION)\
+        .sort("created_at", 1)\
+        .batch_size(EXPORT_BATCH_SIZE)
+    async for t in cursor:
+        writer.writerow(flatten_export_row(t, tz))
+        if output.tell() >= EXPORT_CHUNK_BYTES:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    
+    yield output.getvalue()
+
+@api_router.get("/v1/reports/export")
+async def export_report(
+    start_date: str = None,
+    end_date: str = None,
+    format: str = "json",
+    granularity: str = "transaction",
     current_user: dict = Depends(get_current_user)
 ):
-    """Void/cancel a transaction (owner only)"""
+    """Export report data"""
     require_owner(current_user)
     
-    # Find transaction
-    transaction = await db.transactions.find_one({
-        "id": transaction_id,
-        "tenant_id": current_user["tenant_id"]
-    })
+    if granularity not in EXPORT_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Granularity harus 'transaction' atau 'item'")
     
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaksi tidak ditemukan")
+    tz = tenant_timezone(await get_tenant(current_user["tenant_id"]))
+    if not start_date:
+        start_date = to_business_date(datetime.now(timezone.utc), tz)
+    if not end_date:
+        end_date = start_date
+    # Normalized: they end up in the download filename
+    start_date = parse_report_date(start_date).isoformat()
+    end_date = parse_report_date(end_date).isoformat()
     
-    if transaction.get("status") == "void":
-        raise HTTPException(status_code=400, detail="Transaksi sudah dibatalkan")
+    # Range scan on the business day
+    query = {
+        "tenant_id": current_user["tenant_id"],
+        "business_date": {"$gte": start_date, "$lte": end_date}
+    }
     
-    # Return stock for voided items
-    for trans_item in transaction.get("items", []):
-        item = await db.items.find_one({
-            "id": trans_item["item_id"],
-            "tenant_id": current_user["tenant_id"]
-        })
+    if format == "csv":
+        return StreamingResponse(
+            stream_export_csv(query, tz),
+            media_type="text/csv; charset=utf-8",
+            headers={
+                "Content-Disposition": f'attachment; filename="laporan_{start_date}_to_{end_date}.csv"'
+            }
+        )
+    
+    if format == "parquet":
+        fd, path = tempfile.mkstemp(prefix="aikasir_export_", suffix=".parquet")
+        os.close(fd)
+        try:
+            await write_export_parquet(query, granularity, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return FileResponse(
+            path,
+            media_type="application/vnd.apache.parquet",
+            filename=f"laporan_{start_date}_to_{end_date}_{granularity}.parquet",
+            background=BackgroundTask(os.remove, path)
+        )
+    
+    # Streamed files above are not cached: that would mean buffering them whole
+    async def compute():
+        transactions = await db.transactions.find(query, EXPORT_PROJECTION)\
+            .sort("created_at", 1)\
+            .to_list(10000)
+        filtered_transactions = [flatten_export_row(t, tz) for t in transactions]
         
-        if item and item.get("track_stock", False):
-            current_stock = item.get("stock", 0)
-            new_stock = current_stock + trans_item["qty"]
-            
-            await db.items.update_one(
-                {"id": trans_item["item_id"]},
-                {"$set": {"stock": new_stock}}
-            )
-            
-            # Create stock adjustment for void return
-            stock_adj = StockAdjustment(
-                tenant_id=current_user["tenant_id"],
-                item_id=trans_item["item_id"],
-                item_name=trans_item["name"],
-                adjustment_type="void_return",
-                quantity=trans_item["qty"],
-                stock_before=current_stock,
-                stock_after=new_stock,
-                reason=f"Pembatalan #{transaction['transaction_number']}: {data.reason}",
-                transaction_id=transaction_id,
-                created_by=current_user["id"],
-                created_by_name=current_user["name"]
-            )
-            stock_adj_dict = stock_adj.model_dump()
-            stock_adj_dict["created_at"] = stock_adj_dict["created_at"].isoformat()
-            await db.stock_adjustments.insert_one(stock_adj_dict)
+        return {
+            "format": "json",
+            "period": {"start_date": start_date, "end_date": end_date},
+            "total_records": len(filtered_transactions),
+            "data": filtered_transactions
+        }
     
-    # Update transaction status
-    await db.transactions.update_one(
-        {"id": transaction_id},
+    return await cached_report(
+        current_user["tenant_id"], "export",
+        {"start_date": start_date, "end_date": end_date},
+        compute
+    )
+
+# ============== EXPORT JOBS ==============
+
+# format -> (media type, file extension)
+EXPORT_JOB_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+def new_export_executor() -> ProcessPoolExecutor:
+    # Building rows is pure Python, so jobs run in their own processes (not
+    # threads sharing the event loop's GIL). Spawned, not forked: each worker
+    # imports this module afresh and gets its own sync_client.
+    return ProcessPoolExecutor(max_workers=EXPORT_JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+export_executor = new_export_executor()
+# Blocking client for export worker processes; Motor is tied to the event loop
+sync_client = MongoClient(mongo_url, tz_aware=True)
+sync_db = sync_client[os.environ.get('DB_NAME', 'aikasir_db')]
+
+def export_job_public(job: dict) -> dict:
+    """Job document as returned by the API (without the server-side file path)"""
+    return {key: value for key, value in job.items() if key not in ("_id", "file_path", "owner", "lease_expires_at", "attempts")}
+
+def export_job_filename(job: dict) -> str:
+    extension = EXPORT_JOB_FORMATS[job["format"]][1]
+    suffix = f"_{job['granularity']}" if job["format"] == "parquet" else ""
+    return f"laporan_{job['start_date']}_to_{job['end_date']}{suffix}.{extension}"
+
+def write_export_csv_file(cursor, tz: ZoneInfo, path: Path, on_progress) -> int:
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for t in cursor:
+            writer.writerow(flatten_export_row(t, tz))
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                on_progress(count)
+    return count
+
+def write_export_parquet_file(cursor, granularity: str, path: Path, on_progress) -> int:
+    export = ParquetExportWriter(str(path), granularity)
+    count = 0
+    try:
+        for t in cursor:
+            count += 1
+            if export.add(t):
+                export.flush()
+                on_progress(count)
+        export.flush()
+    finally:
+        export.close()
+    return count
+
+def cleanup_export_files():
+    """Delete export files older than EXPORT_JOB_TTL_HOURS (their job documents expire by TTL index)"""
+    if not EXPORT_DIR.exists():
+        return
+    cutoff = time.time() - EXPORT_JOB_TTL_HOURS * 3600
+    for path in EXPORT_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+class ExportLeaseLost(Exception):
+    """Another process took the job over; stop without touching it"""
+
+def claim_export_job(job_id: str, owner: str) -> Optional[dict]:
+    """Atomically take a queued job, or a running one whose owner stopped renewing its lease"""
+    now = datetime.now(timezone.utc)
+    return sync_db.export_jobs.find_one_and_update(
+        {
+            "id": job_id,
+            "$or": [
+                {"status": "queued"},
+                # $not also matches jobs from before leases existed
+                {"status": "running", "lease_expires_at": {"$not": {"$gte": now}}}
+            ],
+            "attempts": {"$not": {"$gte": EXPORT_JOB_MAX_ATTEMPTS}}
+        },
         {
             "$set": {
-                "status": "void",
-                "voided_at": datetime.now(timezone.utc).isoformat(),
-                "voided_by": current_user["id"],
-                "void_reason": data.reason
-            }
-        }
+                "status": "running",
+                "owner": owner,
+                "lease_expires_at": now + timedelta(seconds=EXPORT_JOB_LEASE_SECONDS),
+                "started_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        return_document=ReturnDocument.AFTER
     )
+
+def renew_export_lease(job_id: str, owner: str, extra: Optional[dict] = None):
+    """Extend our lease (optionally saving progress); raises ExportLeaseLost if the job is no longer ours"""
+    update = {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=EXPORT_JOB_LEASE_SECONDS), **(extra or {})}
+    result = sync_db.export_jobs.update_one({"id": job_id, "owner": owner}, {"$set": update})
+    if not result.matched_count:
+        raise ExportLeaseLost(job_id)
+
+def keep_export_lease(job_id: str, owner: str, stop: threading.Event):
+    """Heartbeat thread: renew the lease between progress updates (e.g. during a slow count)"""
+    while not stop.wait(EXPORT_JOB_LEASE_SECONDS / 3):
+        try:
+            renew_export_lease(job_id, owner)
+        except ExportLeaseLost:
+            return
+        except Exception as e:
+            logger.error(f"Export job {job_id} heartbeat failed: {str(e)}")
+
+def run_export_job(job_id: str):
+    """Worker-process body: write one job's file to EXPORT_DIR, reporting progress in Mongo"""
+    jobs = sync_db.export_jobs
+    owner = str(uuid.uuid4())
+    partial = None
+    stop = threading.Event()
+    try:
+        job = claim_export_job(job_id, owner)
+        if not job:
+            return  # Running elsewhere, finished, or expired
+        threading.Thread(target=keep_export_lease, args=(job_id, owner, stop), daemon=True).start()
+        
+        cleanup_export_files()
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        extension = EXPORT_JOB_FORMATS[job["format"]][1]
+        path = EXPORT_DIR / f"{job_id}.{extension}"
+        # Per owner: a stalled previous owner may still be writing its own
+        partial = EXPORT_DIR / f"{job_id}.{owner}.{extension}.part"
+        
+        tz = tenant_timezone(sync_db.tenants.find_one({"id": job["tenant_id"]}, {"_id": 0, "timezone": 1}))
+        query = {
+            "tenant_id": job["tenant_id"],
+            "business_date": {"$gte": job["start_date"], "$lte": job["end_date"]}
+        }
+        total = sync_db.transactions.count_documents(query)
+        renew_export_lease(job_id, owner, {"total_transactions": total})
+        
+        def on_progress(processed: int):
+            renew_export_lease(job_id, owner, {
+                "processed_transactions": processed,
+                "progress": round(min(processed / total, 1) * 100, 1) if total else 100.0
+            })
+        
+        if job["format"] == "csv":
+            cursor = sync_db.transactions.find(query, EXPORT_PROJECTION)\
+                .sort("created_at", 1)\
+                .batch_size(EXPORT_BATCH_SIZE)
+            processed = write_export_csv_file(cursor, tz, partial, on_progress)
+        else:
+            cursor = sync_db.transactions.find(query, {"_id": 0})\
+                .sort("created_at", 1)\
+                .batch_size(EXPORT_BATCH_SIZE)
+            processed = write_export_parquet_file(cursor, job["granularity"], partial, on_progress)
+        
+        # Only a complete file ever has the final name
+        renew_export_lease(job_id, owner)
+        os.replace(partial, path)
+        jobs.update_one({"id": job_id, "owner": owner}, {"$set": {
+            "status": "done",
+            "processed_transactions": processed,
+            "progress": 100.0,
+            "file_path": str(path),
+            "size_bytes": path.stat().st_size,
+            "finished_at": datetime.now(timezone.utc)
+        }})
+    except ExportLeaseLost:
+        logger.warning(f"Export job {job_id} was taken over by another worker")
+        if partial:
+            partial.unlink(missing_ok=True)
+    except Exception as e:
+        logger.error(f"Export job {job_id} failed: {str(e)}")
+        if partial:
+            partial.unlink(missing_ok=True)
+        jobs.update_one({"id": job_id, "owner": owner}, {"$set": {
+            "status": "failed",
+            "error": "Export gagal, silakan coba lagi",
+            "finished_at": datetime.now(timezone.utc)
+        }})
+    finally:
+        stop.set()
+
+def submit_export_job(job_id: str):
+    """Hand a job to the process pool, replacing the pool if a worker process died"""
+    global export_executor
+    try:
+        export_executor.submit(run_export_job, job_id)
+    except BrokenProcessPool:
+        export_executor = new_export_executor()
+        export_executor.submit(run_export_job, job_id)
+
+async def resume_export_jobs():
+    """Take over jobs no live process is working on; their files are rewritten from scratch.
     
-    return {
-        "message": "Transaksi berhasil dibatalkan",
-        "transaction_id": transaction_id,
-        "voided_by": current_user["name"],
-        "reason": data.reason
-    }
+    Runs periodically on every process. Jobs still under a live lease are
+    left alone, and claim_export_job makes sure only one process wins the rest.
+    """
+    now = datetime.now(timezone.utc)
+    lease_ago = now - timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+    await db.export_jobs.update_many(
+        {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": EXPORT_JOB_MAX_ATTEMPTS}},
+        {"$set": {"status": "failed", "error": "Export gagal, silakan coba lagi", "finished_at": now}}
+    )
+    stranded = db.export_jobs.find({"$or": [
+        # Queued a while ago but never claimed (its process went away first)
+        {"status": "queued", "created_at": {"$lt": lease_ago}},
+        {"status": "running", "lease_expires_at": {"$not": {"$gte": now}}}
+    ]}, {"_id": 0, "id": 1})
+    async for job in stranded:
+        submit_export_job(job["id"])
+    await asyncio.to_thread(cleanup_export_files)
 
-# ============== REPORTS ROUTES ==============
+async def resume_export_jobs_forever():
+    """Background task: pick up jobs left behind by dead or stalled processes"""
+    while True:
+        try:
+            await resume_export_jobs()
+        except Exception as e:
+            logger.error(f"Resuming export jobs failed: {str(e)}")
+        await asyncio.sleep(EXPORT_JOB_LEASE_SECONDS)
 
-@api_router.get("/v1/reports/summary")
-async def get_report_summary(
-    start_date: str = None,
-    end_date: str = None,
+@api_router.post("/v1/reports/export-jobs", status_code=202)
+async def create_export_job(
+    data: ExportJobCreate,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get sales summary report for date range"""
+    """Queue an export for a worker process; poll the job and download the file when done"""
     require_owner(current_user)
     
-    # Default to today if no dates provided
-    if not start_date:
-        start_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    if not end_date:
-        end_date = start_date
-    
-    # Convert dates to transaction number prefix format
-    start_prefix = start_date.replace("-", "")
-    end_prefix = end_date.replace("-", "")
+    if data.format not in EXPORT_JOB_FORMATS:
+        raise HTTPException(status_code=400, detail="Format export harus 'csv' atau 'parquet'")
+    if data.granularity not in EXPORT_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Granularity harus 'transaction' atau 'item'")
+    # Normalized: the job range-queries business_date as strings and names the file with them
+    start_date = parse_report_date(data.start_date).isoformat()
+    end_date = parse_report_date(data.end_date).isoformat()
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="Tanggal mulai harus sebelum tanggal akhir")
     
-    # Build query
-    query = {
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
         "tenant_id": current_user["tenant_id"],
-        "status": "selesai"
+        "created_by": current_user["id"],
+        "format": data.format,
+        "granularity": data.granularity,
+        "start_date": start_date,
+        "end_date": end_date,
+        "status": "queued",  # queued, running, done, failed
+        "progress": 0.0,
+        "total_transactions": None,
+        "processed_transactions": 0,
+        "size_bytes": None,
+        "error": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "expires_at": now + timedelta(hours=EXPORT_JOB_TTL_HOURS)
     }
+    await db.export_jobs.insert_one(job)
+    submit_export_job(job["id"])
+    
+    return export_job_public(job)
+
+@api_router.get("/v1/reports/export-jobs")
+async def list_export_jobs(current_user: dict = Depends(get_current_user)):
+    """Recent export jobs of the tenant"""
+    require_owner(current_user)
+    
+    jobs = await db.export_jobs.find(
+        {"tenant_id": current_user["tenant_id"]},
+        {"_id": 0, "file_path": 0}
+    ).sort("created_at", -1).limit(20).to_list(20)
+    return {"jobs": jobs}
+
+async def get_export_job_or_404(job_id: str, current_user: dict) -> dict:
+    require_owner(current_user)
+    job = await db.export_jobs.find_one({"id": job_id, "tenant_id": current_user["tenant_id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export tidak ditemukan")
+    return job
+
+@api_router.get("/v1/reports/export-jobs/{job_id}")
+async def get_export_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Status and progress of an export job"""
+    return export_job_public(await get_export_job_or_404(job_id, current_user))
+
+@api_router.get("/v1/reports/export-jobs/{job_id}/download")
+async def download_export_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Download the finished export file"""
+    job = await get_export_job_or_404(job_id, current_user)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Export belum selesai")
+    if not os.path.exists(job["file_path"]):
+        raise HTTPException(status_code=410, detail="File export sudah kedaluwarsa")
     
-    # Get all transactions in range
-    transactions = await db.transactions.find(query, {"_id": 0}).to_list(10000)
+    return FileResponse(
+        job["file_path"],
+        media_type=EXPORT_JOB_FORMATS[job["format"]][0],
+        filename=export_job_filename(job)
+    )
+
+# ============== ANALYTICS ROUTES (see analytics.py) ==============
+
+async def load_analytics_columns(tenant_id: str, start_date: str, end_date: str, tz: ZoneInfo):
+    """Load a business-day range of completed transactions into columnar arrays, one cursor batch at a time"""
+    builder = ColumnBuilder(tz)
+    cursor = db.transactions.aggregate([
+        {"$match": {
+            "tenant_id": tenant_id,
+            "business_date": {"$gte": start_date, "$lte": end_date},
+            "status": "selesai"
+        }},
+        {"$project": ANALYTICS_ROW}
+    ], batchSize=EXPORT_BATCH_SIZE)
+    while True:
+        rows = await cursor.to_list(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        builder.add_batch(rows)
+    return builder.build()
+
+async def transaction_mix_reports(tenant_id: str, start_date: str, end_date: str, tz: ZoneInfo) -> dict:
+    """Hourly heatmap and basket sizes of a range, computed together from one load (and cached together)"""
+    async def compute():
+        cols = await load_analytics_columns(tenant_id, start_date, end_date, tz)
+        return {"hourly_heatmap": hourly_heatmap(cols), "basket_sizes": basket_sizes(cols)}
     
-    # Filter by date range
-    filtered_transactions = []
-    for t in transactions:
-        tx_date = t["transaction_number"][:8]
-        if start_prefix <= tx_date <= end_prefix:
-            filtered_transactions.append(t)
+    return await cached_report(tenant_id, "transaction_mix", {"start_date": start_date, "end_date": end_date}, compute)
+
+async def week_over_week_report(tenant_id: str, end_date: str, weeks: int) -> dict:
+    """Weekly totals from daily_rollups for the `weeks` weeks ending with end_date's week"""
+    first_monday = week_start(date.fromisoformat(end_date)) - timedelta(weeks=weeks - 1)
     
-    # Calculate summary
-    total_sales = sum(t["total"] for t in filtered_transactions)
-    total_transactions = len(filtered_transactions)
+    async def compute():
+        rollups = await load_rollups([tenant_id], first_monday.isoformat(), end_date)
+        return {
+            "period": {"start_date": first_monday.isoformat(), "end_date": end_date},
+            "weeks": week_over_week(rollups, first_monday, weeks)
+        }
     
-    # Payment method breakdown
-    payment_breakdown = {}
-    for t in filtered_transactions:
-        method = t.get("payment_method", "tunai")
-        if method not in payment_breakdown:
-            payment_breakdown[method] = {"count": 0, "amount": 0}
-        payment_breakdown[method]["count"] += 1
-        payment_breakdown[method]["amount"] += t["total"]
-    
-    # Items breakdown
-    items_summary = {}
-    total_items_sold = 0
-    for t in filtered_transactions:
-        for item in t["items"]:
-            name = item["name"]
-            qty = item["qty"]
-            if name not in items_summary:
-                items_summary[name] = {"qty": 0, "revenue": 0}
-            items_summary[name]["qty"] += qty
-            items_summary[name]["revenue"] += item["subtotal"]
-            total_items_sold += qty
-    
-    # Sort items by revenue
-    top_items = sorted(
-        [{"name": k, **v} for k, v in items_summary.items()],
-        key=lambda x: x["revenue"],
-        reverse=True
-    )[:10]
-    
-    # Daily breakdown (for charts)
-    daily_sales = {}
-    for t in filtered_transactions:
-        tx_date = t["transaction_number"][:8]
-        formatted_date = f"{tx_date[:4]}-{tx_date[4:6]}-{tx_date[6:8]}"
-        if formatted_date not in daily_sales:
-            daily_sales[formatted_date] = {"transactions": 0, "amount": 0}
-        daily_sales[formatted_date]["transactions"] += 1
-        daily_sales[formatted_date]["amount"] += t["total"]
+    return await cached_report(tenant_id, "week_over_week", {"end_date": end_date, "weeks": weeks}, compute)
+
+def check_analytics_weeks(weeks: int):
+    if not 1 <= weeks <= ANALYTICS_MAX_WEEKS:
+        raise HTTPException(status_code=400, detail=f"Jumlah minggu harus 1-{ANALYTICS_MAX_WEEKS}")
+
+async def analytics_date_range(tenant_id: str, start_date: Optional[str], end_date: Optional[str]):
+    """Resolve and validate a report range; defaults to the last 28 days"""
+    tz = tenant_timezone(await get_tenant(tenant_id))
+    end = parse_report_date(end_date) if end_date else parse_report_date(to_business_date(datetime.now(timezone.utc), tz))
+    start = parse_report_date(start_date) if start_date else end - timedelta(days=27)
+    if start > end:
+        raise HTTPException(status_code=400, detail="Tanggal mulai harus sebelum tanggal akhir")
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Rentang tanggal maksimal {ANALYTICS_MAX_DAYS} hari")
+    return start.isoformat(), end.isoformat(), tz
+
+@api_router.get("/v1/reports/analytics")
+async def get_analytics_reports(
+    start_date: str = None,
+    end_date: str = None,
+    weeks: int = 8,
+    current_user: dict = Depends(get_current_user)
+):
+    """Week-over-week, hourly heatmap and basket sizes in one request (the range is loaded once)"""
+    require_owner(current_user)
     
+    check_analytics_weeks(weeks)
+    start_date, end_date, tz = await analytics_date_range(current_user["tenant_id"], start_date, end_date)
+    mix = await transaction_mix_reports(current_user["tenant_id"], start_date, end_date, tz)
     return {
-        "period": {
-            "start_date": start_date,
-            "end_date": end_date
-        },
-        "summary": {
-            "total_sales": total_sales,
-            "total_sales_formatted": format_rupiah(total_sales),
-            "total_transactions": total_transactions,
-            "total_items_sold": total_items_sold,
-            "avg_transaction": total_sales // total_transactions if total_transactions > 0 else 0
-        },
-        "payment_breakdown": payment_breakdown,
-        "top_items": top_items,
-        "daily_sales": daily_sales
+        "period": {"start_date": start_date, "end_date": end_date},
+        "week_over_week": await week_over_week_report(current_user["tenant_id"], end_date, weeks),
+        **mix
     }
 
-@api_router.get("/v1/reports/daily")
-async def get_daily_report(
-    date: str = None,
+@api_router.get("/v1/reports/week-over-week")
+async def get_week_over_week_report(
+    end_date: str = None,
+    weeks: int = 8,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get detailed daily report"""
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    """Weekly sales (Monday start) for the last `weeks` weeks, with change vs the week before"""
+    require_owner(current_user)
     
-    date_prefix = date.replace("-", "")
+    check_analytics_weeks(weeks)
+    _, end_date, _ = await analytics_date_range(current_user["tenant_id"], None, end_date)
+    return await week_over_week_report(current_user["tenant_id"], end_date, weeks)
+
+@api_router.get("/v1/reports/hourly-heatmap")
+async def get_hourly_heatmap_report(
+    start_date: str = None,
+    end_date: str = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Sales by weekday x hour of day (tenant's local time)"""
+    require_owner(current_user)
     
-    # Get transactions for the day
-    transactions = await db.transactions.find({
-        "tenant_id": current_user["tenant_id"],
-        "transaction_number": {"$regex": f"^{date_prefix}"}
-    }, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    start_date, end_date, tz = await analytics_date_range(current_user["tenant_id"], start_date, end_date)
+    mix = await transaction_mix_reports(current_user["tenant_id"], start_date, end_date, tz)
+    return {"period": {"start_date": start_date, "end_date": end_date}, **mix["hourly_heatmap"]}
+
+@api_router.get("/v1/reports/basket-sizes")
+async def get_basket_sizes_report(
+    start_date: str = None,
+    end_date: str = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Distribution of items per transaction and average basket value per size"""
+    require_owner(current_user)
+    
+    start_date, end_date, tz = await analytics_date_range(current_user["tenant_id"], start_date, end_date)
+    mix = await transaction_mix_reports(current_user["tenant_id"], start_date, end_date, tz)
+    return {"period": {"start_date": start_date, "end_date": end_date}, **mix["basket_sizes"]}
+
+# ============== MULTI-OUTLET ROUTES ==============
+
+async def get_outlets(tenant_id: str) -> List[dict]:
+    """All outlets in the tenant's group (just the tenant itself when not linked)"""
+    tenant = await get_tenant(tenant_id)
+    if not tenant:
+        raise HTTPException(status_code=404, detail="Toko tidak ditemukan")
+    if not tenant.get("group_id"):
+        return [tenant]
+    return await db.tenants.find(
+        {"group_id": tenant["group_id"]},
+        {"_id": 0}
+    ).sort("name", 1).to_list(None)
+
+def outlet_public(tenant: dict) -> dict:
+    return {
+        "id": tenant["id"],
+        "name": tenant["name"],
+        "subdomain": tenant.get("subdomain"),
+        "timezone": tenant.get("timezone", DEFAULT_TIMEZONE)
+    }
+
+@api_router.get("/v1/outlets")
+async def list_outlets(current_user: dict = Depends(get_current_user)):
+    """Outlets the current owner has linked together"""
+    require_owner(current_user)
+    outlets = await get_outlets(current_user["tenant_id"])
+    return {"outlets": [outlet_public(outlet) for outlet in outlets]}
+
+@api_router.post("/v1/outlets/link")
+async def link_outlet(
+    data: OutletLinkRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Link another shop into this owner's group, proven with that shop's owner login"""
+    require_owner(current_user)
+    
+    # 400 rather than 401: a wrong password here must not log the current session out
+    other_user = await db.users.find_one({"email": data.email}, {"_id": 0})
+    if not other_user or not await verify_password(data.password, other_user["password"]):
+        raise HTTPException(status_code=400, detail="Email atau password pemilik toko lain salah")
+    if other_user.get("role") != "pemilik" or not other_user.get("is_active", True):
+        raise HTTPException(status_code=400, detail="Akun tersebut bukan pemilik toko yang aktif")
+    if other_user["tenant_id"] == current_user["tenant_id"]:
+        raise HTTPException(status_code=400, detail="Toko ini sudah merupakan toko Anda")
     
-    # Separate by status
-    completed = [t for t in transactions if t.get("status") == "selesai"]
-    voided = [t for t in transactions if t.get("status") == "void"]
+    tenant = await get_tenant(current_user["tenant_id"])
+    other_tenant = await get_tenant(other_user["tenant_id"])
+    if not tenant or not other_tenant:
+        raise HTTPException(status_code=404, detail="Toko tidak ditemukan")
     
-    total_sales = sum(t["total"] for t in completed)
-    total_voided = sum(t["total"] for t in voided)
+    group_id = tenant.get("group_id") or other_tenant.get("group_id") or str(uuid.uuid4())
+    # Both shops already in groups: merge the other group into this one
+    linked_groups = [
+        g for g in {tenant.get("group_id"), other_tenant.get("group_id")}
+        if g and g != group_id
+    ]
+    await db.tenants.update_many(
+        {"$or": [
+            {"id": {"$in": [tenant["id"], other_tenant["id"]]}},
+            {"group_id": {"$in": linked_groups}}
+        ]},
+        {"$set": {"group_id": group_id}}
+    )
+    # Tenant documents are cached; merging groups may touch outlets beyond these two
+    if linked_groups:
+        tenant_cache.clear()
+    else:
+        tenant_cache.invalidate(tenant["id"])
+        tenant_cache.invalidate(other_tenant["id"])
     
+    outlets = await get_outlets(current_user["tenant_id"])
     return {
-        "date": date,
-        "summary": {
-            "total_sales": total_sales,
-            "total_sales_formatted": format_rupiah(total_sales),
-            "total_transactions": len(completed),
-            "total_voided": len(voided),
-            "voided_amount": total_voided
-        },
-        "transactions": transactions
+        "message": f"{other_tenant['name']} berhasil ditambahkan ke grup toko Anda",
+        "outlets": [outlet_public(outlet) for outlet in outlets]
     }
 
-@api_router.get("/v1/reports/export")
-async def export_report(
+@api_router.delete("/v1/outlets/{tenant_id}")
+async def unlink_outlet(tenant_id: str, current_user: dict = Depends(get_current_user)):
+    """Remove an outlet from the owner's group"""
+    require_owner(current_user)
+    
+    outlets = await get_outlets(current_user["tenant_id"])
+    if len(outlets) < 2 or tenant_id not in {outlet["id"] for outlet in outlets}:
+        raise HTTPException(status_code=404, detail="Toko tidak ditemukan di grup Anda")
+    
+    await db.tenants.update_one({"id": tenant_id}, {"$set": {"group_id": None}})
+    tenant_cache.invalidate(tenant_id)
+    return {"message": "Toko berhasil dilepas dari grup"}
+
+@api_router.get("/v1/reports/consolidated")
+async def get_consolidated_report(
     start_date: str = None,
     end_date: str = None,
-    format: str = "json",
+    tenant_ids: str = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Export report data"""
+    """Chain-level summary across linked outlets, with a per-outlet breakdown.
+    
+    One daily_rollups query covers every outlet; `tenant_ids` (comma
+    separated) narrows it to some of them.
+    """
     require_owner(current_user)
     
+    outlets = {outlet["id"]: outlet for outlet in await get_outlets(current_user["tenant_id"])}
+    if tenant_ids:
+        selected = list(dict.fromkeys(t.strip() for t in tenant_ids.split(",") if t.strip()))
+        if not selected or any(t not in outlets for t in selected):
+            raise HTTPException(status_code=403, detail="Toko tidak termasuk dalam grup Anda")
+    else:
+        selected = list(outlets)
+    
     if not start_date:
-        start_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        start_date = await get_tenant_today(current_user["tenant_id"])
     if not end_date:
         end_date = start_date
+    start_date = parse_report_date(start_date).isoformat()
+    end_date = parse_report_date(end_date).isoformat()
     
-    start_prefix = start_date.replace("-", "")
-    end_prefix = end_date.replace("-", "")
-    
-    # Get all transactions in range
-    transactions = await db.transactions.find({
-        "tenant_id": current_user["tenant_id"]
-    }, {"_id": 0}).to_list(10000)
-    
-    # Filter by date range
-    filtered_transactions = []
-    for t in transactions:
-        tx_date = t["transaction_number"][:8]
-        if start_prefix <= tx_date <= end_prefix:
-            # Flatten for export
-            filtered_transactions.append({
-                "transaction_number": t["transaction_number"],
-                "date": t.get("created_at", "")[:10] if t.get("created_at") else "",
-                "time": t.get("created_at", "")[11:19] if t.get("created_at") else "",
-                "items": ", ".join([f"{item['name']} x{item['qty']}" for item in t["items"]]),
-                "total": t["total"],
-                "payment_method": t.get("payment_method", "tunai"),
-                "status": t.get("status", "selesai"),
-                "cashier": t.get("created_by_name", "")
-            })
-    
-    if format == "csv":
-        # Generate CSV
-        import csv
-        import io
+    async def compute():
+        rollups = await load_rollups(selected, start_date, end_date)
         
-        output = io.StringIO()
-        if filtered_transactions:
-            writer = csv.DictWriter(output, fieldnames=filtered_transactions[0].keys())
-            writer.writeheader()
-            writer.writerows(filtered_transactions)
+        by_outlet = {tenant_id: [] for tenant_id in selected}
+        for rollup in rollups:
+            by_outlet[rollup["tenant_id"]].append(rollup)
         
         return {
-            "format": "csv",
-            "data": output.getvalue(),
-            "filename": f"laporan_{start_date}_to_{end_date}.csv"
+            "period": {"start_date": start_date, "end_date": end_date},
+            "outlet_count": len(selected),
+            "consolidated": shape_report_summary(rollups_to_facets(rollups)),
+            "outlets": [
+                {"tenant_id": tenant_id, "name": outlets[tenant_id]["name"], **shape_report_summary(rollups_to_facets(rows))}
+                for tenant_id, rows in by_outlet.items()
+            ]
         }
     
-    return {
-        "format": "json",
-        "period": {"start_date": start_date, "end_date": end_date},
-        "total_records": len(filtered_transactions),
-        "data": filtered_transactions
-    }
+    # A sale in any of the outlets makes the cached result stale
+    return await cached_report(
+        current_user["tenant_id"], "consolidated",
+        {"start_date": start_date, "end_date": end_date, "tenant_ids": selected},
+        compute,
+        tenant_ids=selected
+    )
 
 # ============== DASHBOARD ROUTES ==============
 
 @api_router.get("/v1/dashboard/today")
 async def get_dashboard_today(current_user: dict = Depends(get_current_user)):
-    """Get today's dashboard summary"""
-    today = datetime.now(timezone.utc).strftime("%Y%m%d")
-    
-    # Get today's transactions
-    transactions = await db.transactions.find({
-        "tenant_id": current_user["tenant_id"],
-        "transaction_number": {"$regex": f"^{today}"},
-        "status": "selesai"
-    }, {"_id": 0}).to_list(1000)
-    
-    total_sales = sum(t["total"] for t in transactions)
-    total_transactions = len(transactions)
-    
-    # Calculate items sold and top items
-    items_count = {}
-    items_revenue = {}
-    total_items_sold = 0
-    
-    for t in transactions:
-        for item in t["items"]:
-            name = item["name"]
-            qty = item["qty"]
-            items_count[name] = items_count.get(name, 0) + qty
-            items_revenue[name] = items_revenue.get(name, 0) + item["subtotal"]
-            total_items_sold += qty
-    
-    # Sort by quantity to get top items
-    top_items = sorted(
-        [{"name": k, "qty": v, "revenue": items_revenue[k]} for k, v in items_count.items()],
-        key=lambda x: x["qty"],
-        reverse=True
-    )[:5]
+    """Get today's dashboard summary (served from the live counters)"""
+    today = await get_tenant_today(current_user["tenant_id"])
+    await live_dashboard.ensure_today(current_user["tenant_id"], today)
+    return live_dashboard.snapshot(current_user["tenant_id"])
+
+async def stream_still_authorized(user_id: str, token_version: int) -> bool:
+    """Re-check a long-lived stream's user: still active and the token not revoked since it connected"""
+    if token_revocations.is_revoked(user_id, token_version):
+        return False
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "is_active": 1, "token_version": 1})
+    if not user or not user.get("is_active", True):
+        return False
+    return user.get("token_version", 0) <= token_version
+
+async def dashboard_events(tenant_id: str, user_id: str, token_version: int):
+    """SSE stream: the current snapshot, then one event per change plus keepalives.
     
-    return {
-        "date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-        "total_sales": total_sales,
-        "total_sales_formatted": format_rupiah(total_sales),
-        "total_transactions": total_transactions,
-        "total_items_sold": total_items_sold,
-        "top_items": top_items
-    }
+    Auth is re-checked at most every DASHBOARD_SSE_KEEPALIVE_SECONDS; the
+    stream ends once the user is disabled or their tokens are revoked.
+    """
+    queue = live_dashboard.subscribe(tenant_id)
+    try:
+        today = await get_tenant_today(tenant_id)
+        await live_dashboard.ensure_today(tenant_id, today)
+        yield f"event: dashboard\ndata: {json.dumps(live_dashboard.snapshot(tenant_id))}\n\n"
+        checked_at = time.monotonic()
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), timeout=DASHBOARD_SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                snapshot = None
+            if time.monotonic() - checked_at >= DASHBOARD_SSE_KEEPALIVE_SECONDS:
+                if not await stream_still_authorized(user_id, token_version):
+                    return
+                checked_at = time.monotonic()
+            if snapshot is None:
+                # Quiet period: also the moment to notice the business day rolling over
+                await live_dashboard.ensure_today(tenant_id, await get_tenant_today(tenant_id))
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: dashboard\ndata: {json.dumps(snapshot)}\n\n"
+    finally:
+        live_dashboard.unsubscribe(tenant_id, queue)
+
+@api_router.get("/v1/dashboard/stream")
+async def stream_dashboard(current_user: dict = Depends(get_current_user)):
+    """Push today's dashboard over Server-Sent Events whenever a sale or void lands"""
+    return StreamingResponse(
+        dashboard_events(current_user["tenant_id"], current_user["id"], current_user.get("token_version", 0)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # ============== STOCK MANAGEMENT ROUTES (Phase 4) ==============
 
@@ -1273,7 +3911,6 @@ async def adjust_stock(
         created_by_name=current_user["name"]
     )
     stock_adj_dict = stock_adj.model_dump()
-    stock_adj_dict["created_at"] = stock_adj_dict["created_at"].isoformat()
     await db.stock_adjustments.insert_one(stock_adj_dict)
     
     return {
@@ -1317,7 +3954,7 @@ async def get_stock_history(
 @api_router.get("/v1/settings")
 async def get_settings(current_user: dict = Depends(get_current_user)):
     """Get tenant settings"""
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(current_user["tenant_id"])
     if not tenant:
         raise HTTPException(status_code=404, detail="Toko tidak ditemukan")
     return tenant
@@ -1338,14 +3975,23 @@ async def update_settings(
         update_data["address"] = data["address"]
     if "phone" in data:
         update_data["phone"] = data["phone"]
+    if "timezone" in data:
+        try:
+            ZoneInfo(data["timezone"])
+        except Exception:
+            raise HTTPException(status_code=400, detail="Zona waktu tidak valid")
+        update_data["timezone"] = data["timezone"]
     
     if update_data:
         await db.tenants.update_one(
             {"id": current_user["tenant_id"]},
             {"$set": update_data}
         )
+        tenant_cache.invalidate(current_user["tenant_id"])
+        # Timezone and business details feed into reports
+        await bump_tenant_version(current_user["tenant_id"])
     
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(current_user["tenant_id"])
     return tenant
 
 # ============== USER MANAGEMENT ROUTES ==============
@@ -1396,7 +4042,7 @@ async def invite_user(
     user_dict.pop("_id", None)
     
     # Get tenant for invite link
-    tenant = await db.tenants.find_one({"id": current_user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(current_user["tenant_id"])
     
     return {
         "user": {
@@ -1430,23 +4076,22 @@ async def accept_invite(data: AcceptInvite):
         {"id": user["id"]},
         {
             "$set": {
-                "password": hash_password(data.password),
+                "password": await hash_password(data.password),
                 "status": "active",
                 "invite_token": None,
                 "is_active": True
             }
         }
     )
-    
-    # Create token for auto-login
-    token = create_token(user["id"], user["tenant_id"])
+    principal_cache.invalidate(user["id"])
     
     # Get tenant
-    tenant = await db.tenants.find_one({"id": user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(user["tenant_id"])
     
     return {
         "message": "Selamat datang! Akun kamu sudah aktif",
-        "token": token,
+        # Auto-login
+        **(await issue_tokens(user)),
         "user": {
             "id": user["id"],
             "name": user["name"],
@@ -1471,7 +4116,7 @@ async def get_invite_info(token: str):
         raise HTTPException(status_code=400, detail="Undangan sudah digunakan")
     
     # Get tenant info
-    tenant = await db.tenants.find_one({"id": user["tenant_id"]}, {"_id": 0})
+    tenant = await get_tenant(user["tenant_id"])
     
     # Get inviter info
     inviter = await db.users.find_one({"id": user.get("invited_by")}, {"_id": 0})
@@ -1515,6 +4160,11 @@ async def update_user(
     
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        # A new role or a disabled account must take effect on live sessions;
+        # a rename can wait for the next token refresh
+        if any(key in update_data and update_data[key] != user.get(key, default)
+               for key, default in (("role", None), ("is_active", True))):
+            await revoke_user_tokens(user_id)
     
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0, "invite_token": 0})
     return updated_user
@@ -1543,6 +4193,7 @@ async def delete_user(
         {"id": user_id},
         {"$set": {"is_active": False, "status": "disabled"}}
     )
+    await revoke_user_tokens(user_id)
     
     return {"message": "Karyawan berhasil dihapus"}
 
@@ -1551,7 +4202,7 @@ async def delete_user(
 @api_router.get("/v1/tenant/check/{subdomain}")
 async def check_subdomain(subdomain: str):
     """Check if subdomain exists and get tenant info"""
-    tenant = await db.tenants.find_one({"subdomain": subdomain.lower()}, {"_id": 0})
+    tenant = await db.tenants.find_one({"subdomain": subdomain.lower()}, {"_id": 0, "write_version": 0})
     if not tenant:
         raise HTTPException(status_code=404, detail="Toko tidak ditemukan")
     
@@ -1567,7 +4218,7 @@ async def check_subdomain(subdomain: str):
 @api_router.get("/v1/tenant/by-subdomain/{subdomain}")
 async def get_tenant_by_subdomain(subdomain: str):
     """Get full tenant info by subdomain (for public pages)"""
-    tenant = await db.tenants.find_one({"subdomain": subdomain.lower()}, {"_id": 0})
+    tenant = await db.tenants.find_one({"subdomain": subdomain.lower()}, {"_id": 0, "write_version": 0})
     if not tenant:
         raise HTTPException(status_code=404, detail="Toko tidak ditemukan")
     
@@ -1589,6 +4240,18 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@api_router.get("/health/password-hashing")
+async def password_hashing_stats(current_user: dict = Depends(get_current_user)):
+    """Bcrypt pool load and queue-time percentiles (per worker process, owner only)"""
+    require_owner(current_user)
+    return password_hasher.stats()
+
+@api_router.get("/health/cache")
+async def cache_stats(current_user: dict = Depends(get_current_user)):
+    """Hit/miss counters of the in-process caches (per worker, owner only)"""
+    require_owner(current_user)
+    return {"caches": [cache.stats() for cache in CACHES], "live_dashboard": live_dashboard.stats()}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1598,8 +4261,38 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend read the export filename
+    expose_headers=["Content-Disposition"],
 )
 
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_token_revocations():
+    app.state.revocation_task = asyncio.create_task(reload_token_revocations_forever())
+
+@app.on_event("startup")
+async def startup_export_jobs():
+    app.state.export_resume_task = asyncio.create_task(resume_export_jobs_forever())
+
+@app.on_event("startup")
+async def startup_live_dashboard():
+    try:
+        await seed_live_dashboard()
+    except Exception as e:
+        # Not fatal: counters are loaded on each tenant's first read instead
+        logger.error(f"Live dashboard seeding failed: {str(e)}")
+    app.state.dashboard_sync_task = asyncio.create_task(sync_live_dashboard_forever())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.revocation_task.cancel()
+    app.state.dashboard_sync_task.cancel()
+    app.state.export_resume_task.cancel()
+    export_executor.shutdown(wait=False, cancel_futures=True)
+    password_hasher.executor.shutdown(wait=False, cancel_futures=True)
+    await openai_client.close()
     client.close()
+    sync_client.close()
@@ -7,8 +7,10 @@ Tests all Phase 1 functionality including AI Onboarding, Auth, Items, Transactio
 import requests
 import json
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 class AIKasirTester:
     def __init__(self, base_url="https://tenant-pos-5.preview.emergentagent.com"):
@@ -45,10 +47,10 @@ class AIKasirTester:
             print(f"    {details}")
         return success
 
-    def make_request(self, method, endpoint, data=None, expected_status=200):
+    def make_request(self, method, endpoint, data=None, expected_status=200, extra_headers=None):
         """Make HTTP request with proper headers"""
         url = f"{self.base_url}/api{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(extra_headers or {})}
         
         if self.token:
             headers['Authorization'] = f'Bearer {self.token}'
@@ -297,6 +299,417 @@ class AIKasirTester:
             data
         )
 
+    def test_transaction_pagination(self, sales=5, page_size=2):
+        """Keyset pagination: stable across equal created_at, 400 on a bad cursor, null cursor on the last page"""
+        print("\n📄 Testing Transaction Pagination...")
+        
+        if not self.token:
+            return self.log_test("Transaction Pagination", False, "No token available")
+        
+        test_item = {
+            "name": f"Paging Item {datetime.now().strftime('%H%M%S')}",
+            "price": 1000,
+            "track_stock": False
+        }
+        success, item = self.make_request('POST', '/v1/items', test_item, expected_status=201)
+        if not success:
+            return self.log_test("Create Paging Item", False, f"Error: {item}", item)
+        
+        # Offline sales stamped with one identical created_at on a quiet past day
+        same_time = (datetime.now(timezone.utc) - timedelta(days=5)).replace(hour=12, minute=0, second=0, microsecond=123000)
+        prefix = uuid.uuid4().hex[:8]
+        batch = {"sales": [{
+            "client_id": f"{prefix}-{n}",
+            "created_at": same_time.isoformat(),
+            "items": [{"item_id": item['id'], "qty": 1}],
+            "payment_method": "tunai",
+            "payment_amount": 1000
+        } for n in range(sales)]}
+        success, data = self.make_request('POST', '/v1/transactions/batch', batch)
+        created = {r.get('transaction_id') for r in data.get('results', []) if r.get('status') == 'created'} if success else set()
+        
+        day = same_time.strftime('%Y-%m-%d')
+        seen, pages, after, last_page = [], 0, None, None
+        while pages < 100:
+            endpoint = f'/v1/transactions?date={day}&limit={page_size}' + (f'&after={after}' if after else '')
+            success, last_page = self.make_request('GET', endpoint)
+            if not success:
+                break
+            seen.extend(t['id'] for t in last_page.get('transactions', []))
+            pages += 1
+            after = last_page.get('next_cursor')
+            if not after:
+                break
+        
+        stable = len(created) == sales and len(seen) == len(set(seen)) and created <= set(seen)
+        self.log_test(
+            "Pagination With Equal created_at",
+            stable,
+            f"{sales} sales at one instant, {len(seen)} rows over {pages} page(s), {len(seen) - len(set(seen))} repeated",
+            {"created": len(created), "seen": len(seen)}
+        )
+        
+        last_null = success and last_page is not None and last_page.get('next_cursor') is None
+        self.log_test(
+            "Pagination Last Page Cursor",
+            last_null,
+            f"Last page next_cursor: {last_page.get('next_cursor') if last_page else None}",
+            last_page
+        )
+        
+        ok_bad, bad = self.make_request('GET', '/v1/transactions?after=not-a-cursor', expected_status=400)
+        self.log_test(
+            "Pagination Malformed Cursor",
+            ok_bad,
+            f"Response: {bad.get('detail')}",
+            bad
+        )
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{item['id']}")
+        
+        return stable and last_null and ok_bad
+
+    def test_concurrent_checkout_no_oversell(self, stock=5, checkouts=200):
+        """Fire many parallel checkouts at one low-stock item and check nothing is oversold"""
+        print("\n🏁 Testing Concurrent Checkout (Oversell)...")
+        
+        if not self.token:
+            return self.log_test("Concurrent Checkout", False, "No token available")
+        
+        test_item = {
+            "name": f"Stress Item {datetime.now().strftime('%H%M%S')}",
+            "price": 1000,
+            "track_stock": True,
+            "stock": stock
+        }
+        success, item = self.make_request('POST', '/v1/items', test_item, expected_status=201)
+        if not success:
+            return self.log_test("Create Low-Stock Item", False, f"Error: {item}", item)
+        
+        checkout = {
+            "items": [{"item_id": item['id'], "qty": 1}],
+            "payment_method": "tunai",
+            "payment_amount": 1000
+        }
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            results = list(pool.map(
+                lambda _: self.make_request('POST', '/v1/transactions', checkout, expected_status=201),
+                range(checkouts)
+            ))
+        sold = sum(1 for ok, _ in results if ok)
+        
+        success, stock_data = self.make_request('GET', f"/v1/stock/{item['id']}/history", None)
+        remaining = stock_data.get('item', {}).get('stock') if success else None
+        sale_records = len([h for h in stock_data.get('history', []) if h.get('adjustment_type') == 'sale']) if success else None
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{item['id']}")
+        
+        return self.log_test(
+            "Concurrent Checkout No Oversell",
+            sold == stock and remaining == 0 and sale_records == stock,
+            f"{checkouts} checkouts, stock {stock}: sold {sold}, remaining {remaining}, sale records {sale_records}",
+            {"sold": sold, "remaining": remaining}
+        )
+
+    def test_checkout_all_or_nothing(self, carts=50, short_stock=5, dashboard_sync_wait=3):
+        """Multi-item carts racing for a scarce item: a cart that fails on one line leaves no trace of the others"""
+        print("\n🧺 Testing Checkout All-or-Nothing...")
+        
+        if not self.token:
+            return self.log_test("Checkout All-or-Nothing", False, "No token available")
+        
+        stamp = datetime.now().strftime('%H%M%S')
+        success, plenty = self.make_request('POST', '/v1/items', {
+            "name": f"Plenty Item {stamp}", "price": 1000, "track_stock": True, "stock": carts * 2
+        }, expected_status=201)
+        success_short, scarce = self.make_request('POST', '/v1/items', {
+            "name": f"Scarce Item {stamp}", "price": 500, "track_stock": True, "stock": short_stock
+        }, expected_status=201)
+        if not success or not success_short:
+            return self.log_test("Create All-or-Nothing Items", False, f"Error: {plenty} / {scarce}")
+        
+        def stock_of(item):
+            ok, data = self.make_request('GET', f"/v1/stock/{item['id']}/history", None)
+            history = data.get('history', []) if ok else []
+            return data.get('item', {}).get('stock') if ok else None, \
+                len([h for h in history if h.get('adjustment_type') == 'sale'])
+        
+        def dashboard():
+            time.sleep(dashboard_sync_wait)
+            _, data = self.make_request('GET', '/v1/dashboard/today')
+            return data.get('total_sales'), data.get('total_transactions')
+        
+        sales_before, count_before = dashboard()
+        
+        # The scarce line is short from the start: rejected before anything is written
+        cart = {
+            "items": [{"item_id": plenty['id'], "qty": 2}, {"item_id": scarce['id'], "qty": short_stock + 1}],
+            "payment_method": "tunai",
+            "payment_amount": 2000 + 500 * (short_stock + 1)
+        }
+        ok_rejected, rejected = self.make_request('POST', '/v1/transactions', cart, expected_status=400)
+        
+        # Every cart passes the stock check on its own; only `short_stock` of them can be written
+        race_cart = {
+            "items": [{"item_id": plenty['id'], "qty": 2}, {"item_id": scarce['id'], "qty": 1}],
+            "payment_method": "tunai",
+            "payment_amount": 2500
+        }
+        with ThreadPoolExecutor(max_workers=carts) as pool:
+            results = list(pool.map(
+                lambda _: self.make_request('POST', '/v1/transactions', race_cart, expected_status=201),
+                range(carts)
+            ))
+        sold = sum(1 for ok, _ in results if ok)
+        
+        plenty_stock, plenty_sales = stock_of(plenty)
+        scarce_stock, scarce_sales = stock_of(scarce)
+        sales_after, count_after = dashboard()
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{plenty['id']}")
+        self.make_request('DELETE', f"/v1/items/{scarce['id']}")
+        
+        consistent = ok_rejected and sold == short_stock \
+            and plenty_stock == carts * 2 - 2 * sold and plenty_sales == sold \
+            and scarce_stock == 0 and scarce_sales == sold \
+            and sales_before is not None and sales_after == sales_before + 2500 * sold \
+            and count_after == count_before + sold
+        return self.log_test(
+            "Checkout All-or-Nothing",
+            consistent,
+            f"Short cart: {rejected.get('detail')}; {carts} racing carts sold {sold}; "
+            f"plenty stock {carts * 2} -> {plenty_stock} ({plenty_sales} sale records), "
+            f"scarce stock {short_stock} -> {scarce_stock}; dashboard +{(sales_after or 0) - (sales_before or 0)} "
+            f"in {(count_after or 0) - (count_before or 0)} sale(s)",
+            {"sold": sold, "plenty_stock": plenty_stock, "scarce_stock": scarce_stock}
+        )
+
+    def test_idempotent_checkout(self):
+        """Idempotency-Key: a replay returns the first sale, a racing retry gets 409, another cart gets 422"""
+        print("\n🔁 Testing Idempotent Checkout...")
+        
+        if not self.token:
+            return self.log_test("Idempotent Checkout", False, "No token available")
+        
+        test_item = {
+            "name": f"Idempotency Item {datetime.now().strftime('%H%M%S')}",
+            "price": 1000,
+            "track_stock": True,
+            "stock": 10
+        }
+        success, item = self.make_request('POST', '/v1/items', test_item, expected_status=201)
+        if not success:
+            return self.log_test("Create Idempotency Item", False, f"Error: {item}", item)
+        
+        checkout = {
+            "items": [{"item_id": item['id'], "qty": 1}],
+            "payment_method": "tunai",
+            "payment_amount": 1000
+        }
+        
+        # Replay: same key twice in a row
+        key = {"Idempotency-Key": str(uuid.uuid4())}
+        ok_first, first = self.make_request('POST', '/v1/transactions', checkout, 201, key)
+        ok_replay, replay = self.make_request('POST', '/v1/transactions', checkout, 201, key)
+        replayed = ok_first and ok_replay and first.get('id') == replay.get('id') \
+            and first.get('transaction_number') == replay.get('transaction_number')
+        self.log_test(
+            "Idempotency Replay",
+            replayed,
+            f"First #{first.get('transaction_number')}, replay #{replay.get('transaction_number')}",
+            {"first": first, "replay": replay}
+        )
+        
+        # Same key, different cart
+        other_cart = {**checkout, "items": [{"item_id": item['id'], "qty": 2}], "payment_amount": 2000}
+        ok_reuse, reuse = self.make_request('POST', '/v1/transactions', other_cart, 422, key)
+        self.log_test(
+            "Idempotency Key Reused For Other Cart",
+            ok_reuse,
+            f"Response: {reuse.get('detail')}",
+            reuse
+        )
+        
+        # Racing retries of one request: one sale, the rest are 409 or replays of it
+        race_key = {"Idempotency-Key": str(uuid.uuid4())}
+        url = f"{self.base_url}/api/v1/transactions"
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}', **race_key}
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            responses = list(pool.map(
+                lambda _: requests.post(url, json=checkout, headers=headers, timeout=30),
+                range(10)
+            ))
+        statuses = sorted(response.status_code for response in responses)
+        sale_ids = {response.json().get('id') for response in responses if response.status_code == 201}
+        
+        success, stock_data = self.make_request('GET', f"/v1/stock/{item['id']}/history", None)
+        remaining = stock_data.get('item', {}).get('stock') if success else None
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{item['id']}")
+        
+        return self.log_test(
+            "Idempotency Racing Retries",
+            set(statuses) <= {201, 409} and len(sale_ids) == 1 and remaining == 8,
+            f"Statuses {statuses}, {len(sale_ids)} distinct sale(s), stock 10 -> {remaining} after 2 sales",
+            {"statuses": statuses, "remaining": remaining}
+        ) and replayed and ok_reuse
+
+    def test_batch_sync(self):
+        """Offline batch sync: partial failure, a client_id repeated in and across uploads, past-day numbering"""
+        print("\n📦 Testing Offline Batch Sync...")
+        
+        if not self.token:
+            return self.log_test("Batch Sync", False, "No token available")
+        
+        test_item = {
+            "name": f"Batch Item {datetime.now().strftime('%H%M%S')}",
+            "price": 1000,
+            "track_stock": True,
+            "stock": 3
+        }
+        success, item = self.make_request('POST', '/v1/items', test_item, expected_status=201)
+        if not success:
+            return self.log_test("Create Batch Item", False, f"Error: {item}", item)
+        
+        def sale(client_id, qty, created_at):
+            return {
+                "client_id": client_id,
+                "created_at": created_at.isoformat(),
+                "items": [{"item_id": item['id'], "qty": qty}],
+                "payment_method": "tunai",
+                "payment_amount": 1000 * qty
+            }
+        
+        now = datetime.now(timezone.utc)
+        # Noon UTC keeps the same calendar day in any tenant timezone within +-11h
+        past_day = (now - timedelta(days=3)).replace(hour=12, minute=0, second=0, microsecond=0)
+        prefix = uuid.uuid4().hex[:8]
+        batch = {"sales": [
+            sale(f"{prefix}-a", 1, now),
+            sale(f"{prefix}-b", 5, now),  # More than the stock left: rejected on its own
+            sale(f"{prefix}-a", 1, now),  # Same sale uploaded twice in one batch
+            sale(f"{prefix}-c", 1, past_day)
+        ]}
+        
+        ok_first, first = self.make_request('POST', '/v1/transactions/batch', batch)
+        results = first.get('results', []) if ok_first else []
+        statuses = [r.get('status') for r in results]
+        partial = statuses == ["created", "error", "duplicate", "created"]
+        self.log_test(
+            "Batch Sync Partial Failure",
+            partial,
+            f"Statuses {statuses}",
+            first
+        )
+        
+        repeated = partial and results[2].get('transaction_id') == results[0].get('transaction_id') \
+            and results[2].get('transaction_number') == results[0].get('transaction_number') \
+            and results[0].get('transaction_id') is not None
+        self.log_test(
+            "Batch Sync Repeated Client Id In Batch",
+            repeated,
+            f"First #{results[0].get('transaction_number') if results else None}, "
+            f"repeat #{results[2].get('transaction_number') if len(results) > 2 else None}",
+            results
+        )
+        
+        past_number = results[3].get('transaction_number') if partial else None
+        numbered = bool(past_number) and past_number.startswith(past_day.strftime('%Y%m%d'))
+        self.log_test(
+            "Batch Sync Past Day Numbering",
+            numbered,
+            f"Sale from {past_day.date()} numbered #{past_number}",
+            results[3] if partial else first
+        )
+        
+        # Re-uploading the same batch stores nothing new
+        ok_replay, replay = self.make_request('POST', '/v1/transactions/batch', batch)
+        replay_results = replay.get('results', []) if ok_replay else []
+        replayed = [r.get('status') for r in replay_results] == ["duplicate", "error", "duplicate", "duplicate"] \
+            and partial and all(
+                replay_results[i].get('transaction_id') == results[i].get('transaction_id') for i in (0, 2, 3)
+            )
+        self.log_test(
+            "Batch Sync Replay",
+            replayed,
+            f"Statuses {[r.get('status') for r in replay_results]}",
+            replay
+        )
+        
+        success, stock_data = self.make_request('GET', f"/v1/stock/{item['id']}/history", None)
+        remaining = stock_data.get('item', {}).get('stock') if success else None
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{item['id']}")
+        
+        return self.log_test(
+            "Batch Sync Stock",
+            remaining == 1,
+            f"Stock 3 -> {remaining} after 2 stored sales",
+            {"remaining": remaining}
+        ) and partial and repeated and numbered and replayed
+
+    def test_checkout_latency_during_logins(self, logins=50, checkouts=40, max_p99_ms=1000):
+        """Benchmark: checkout p99 latency while a wave of logins (bcrypt) is in progress"""
+        print("\n⏱️  Testing Checkout Latency During Login Wave...")
+        
+        if not self.token:
+            return self.log_test("Checkout Latency", False, "No token available")
+        
+        test_item = {
+            "name": f"Latency Item {datetime.now().strftime('%H%M%S')}",
+            "price": 1000,
+            "track_stock": False
+        }
+        success, item = self.make_request('POST', '/v1/items', test_item, expected_status=201)
+        if not success:
+            return self.log_test("Create Latency Item", False, f"Error: {item}", item)
+        
+        checkout = {
+            "items": [{"item_id": item['id'], "qty": 1}],
+            "payment_method": "tunai",
+            "payment_amount": 1000
+        }
+        
+        def timed_checkouts(count):
+            latencies = []
+            for _ in range(count):
+                started = time.perf_counter()
+                ok, _ = self.make_request('POST', '/v1/transactions', checkout, expected_status=201)
+                latencies.append((ok, (time.perf_counter() - started) * 1000))
+            return latencies
+        
+        def p99(latencies):
+            ordered = sorted(ms for _, ms in latencies)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        
+        baseline = timed_checkouts(checkouts // 2)
+        
+        login = {"email": self.test_email, "password": self.test_password}
+        with ThreadPoolExecutor(max_workers=logins) as pool:
+            wave = [pool.submit(self.make_request, 'POST', '/v1/auth/login', login) for _ in range(logins)]
+            under_load = timed_checkouts(checkouts)
+            logins_ok = sum(1 for future in wave if future.result()[0])
+        
+        _, hashing = self.make_request('GET', '/health/password-hashing')
+        
+        # Clean up
+        self.make_request('DELETE', f"/v1/items/{item['id']}")
+        
+        baseline_p99 = p99(baseline)
+        load_p99 = p99(under_load)
+        return self.log_test(
+            "Checkout p99 During Login Wave",
+            all(ok for ok, _ in baseline + under_load) and load_p99 <= max_p99_ms,
+            f"baseline p99 {baseline_p99:.0f} ms, during {logins} logins p99 {load_p99:.0f} ms "
+            f"({logins_ok}/{logins} logins ok, bcrypt queue p99 {hashing.get('queue_ms_p99')} ms)",
+            {"baseline_p99_ms": baseline_p99, "load_p99_ms": load_p99, "password_hashing": hashing}
+        )
+
     def test_dashboard(self):
         """Test Dashboard data"""
         print("\n📊 Testing Dashboard...")
@@ -418,6 +831,76 @@ class AIKasirTester:
         self.token = original_token
         return kasir_blocked
 
+    def test_token_revocation(self, revocation_wait=11, reuse_grace=31):
+        """Refresh token reuse, revocation after a password change or a disabled account, and renames that keep sessions"""
+        print("\n🔑 Testing Token Revocation...")
+        
+        if not self.token:
+            return self.log_test("Token Revocation", False, "No token available")
+        
+        email = f"tokenkasir{datetime.now().strftime('%H%M%S')}@test.com"
+        success, data = self.make_request('POST', '/v1/users/invite', {"name": "Token Kasir", "email": email, "role": "kasir"}, expected_status=201)
+        if not success:
+            return self.log_test("Invite Token User", False, f"Error: {data}", data)
+        user_id = data.get('user', {}).get('id')
+        success, session = self.make_request('POST', '/v1/users/accept-invite', {"token": data.get('invite_token'), "password": "tokenpass123"})
+        if not success:
+            return self.log_test("Accept Token User Invite", False, f"Error: {session}", session)
+        
+        owner_token = self.token
+        
+        def as_token(token, method, endpoint, data=None, expected_status=200):
+            self.token = token
+            try:
+                return self.make_request(method, endpoint, data, expected_status)
+            finally:
+                self.token = owner_token
+        
+        def refresh(refresh_token, expected_status=200):
+            return as_token(None, 'POST', '/v1/auth/refresh', {"refresh_token": refresh_token}, expected_status)
+        
+        # A rename does not end the user's sessions
+        self.make_request('PUT', f'/v1/users/{user_id}', {"name": "Token Kasir Baru"})
+        time.sleep(revocation_wait)
+        ok_renamed, _ = as_token(session['token'], 'GET', '/v1/auth/me')
+        self.log_test("Rename Keeps Session", ok_renamed, "Access token still accepted after a name-only edit")
+        
+        # Rotation: the spent token fails, the new one works (a quick second use is not yet theft)
+        ok_rotate, rotated = refresh(session['refresh_token'])
+        ok_spent, _ = refresh(session['refresh_token'], 401)
+        ok_next, latest = refresh(rotated.get('refresh_token'))
+        rotation = ok_rotate and ok_spent and ok_next
+        self.log_test("Refresh Token Rotation", rotation, "Spent refresh token rejected, rotated one accepted")
+        
+        # Reuse after the grace period ends the whole session
+        time.sleep(reuse_grace)
+        ok_reused, _ = refresh(session['refresh_token'], 401)
+        ok_family_revoked, _ = refresh(latest.get('refresh_token'), 401)
+        reuse = ok_reused and ok_family_revoked
+        self.log_test("Refresh Token Reuse Detection", reuse, "Late reuse of a spent token revoked the newest token of its session")
+        
+        # A password change signs out every other session
+        _, device_a = as_token(None, 'POST', '/v1/auth/login', {"email": email, "password": "tokenpass123"})
+        _, device_b = as_token(None, 'POST', '/v1/auth/login', {"email": email, "password": "tokenpass123"})
+        ok_changed, changed = as_token(device_a.get('token'), 'PUT', '/v1/auth/password', {"new_password": "tokenpass456"})
+        ok_other_refresh, _ = refresh(device_b.get('refresh_token'), 401)
+        time.sleep(revocation_wait)
+        ok_other_access, _ = as_token(device_b.get('token'), 'GET', '/v1/auth/me', expected_status=401)
+        ok_own_access, _ = as_token(changed.get('token'), 'GET', '/v1/auth/me')
+        password_change = ok_changed and ok_other_refresh and ok_other_access and ok_own_access
+        self.log_test("Password Change Revokes Other Sessions", password_change, "Other device's access and refresh tokens rejected, new tokens accepted")
+        
+        # Disabling the account bumps token_version: its access token stops working
+        self.make_request('PUT', f'/v1/users/{user_id}', {"is_active": False})
+        time.sleep(revocation_wait)
+        ok_disabled, _ = as_token(changed.get('token'), 'GET', '/v1/auth/me', expected_status=401)
+        self.log_test("Disabled User Access Token Rejected", ok_disabled, f"Rejected within {revocation_wait}s of the token_version bump")
+        
+        # Clean up
+        self.make_request('DELETE', f'/v1/users/{user_id}')
+        
+        return ok_renamed and rotation and reuse and password_change and ok_disabled
+
     def test_subdomain_check(self):
         """Test Subdomain Check API"""
         print("\n🌐 Testing Subdomain Check...")
@@ -457,9 +940,16 @@ class AIKasirTester:
             self.test_get_me,
             self.test_items_crud,
             self.test_transactions,
+            self.test_transaction_pagination,
+            self.test_concurrent_checkout_no_oversell,
+            self.test_checkout_all_or_nothing,
+            self.test_idempotent_checkout,
+            self.test_batch_sync,
+            self.test_checkout_latency_during_logins,
             self.test_dashboard,
             self.test_user_management_owner,
             self.test_user_management_kasir,
+            self.test_token_revocation,
             self.test_subdomain_check,
         ]
         
@@ -20,15 +20,62 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+const clearSession = () => {
+  localStorage.removeItem('aikasir_token');
+  localStorage.removeItem('aikasir_refresh_token');
+  localStorage.removeItem('aikasir_user');
+  localStorage.removeItem('aikasir_tenant');
+  window.location.href = '/login';
+};
+
+// Access tokens are short-lived; one refresh is shared by concurrent 401s
+let refreshing = null;
+
+const refreshAccessToken = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem('aikasir_refresh_token');
+    refreshing = (refreshToken
+      ? axios.post(`${API_BASE}/auth/refresh`, { refresh_token: refreshToken })
+      : Promise.reject(new Error('no refresh token'))
+    )
+      .then((response) => {
+        localStorage.setItem('aikasir_token', response.data.token);
+        localStorage.setItem('aikasir_refresh_token', response.data.refresh_token);
+        return response.data.token;
+      })
+      .catch((error) => {
+        // Refresh tokens are single use: another tab may have just rotated ours
+        const current = localStorage.getItem('aikasir_refresh_token');
+        if (error.response?.status === 401 && current && current !== refreshToken) {
+          return localStorage.getItem('aikasir_token');
+        }
+        throw error;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
 // Handle auth errors
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const original = error.config;
+    if (error.response?.status === 401 && original && !original._retried && !['/auth/login', '/auth/refresh'].includes(original.url)) {
+      original._retried = true;
+      try {
+        const token = await refreshAccessToken();
+        original.headers.Authorization = `Bearer ${token}`;
+        return api(original);
+      } catch (refreshError) {
+        clearSession();
+        return Promise.reject(error);
+      }
+    }
     if (error.response?.status === 401) {
-      localStorage.removeItem('aikasir_token');
-      localStorage.removeItem('aikasir_user');
-      localStorage.removeItem('aikasir_tenant');
-      window.location.href = '/login';
+      clearSession();
     }
     return Promise.reject(error);
   }
@@ -38,12 +85,48 @@ api.interceptors.response.use(
 export const aiOnboard = (message, sessionId) =>
   api.post('/ai/onboard', { message, session_id: sessionId });
 
+// Streams the reply: onToken(text) per chunk of the message, resolves with the
+// same body as aiOnboard once the completion is done
+export const streamOnboard = async (message, sessionId, onToken) => {
+  const response = await fetch(`${API_BASE}/ai/onboard/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ message, session_id: sessionId }),
+  });
+  if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const event of events) {
+      const lines = event.split('\n');
+      const name = lines.find((line) => line.startsWith('event: '))?.slice(7);
+      const data = lines.find((line) => line.startsWith('data: '));
+      if (!name || !data) continue;
+      const payload = JSON.parse(data.slice(6));
+      if (name === 'token') onToken(payload.text);
+      if (name === 'done') return payload;
+      if (name === 'error') throw new Error(payload.detail);
+    }
+  }
+  throw new Error('Stream ended without a reply');
+};
+
 // Auth
 export const login = (email, password) =>
   api.post('/auth/login', { email, password });
 
 export const getMe = () => api.get('/auth/me');
 
+export const refreshToken = (token) =>
+  api.post('/auth/refresh', { refresh_token: token });
+
 export const changePassword = (newPassword) =>
   api.put('/auth/password', { new_password: newPassword });
 
@@ -61,26 +144,109 @@ export const deleteItem = (id) =>
   api.delete(`/items/${id}`);
 
 // Transactions
-export const getTransactions = (date = null, limit = 50, offset = 0) =>
-  api.get('/transactions', { params: { date, limit, offset } });
+// Pass the previous response's next_cursor as `after` to load the next page
+export const getTransactions = (date = null, limit = 50, after = null) =>
+  api.get('/transactions', { params: { date, limit, after, include_total: !after } });
 
 export const getTransaction = (id) =>
   api.get(`/transactions/${id}`);
 
-export const createTransaction = (items, paymentMethod, paymentAmount, paymentReference = null) =>
+// Retries with the same idempotencyKey replay the first result instead of selling twice
+export const createTransaction = (items, paymentMethod, paymentAmount, paymentReference = null, idempotencyKey = null) =>
   api.post('/transactions', {
     items,
     payment_method: paymentMethod,
     payment_amount: paymentAmount,
     payment_reference: paymentReference,
-  });
+  }, { headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {} });
 
-export const voidTransaction = (id, reason) =>
-  api.post(`/transactions/${id}/void`, { reason });
+export const syncOfflineSales = (sales) =>
+  api.post('/transactions/batch', { sales });
+
+export const voidTransaction = (id, reason, idempotencyKey = null) =>
+  api.post(`/transactions/${id}/void`, { reason }, {
+    headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+  });
 
 // Dashboard
 export const getDashboardToday = () => api.get('/dashboard/today');
 
+// Live dashboard over Server-Sent Events. fetch() is used instead of
+// EventSource so the bearer token can go in a header. Returns a stop function.
+const DASHBOARD_RETRY_MIN_MS = 1000;
+const DASHBOARD_RETRY_MAX_MS = 30000;
+
+// Reads SSE events until the server closes the stream
+const readDashboardEvents = async (signal, onUpdate, onOpen) => {
+  const response = await fetch(`${API_BASE}/dashboard/stream`, {
+    headers: { Authorization: `Bearer ${localStorage.getItem('aikasir_token')}` },
+    signal,
+  });
+  if (!response.ok) {
+    const error = new Error(`HTTP ${response.status}`);
+    error.status = response.status;
+    throw error;
+  }
+  onOpen();
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    events.forEach((event) => {
+      const data = event.split('\n').find((line) => line.startsWith('data: '));
+      if (data) onUpdate(JSON.parse(data.slice(6)));
+    });
+  }
+};
+
+// Keeps the dashboard stream open: after a drop it waits (backing off),
+// refreshes the access token, re-fetches the snapshot, then reconnects
+export const streamDashboard = (onUpdate, onStatus = () => {}) => {
+  const controller = new AbortController();
+  const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+  (async () => {
+    let delay = DASHBOARD_RETRY_MIN_MS;
+    let reconnecting = false;
+    while (!controller.signal.aborted) {
+      try {
+        if (reconnecting) {
+          try {
+            await refreshAccessToken();
+          } catch (refreshError) {
+            // Offline: keep retrying; refresh token missing or rejected: the session is over
+            if (!refreshError.response && localStorage.getItem('aikasir_refresh_token')) throw refreshError;
+            clearSession();
+            return;
+          }
+          const response = await getDashboardToday();
+          onUpdate(response.data);
+        }
+        await readDashboardEvents(controller.signal, onUpdate, () => {
+          delay = DASHBOARD_RETRY_MIN_MS;
+          onStatus('live');
+        });
+      } catch (error) {
+        if (error.name === 'AbortError') return;
+        console.error('Dashboard stream error:', error);
+      }
+      if (controller.signal.aborted) return;
+      onStatus('reconnecting');
+      reconnecting = true;
+      await sleep(delay + Math.random() * delay / 2);
+      delay = Math.min(delay * 2, DASHBOARD_RETRY_MAX_MS);
+    }
+  })();
+
+  return () => controller.abort();
+};
+
 // Reports
 export const getReportSummary = (startDate, endDate) =>
   api.get('/reports/summary', { params: { start_date: startDate, end_date: endDate } });
@@ -89,7 +255,11 @@ export const getDailyReport = (date) =>
   api.get('/reports/daily', { params: { date } });
 
 export const exportReport = (startDate, endDate, format = 'json') =>
-  api.get('/reports/export', { params: { start_date: startDate, end_date: endDate, format } });
+  api.get('/reports/export', {
+    params: { start_date: startDate, end_date: endDate, format },
+    // CSV is streamed back as a file, not JSON
+    responseType: format === 'csv' ? 'blob' : 'json',
+  });
 
 // Settings
 export const getSettings = () => api.get('/settings');
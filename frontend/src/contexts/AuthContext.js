@@ -36,13 +36,17 @@ export const AuthProvider = ({ children }) => {
     } catch (error) {
       console.error('Auth check failed:', error);
       localStorage.removeItem('aikasir_token');
+      localStorage.removeItem('aikasir_refresh_token');
     } finally {
       setLoading(false);
     }
   };
 
-  const loginUser = (token, userData, tenantData) => {
+  const loginUser = (token, userData, tenantData, refreshToken) => {
     localStorage.setItem('aikasir_token', token);
+    if (refreshToken) {
+      localStorage.setItem('aikasir_refresh_token', refreshToken);
+    }
     localStorage.setItem('aikasir_user', JSON.stringify(userData));
     localStorage.setItem('aikasir_tenant', JSON.stringify(tenantData));
     setUser(userData);
@@ -52,6 +56,7 @@ export const AuthProvider = ({ children }) => {
 
   const logout = () => {
     localStorage.removeItem('aikasir_token');
+    localStorage.removeItem('aikasir_refresh_token');
     localStorage.removeItem('aikasir_user');
     localStorage.removeItem('aikasir_tenant');
     setUser(null);
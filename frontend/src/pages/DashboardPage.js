@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { getDashboardToday } from '../api';
+import { getDashboardToday, streamDashboard } from '../api';
 import Layout from '../components/Layout';
 import {
   TrendingUp,
@@ -17,9 +17,16 @@ const formatRupiah = (num) => {
 const DashboardPage = () => {
   const [data, setData] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [streamStatus, setStreamStatus] = useState('live');
 
   useEffect(() => {
     fetchDashboard();
+    // Server pushes a fresh summary after every sale or void; reconnects on its own
+    const stop = streamDashboard(
+      (summary) => setData(summary),
+      (status) => setStreamStatus(status)
+    );
+    return stop;
   }, []);
 
   const fetchDashboard = async () => {
@@ -57,6 +64,12 @@ const DashboardPage = () => {
               year: 'numeric',
             })}
           </p>
+          {streamStatus === 'reconnecting' && (
+            <p className="flex items-center gap-2 text-sm text-amber-600 mt-2" data-testid="dashboard-reconnecting">
+              <Loader2 className="w-4 h-4 animate-spin" />
+              Koneksi terputus, menyambung ulang...
+            </p>
+          )}
         </div>
 
         {/* Stats Cards */}
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { getTransactions, getTransaction, voidTransaction } from '../api';
+import { localDateString } from '../lib/utils';
 import { useAuth } from '../contexts/AuthContext';
 import Layout from '../components/Layout';
 import { Receipt, Calendar, Loader2, Eye, Package, XCircle, Ban, Check } from 'lucide-react';
@@ -20,14 +21,17 @@ const formatTime = (dateStr) => {
 const HistoryPage = () => {
   const [transactions, setTransactions] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedDate, setSelectedDate] = useState(
-    new Date().toISOString().split('T')[0]
+    localDateString()
   );
   const [showReceipt, setShowReceipt] = useState(false);
   const [selectedTransaction, setSelectedTransaction] = useState(null);
   const [showVoidModal, setShowVoidModal] = useState(false);
   const [voidReason, setVoidReason] = useState('');
   const [transactionToVoid, setTransactionToVoid] = useState(null);
+  const [voidKey, setVoidKey] = useState(null);
   const [voiding, setVoiding] = useState(false);
   const { tenant, user } = useAuth();
 
@@ -40,6 +44,7 @@ const HistoryPage = () => {
     try {
       const response = await getTransactions(selectedDate);
       setTransactions(response.data.transactions);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching transactions:', error);
     } finally {
@@ -47,6 +52,19 @@ const HistoryPage = () => {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await getTransactions(selectedDate, 50, nextCursor);
+      setTransactions((prev) => [...prev, ...response.data.transactions]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching transactions:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const viewReceipt = async (transaction) => {
     try {
       const response = await getTransaction(transaction.id);
@@ -63,6 +81,7 @@ const HistoryPage = () => {
   const openVoidModal = (transaction) => {
     setTransactionToVoid(transaction);
     setVoidReason('');
+    setVoidKey(crypto.randomUUID());
     setShowVoidModal(true);
   };
 
@@ -74,7 +93,7 @@ const HistoryPage = () => {
 
     setVoiding(true);
     try {
-      await voidTransaction(transactionToVoid.id, voidReason);
+      await voidTransaction(transactionToVoid.id, voidReason, voidKey);
       setShowVoidModal(false);
       setTransactionToVoid(null);
       setVoidReason('');
@@ -268,6 +287,16 @@ const HistoryPage = () => {
                 )}
               </div>
             ))}
+            {nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="w-full py-3 text-blue-600 font-medium hover:bg-blue-50 rounded-xl disabled:opacity-50"
+                data-testid="load-more-btn"
+              >
+                {loadingMore ? 'Memuat...' : 'Muat lebih banyak'}
+              </button>
+            )}
           </div>
         )}
       </div>
@@ -49,7 +49,7 @@ const InvitePage = () => {
     setSaving(true);
     try {
       const response = await acceptInvite(token, password);
-      loginUser(response.data.token, response.data.user, response.data.tenant);
+      loginUser(response.data.token, response.data.user, response.data.tenant, response.data.refresh_token);
       navigate('/pos');
     } catch (err) {
       setError(err.response?.data?.detail || 'Gagal mengaktifkan akun');
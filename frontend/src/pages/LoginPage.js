@@ -20,8 +20,8 @@ const LoginPage = () => {
 
     try {
       const response = await login(email, password);
-      const { token, user, tenant } = response.data;
-      loginUser(token, user, tenant);
+      const { token, refresh_token, user, tenant } = response.data;
+      loginUser(token, user, tenant, refresh_token);
       navigate('/pos');
     } catch (err) {
       console.error('Login error:', err);
@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { aiOnboard } from '../api';
+import { streamOnboard } from '../api';
 import { useAuth } from '../contexts/AuthContext';
 import { Send, Bot, User, Loader2, Store } from 'lucide-react';
 
@@ -29,18 +29,28 @@ const OnboardingPage = () => {
 
     const userMessage = input.trim();
     setInput('');
-    setMessages((prev) => [...prev, { role: 'user', content: userMessage }]);
+    setMessages((prev) => [
+      ...prev,
+      { role: 'user', content: userMessage },
+      { role: 'assistant', content: '' },
+    ]);
     setLoading(true);
 
+    // Replace the placeholder reply at the end of the list
+    const setReply = (update) =>
+      setMessages((prev) => [
+        ...prev.slice(0, -1),
+        { role: 'assistant', content: update(prev[prev.length - 1].content) },
+      ]);
+
     try {
-      const response = await aiOnboard(userMessage, sessionId);
-      const data = response.data;
+      const data = await streamOnboard(userMessage, sessionId, (text) =>
+        setReply((content) => content + text)
+      );
 
       setSessionId(data.session_id);
-      setMessages((prev) => [
-        ...prev,
-        { role: 'assistant', content: data.message },
-      ]);
+      // The final message wins (e.g. "email sudah terdaftar" replaces the streamed text)
+      setReply(() => data.message);
 
       if (data.status === 'complete') {
         setSetupComplete(true);
@@ -48,18 +58,12 @@ const OnboardingPage = () => {
         
         // Auto login
         if (data.token) {
-          loginUser(data.token, data.user, data.tenant);
+          loginUser(data.token, data.user, data.tenant, data.refresh_token);
         }
       }
     } catch (error) {
       console.error('Onboard error:', error);
-      setMessages((prev) => [
-        ...prev,
-        {
-          role: 'assistant',
-          content: 'Maaf, ada gangguan. Coba lagi ya! 🙏',
-        },
-      ]);
+      setReply(() => 'Maaf, ada gangguan. Coba lagi ya! 🙏');
     } finally {
       setLoading(false);
     }
@@ -107,7 +111,7 @@ const OnboardingPage = () => {
       {/* Chat Messages */}
       <div className="flex-1 overflow-y-auto">
         <div className="max-w-3xl mx-auto px-4 py-6 space-y-4">
-          {messages.map((message, index) => (
+          {messages.filter((message) => message.content).map((message, index) => (
             <div
               key={index}
               className={`flex gap-3 ${message.role === 'user' ? 'justify-end' : 'justify-start'}`}
@@ -136,7 +140,8 @@ const OnboardingPage = () => {
             </div>
           ))}
 
-          {loading && (
+          {/* Until the first token arrives */}
+          {loading && !messages[messages.length - 1].content && (
             <div className="flex gap-3">
               <div className="w-8 h-8 bg-gradient-to-br from-blue-500 to-indigo-600 rounded-full flex items-center justify-center">
                 <Bot className="w-5 h-5 text-white" />
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { getItems, createTransaction } from '../api';
 import { useCart } from '../contexts/CartContext';
 import { useAuth } from '../contexts/AuthContext';
@@ -27,6 +27,7 @@ const POSPage = () => {
   const [showPayment, setShowPayment] = useState(false);
   const [showReceipt, setShowReceipt] = useState(false);
   const [lastTransaction, setLastTransaction] = useState(null);
+  const checkoutKey = useRef(null);
   const { tenant } = useAuth();
   const {
     items: cartItems,
@@ -42,6 +43,11 @@ const POSPage = () => {
     fetchItems();
   }, []);
 
+  // A changed cart is a new checkout, not a retry of the previous one
+  useEffect(() => {
+    checkoutKey.current = null;
+  }, [cartItems]);
+
   const fetchItems = async () => {
     try {
       const response = await getItems(true, search);
@@ -67,13 +73,19 @@ const POSPage = () => {
         qty: item.qty,
       }));
 
+      if (!checkoutKey.current) {
+        checkoutKey.current = crypto.randomUUID();
+      }
+
       const response = await createTransaction(
         transactionItems,
         paymentMethod,
         paymentAmount,
-        paymentReference
+        paymentReference,
+        checkoutKey.current
       );
 
+      checkoutKey.current = null;
       setLastTransaction(response.data);
       setShowPayment(false);
       setShowReceipt(true);
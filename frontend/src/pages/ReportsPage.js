@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { getReportSummary, getDailyReport, exportReport } from '../api';
+import { localDateString } from '../lib/utils';
 import { useAuth } from '../contexts/AuthContext';
 import Layout from '../components/Layout';
 import {
@@ -24,8 +25,8 @@ const ReportsPage = () => {
   const { user } = useAuth();
   const [loading, setLoading] = useState(true);
   const [reportData, setReportData] = useState(null);
-  const [startDate, setStartDate] = useState(new Date().toISOString().split('T')[0]);
-  const [endDate, setEndDate] = useState(new Date().toISOString().split('T')[0]);
+  const [startDate, setStartDate] = useState(localDateString());
+  const [endDate, setEndDate] = useState(localDateString());
   const [exporting, setExporting] = useState(false);
 
   useEffect(() => {
@@ -50,12 +51,13 @@ const ReportsPage = () => {
       const response = await exportReport(startDate, endDate, format);
       
       if (format === 'csv') {
-        // Download CSV file
-        const blob = new Blob([response.data.data], { type: 'text/csv' });
-        const url = window.URL.createObjectURL(blob);
+        // Download CSV file (streamed by the server)
+        const disposition = response.headers['content-disposition'] || '';
+        const match = disposition.match(/filename="?([^"]+)"?/);
+        const url = window.URL.createObjectURL(response.data);
         const a = document.createElement('a');
         a.href = url;
-        a.download = response.data.filename;
+        a.download = match ? match[1] : `laporan_${startDate}_to_${endDate}.csv`;
         a.click();
         window.URL.revokeObjectURL(url);
       } else {
@@ -94,8 +96,8 @@ const ReportsPage = () => {
         start = today;
     }
     
-    setStartDate(start.toISOString().split('T')[0]);
-    setEndDate(today.toISOString().split('T')[0]);
+    setStartDate(localDateString(start));
+    setEndDate(localDateString(today));
   };
 
   // Only owner can access
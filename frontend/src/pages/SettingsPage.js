@@ -66,7 +66,10 @@ const SettingsPage = () => {
 
     setSavingPassword(true);
     try {
-      await changePassword(passwordData.newPassword);
+      // Changing the password revokes every other session; keep this one
+      const response = await changePassword(passwordData.newPassword);
+      localStorage.setItem('aikasir_token', response.data.token);
+      localStorage.setItem('aikasir_refresh_token', response.data.refresh_token);
       setPasswordData({ newPassword: '', confirmPassword: '' });
       setSuccess('Password berhasil diubah!');
       setTimeout(() => setSuccess(''), 3000);
@@ -0,0 +1,111 @@
+"""
+Local fake of the OpenAI chat completions API, for tests
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:{port}/v1.
+Every completion sleeps `delay` seconds first, so tests can check that the
+backend keeps serving other requests during a slow LLM call. With
+"stream": true the reply is sent as SSE chunks of `chunk_size` characters,
+`chunk_delay` seconds apart.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = {
+    "message": "Halo! Usaha kamu jualan apa?",
+    "step": 1,
+    "data": {},
+    "complete": False
+}
+
+
+class FakeOpenAI:
+    """Threaded HTTP server answering POST /v1/chat/completions with `reply` after `delay` seconds"""
+
+    def __init__(self, delay: float = 0.0, reply: dict = None, chunk_size: int = 4, chunk_delay: float = 0.02):
+        self.delay = delay
+        self.reply = reply or DEFAULT_REPLY
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                fake.requests += 1
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self.send_error(404)
+                    return
+                time.sleep(fake.delay)
+                if request.get("stream"):
+                    self.stream_completion()
+                    return
+                body = json.dumps(fake.completion()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def stream_completion(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for chunk in fake.completion_chunks():
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(fake.chunk_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def completion(self) -> dict:
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(self.reply)},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    def completion_chunks(self):
+        content = json.dumps(self.reply)
+        pieces = [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+        for index, piece in enumerate(pieces):
+            yield {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": piece} if index == 0 else {"content": piece},
+                    "finish_reason": "stop" if index == len(pieces) - 1 else None
+                }]
+            }
+
+    def start(self) -> "FakeOpenAI":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
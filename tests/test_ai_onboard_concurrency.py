@@ -0,0 +1,214 @@
+"""
+AI onboarding: slow OpenAI completions must not block other requests, and
+the streaming variant delivers message tokens before the completion ends
+
+Starts a local fake OpenAI server and a backend instance pointed at it
+(needs MONGO_URL and DB_NAME, like the server itself).
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+from tests.fake_openai import DEFAULT_REPLY, FakeOpenAI
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+OPENAI_TIMEOUT_SECONDS = 2
+OPENAI_MAX_RETRIES = 1
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("MONGO_URL") and not (BACKEND_DIR / ".env").exists(),
+    reason="needs MONGO_URL for a local backend"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def fake_openai():
+    fake = FakeOpenAI().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture(scope="module")
+def backend_url(fake_openai):
+    port = free_port()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": fake_openai.base_url,
+        "OPENAI_API_KEY": "sk-fake",
+        "OPENAI_TIMEOUT_SECONDS": str(OPENAI_TIMEOUT_SECONDS),
+        "OPENAI_MAX_RETRIES": str(OPENAI_MAX_RETRIES),
+        "OPENAI_RETRY_BASE_SECONDS": "0.1"
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                if requests.get(f"{url}/api/health", timeout=1).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        else:
+            pytest.fail("Backend did not start")
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def slow_completion(fake_openai):
+    def set_delay(seconds: float):
+        fake_openai.delay = seconds
+    yield set_delay
+    fake_openai.delay = 0
+
+
+class TestAIOnboardConcurrency:
+    """The event loop keeps serving while ai_onboard waits on OpenAI"""
+
+    def test_other_endpoints_served_during_slow_completion(self, backend_url, slow_completion):
+        slow_completion(1.5)
+        result = {}
+
+        def onboard():
+            result["response"] = requests.post(f"{backend_url}/api/v1/ai/onboard", json={"message": "halo"}, timeout=30)
+
+        thread = threading.Thread(target=onboard)
+        thread.start()
+        time.sleep(0.3)
+
+        latencies = []
+        for _ in range(10):
+            started = time.perf_counter()
+            response = requests.get(f"{backend_url}/api/health", timeout=5)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+        still_waiting = thread.is_alive()
+        thread.join()
+
+        assert still_waiting, "Completion finished before the health checks; raise the fake delay"
+        assert max(latencies) < 0.5, f"Health check took {max(latencies):.2f}s during a slow completion"
+        assert result["response"].status_code == 200
+        data = result["response"].json()
+        assert data["status"] == "continue"
+        assert data["message"] == "Halo! Usaha kamu jualan apa?"
+        print(f"✓ Health p100 {max(latencies) * 1000:.0f} ms while a completion was in flight")
+
+    def test_timeout_is_retried_then_503(self, backend_url, fake_openai, slow_completion):
+        slow_completion(OPENAI_TIMEOUT_SECONDS + 1)
+        before = fake_openai.requests
+
+        started = time.perf_counter()
+        response = requests.post(f"{backend_url}/api/v1/ai/onboard", json={"message": "halo"}, timeout=30)
+        elapsed = time.perf_counter() - started
+
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Asisten AI sedang sibuk, silakan coba lagi"
+        assert fake_openai.requests - before == OPENAI_MAX_RETRIES + 1
+        # Bounded by the per-call timeout, not the fake's delay
+        assert elapsed < (OPENAI_MAX_RETRIES + 1) * (OPENAI_TIMEOUT_SECONDS + 1)
+        print(f"✓ Timed out after {OPENAI_MAX_RETRIES + 1} attempt(s) in {elapsed:.1f}s")
+
+
+def read_events(response) -> list:
+    """(event, data, seconds since the request) for every SSE event of a streamed response"""
+    started = time.perf_counter()
+    events = []
+    for block in response.iter_lines(delimiter="\n\n", decode_unicode=True):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"]), time.perf_counter() - started))
+    return events
+
+
+class TestAIOnboardStream:
+    """POST /v1/ai/onboard/stream: token events first, then the full response"""
+
+    def test_tokens_stream_before_done(self, backend_url, fake_openai, slow_completion):
+        slow_completion(0.2)
+        fake_openai.chunk_delay = 0.05
+
+        with requests.post(
+            f"{backend_url}/api/v1/ai/onboard/stream",
+            json={"message": "halo"},
+            stream=True,
+            timeout=30
+        ) as response:
+            assert response.status_code == 200
+            assert response.headers["Content-Type"].startswith("text/event-stream")
+            events = read_events(response)
+        fake_openai.chunk_delay = 0.02
+
+        names = [name for name, _, _ in events]
+        assert names[-1] == "done", f"Stream ended with {names[-1]}: {events[-1][1]}"
+        assert "token" in names
+        tokens = [data["text"] for name, data, _ in events if name == "token"]
+        done = events[-1][1]
+        assert "".join(tokens) == done["message"] == "Halo! Usaha kamu jualan apa?"
+        assert done["status"] == "continue"
+        assert done["session_id"]
+
+        first_token = next(at for name, _, at in events if name == "token")
+        assert first_token < events[-1][2] - 0.2, "First token did not arrive well before the end"
+        print(f"✓ First token after {first_token * 1000:.0f} ms, done after {events[-1][2] * 1000:.0f} ms")
+
+    def test_stream_reports_timeout_as_error_event(self, backend_url, slow_completion):
+        slow_completion(OPENAI_TIMEOUT_SECONDS + 1)
+
+        with requests.post(
+            f"{backend_url}/api/v1/ai/onboard/stream",
+            json={"message": "halo"},
+            stream=True,
+            timeout=30
+        ) as response:
+            assert response.status_code == 200
+            events = read_events(response)
+
+        assert [name for name, _, _ in events] == ["error"]
+        assert events[0][1]["detail"] == "Asisten AI sedang sibuk, silakan coba lagi"
+
+    def test_message_after_nested_data_is_streamed(self, backend_url, fake_openai):
+        # The model is free to order keys; "message" after a nested object must still stream
+        fake_openai.reply = {
+            "data": {"business_type": "warung kopi", "items": ["Kopi Susu", "Gorengan"], "note": {"message": "bukan ini"}},
+            "step": 2,
+            "message": "Oke, warung kopi! Namanya apa?",
+            "complete": False
+        }
+        try:
+            with requests.post(
+                f"{backend_url}/api/v1/ai/onboard/stream",
+                json={"message": "warung kopi"},
+                stream=True,
+                timeout=30
+            ) as response:
+                assert response.status_code == 200
+                events = read_events(response)
+        finally:
+            fake_openai.reply = DEFAULT_REPLY
+
+        names = [name for name, _, _ in events]
+        assert names[-1] == "done", f"Stream ended with {names[-1]}: {events[-1][1]}"
+        tokens = [data["text"] for name, data, _ in events if name == "token"]
+        assert len(tokens) > 1, "Message arrived in one piece instead of streaming"
+        assert "".join(tokens) == events[-1][1]["message"] == "Oke, warung kopi! Namanya apa?"
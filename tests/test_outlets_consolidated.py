@@ -0,0 +1,124 @@
+"""
+Linked outlets: linking a second shop with its owner's login, and the
+consolidated report adding up sales of every outlet in the group
+
+Creates fresh shops through AI onboarding against the fake OpenAI server
+(needs MONGO_URL and DB_NAME, like the server itself).
+"""
+import uuid
+
+import pytest
+import requests
+
+from tests.fake_openai import DEFAULT_REPLY
+from tests.test_ai_onboard_concurrency import backend_url, fake_openai  # noqa: F401 (fixtures)
+
+
+def create_shop(backend_url, fake_openai, name: str) -> dict:
+    """Onboard a new shop in one turn; returns the onboarding response (token, temp password, tenant)"""
+    email = f"outlet-{uuid.uuid4().hex[:10]}@test.com"
+    fake_openai.reply = {
+        "message": "Toko kamu sudah jadi!",
+        "step": 4,
+        "data": {"business_type": "warung kopi", "business_name": name, "items": ["Kopi Susu"], "email": email},
+        "complete": True
+    }
+    try:
+        response = requests.post(f"{backend_url}/api/v1/ai/onboard", json={"message": email}, timeout=30)
+    finally:
+        fake_openai.reply = DEFAULT_REPLY
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["status"] == "complete", data
+    return data
+
+
+def sell(backend_url, token: str, qty: int) -> dict:
+    """Sell `qty` of the shop's first item for cash"""
+    headers = {"Authorization": f"Bearer {token}"}
+    item = requests.get(f"{backend_url}/api/v1/items", headers=headers, timeout=10).json()["items"][0]
+    response = requests.post(f"{backend_url}/api/v1/transactions", headers=headers, json={
+        "items": [{"item_id": item["id"], "qty": qty}],
+        "payment_method": "tunai",
+        "payment_amount": item["price"] * qty
+    }, timeout=10)
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+@pytest.fixture(scope="module")
+def shops(backend_url, fake_openai):
+    main = create_shop(backend_url, fake_openai, f"Kopi Pusat {uuid.uuid4().hex[:4]}")
+    branch = create_shop(backend_url, fake_openai, f"Kopi Cabang {uuid.uuid4().hex[:4]}")
+    return main, branch
+
+
+def auth(shop: dict) -> dict:
+    return {"Authorization": f"Bearer {shop['token']}"}
+
+
+class TestOutletLink:
+    """POST /v1/outlets/link"""
+
+    def test_wrong_password_is_400(self, backend_url, shops):
+        main, branch = shops
+        response = requests.post(f"{backend_url}/api/v1/outlets/link", headers=auth(main), json={
+            "email": branch["user"]["email"],
+            "password": "bukan-password"
+        }, timeout=10)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Email atau password pemilik toko lain salah"
+
+    def test_invited_owner_without_password_is_400(self, backend_url, shops):
+        main, branch = shops
+        # An invited account has no password hash yet; it must read as wrong credentials, not a 500
+        email = f"invited-{uuid.uuid4().hex[:10]}@test.com"
+        invite = requests.post(f"{backend_url}/api/v1/users/invite", headers=auth(branch), json={
+            "name": "Pemilik Baru", "email": email, "role": "pemilik"
+        }, timeout=10)
+        assert invite.status_code == 201, invite.text
+
+        for password in ("", "apa-saja"):
+            response = requests.post(f"{backend_url}/api/v1/outlets/link", headers=auth(main), json={
+                "email": email,
+                "password": password
+            }, timeout=10)
+            assert response.status_code == 400, response.text
+            assert response.json()["detail"] == "Email atau password pemilik toko lain salah"
+
+    def test_link_and_consolidated_totals(self, backend_url, shops):
+        main, branch = shops
+        main_sale = sell(backend_url, main["token"], 2)
+        branch_sale = sell(backend_url, branch["token"], 1)
+
+        response = requests.post(f"{backend_url}/api/v1/outlets/link", headers=auth(main), json={
+            "email": branch["user"]["email"],
+            "password": branch["user"]["temp_password"]
+        }, timeout=10)
+        assert response.status_code == 200, response.text
+        outlet_ids = {outlet["id"] for outlet in response.json()["outlets"]}
+        assert outlet_ids == {main["tenant"]["id"], branch["tenant"]["id"]}
+
+        response = requests.get(f"{backend_url}/api/v1/reports/consolidated", headers=auth(main), timeout=10)
+        assert response.status_code == 200, response.text
+        report = response.json()
+        by_outlet = {outlet["tenant_id"]: outlet["summary"] for outlet in report["outlets"]}
+        assert report["outlet_count"] == 2
+        assert by_outlet[main["tenant"]["id"]]["total_sales"] == main_sale["total"]
+        assert by_outlet[branch["tenant"]["id"]]["total_sales"] == branch_sale["total"]
+        assert report["consolidated"]["total_sales"] == main_sale["total"] + branch_sale["total"]
+        assert report["consolidated"]["total_transactions"] == 2
+
+        # A later sale in the linked outlet shows up in the consolidated totals
+        later = sell(backend_url, branch["token"], 1)
+        report = requests.get(f"{backend_url}/api/v1/reports/consolidated", headers=auth(main), timeout=10).json()
+        assert report["consolidated"]["total_sales"] == main_sale["total"] + branch_sale["total"] + later["total"]
+
+        # Outlets outside the group cannot be selected
+        response = requests.get(
+            f"{backend_url}/api/v1/reports/consolidated",
+            params={"tenant_ids": str(uuid.uuid4())},
+            headers=auth(main),
+            timeout=10
+        )
+        assert response.status_code == 403
@@ -425,13 +425,17 @@ class TestReports:
         })
         
         assert response.status_code == 200
-        data = response.json()
+        assert response.headers["content-type"].startswith("text/csv")
         
-        assert data["format"] == "csv"
-        assert "data" in data
-        assert "filename" in data
+        # Streamed as a file download, not wrapped in JSON
+        disposition = response.headers["content-disposition"]
+        assert disposition.startswith("attachment")
+        assert f"laporan_{week_ago}_to_{today}.csv" in disposition
+        
+        header = response.text.splitlines()[0]
+        assert header == "transaction_number,date,time,items,total,payment_method,status,cashier"
         
-        print(f"✓ CSV export successful: {data['filename']}")
+        print(f"✓ CSV export successful: {disposition}")
     
     def test_payment_breakdown_in_report(self, owner_token):
         """Test that payment breakdown shows different methods"""